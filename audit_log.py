@@ -0,0 +1,402 @@
+"""
+AUDIT LOG - NON-BLOCKING AUTHENTICATION AUDIT TRAIL
+Records every registration, login and password change off the request path
+
+attach() wraps the transaction methods of one system instance. After each
+call the wrapper only appends a small fixed-size tuple (time, event,
+username, outcome, token) to a bounded in-memory queue; a writer thread
+wakes every flush_interval seconds (or as soon as max_batch records are
+waiting), formats the whole batch and writes it with one write(). A
+successful login record carries the session token it issued; password
+change records carry the token they were made with and the user the
+token's session belonged to (looked up before the change, so the record
+stands on its own even if the login record was dropped or rotated out).
+Passwords are never recorded.
+
+Output is JSON lines or fixed-header binary records, in a file that is
+rotated to <path>.1 ... <path>.<backups> once it passes max_bytes.
+
+When the writer falls behind and the queue is full, policy decides:
+  block        - the transaction waits for space (nothing is lost)
+  drop_oldest  - the oldest queued record is discarded
+  drop_newest  - the new record is discarded
+Discarded records are counted in `dropped`. A batch the writer cannot
+encode or write is dropped too (counted, and the error kept in
+`last_error`); the writer carries on with the next batch, so a failing
+disk never leaves block-policy transactions waiting on a dead thread.
+
+Usage:
+    audit = AuditLog('audit.jsonl', policy='drop_oldest')
+    audit.attach(system)
+    ...
+    audit.close()
+
+    python audit_log.py bench [--ops 100000] [--format jsonl] [--policy block]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+from metrics import LatencyHistogram
+from modern_app import MESSAGES, UserManagementSystem
+
+POLICIES = ('block', 'drop_oldest', 'drop_newest')
+FORMATS = ('jsonl', 'binary')
+
+EVENTS = ('register', 'login', 'password_change')
+
+# Binary files: magic, then per record a header (time, token, event index,
+# outcome index in MESSAGES order, username byte length) and the UTF-8 name
+BINARY_MAGIC = b'UMSAUDT1'
+BINARY_RECORD = struct.Struct('<dIBBH')
+OUTCOMES = tuple(MESSAGES)
+
+# Records formatted per GIL hand-off by the writer
+ENCODE_CHUNK = 128
+
+
+def encode_jsonl(batch):
+    """JSON-lines bytes for a batch of queued records"""
+    return ''.join(
+        json.dumps({'time': stamp, 'event': event, 'user': ws_username, 'outcome': outcome,
+                    'token': token}, ensure_ascii=False, separators=(',', ':')) + '\n'
+        for stamp, event, ws_username, outcome, token in batch).encode('utf-8', 'surrogatepass')
+
+
+def encode_binary(batch):
+    """Binary record bytes for a batch of queued records"""
+    parts = []
+    for stamp, event, ws_username, outcome, token in batch:
+        name = ws_username.encode('utf-8', 'surrogatepass')[:0xFFFF]
+        if not isinstance(token, int) or not 0 <= token <= 0xFFFFFFFF:
+            token = 0
+        parts.append(BINARY_RECORD.pack(stamp, token, EVENTS.index(event),
+                                        OUTCOMES.index(outcome), len(name)) + name)
+    return b''.join(parts)
+
+
+def read_records(path):
+    """Yield the records of one audit file as dicts (either format)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(BINARY_MAGIC):
+        for line in data.decode('utf-8', 'surrogatepass').splitlines():
+            yield json.loads(line)
+        return
+    offset = len(BINARY_MAGIC)
+    while offset + BINARY_RECORD.size <= len(data):
+        stamp, token, event, outcome, length = BINARY_RECORD.unpack_from(data, offset)
+        offset += BINARY_RECORD.size + length
+        yield {'time': stamp, 'event': EVENTS[event],
+               'user': data[offset - length:offset].decode('utf-8', 'surrogatepass'),
+               'outcome': OUTCOMES[outcome], 'token': token}
+
+
+class AuditLog:
+    """Bounded audit queue drained to a rotating file by a writer thread
+
+    capacity is the queue bound in records, max_bytes the size at which
+    the file is rotated (None: never) and backups how many rotated files
+    are kept.
+    """
+
+    def __init__(self, path, fmt='jsonl', policy='block', capacity=65536, max_batch=4096,
+                 flush_interval=0.05, max_bytes=64 * 1024 * 1024, backups=5):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown audit format: {fmt!r}")
+        if policy not in POLICIES:
+            raise ValueError(f"unknown backpressure policy: {policy!r}")
+        self.path = path
+        self.fmt = fmt
+        self.policy = policy
+        self.capacity = capacity
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._encode = encode_binary if fmt == 'binary' else encode_jsonl
+
+        self._queue = deque(maxlen=capacity if policy == 'drop_oldest' else None)
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._busy = False
+        self._flush_wanted = False
+        self._closing = False
+        self._attached = []
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+        self.last_error = None
+        self._stopped = False
+
+        self._file = None
+        self._open()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def record(self, event, username, outcome, token=0):
+        """Queue one audit record; the hot-path cost of auditing"""
+        entry = (time.time(), event, username, outcome, token or 0)
+        with self._lock:
+            if self._closing:
+                return
+            if self._stopped:
+                self.dropped += 1    # no writer left to drain the queue
+                return
+            if len(self._queue) >= self.capacity:
+                if self.policy == 'block':
+                    self.blocked += 1
+                    self._work.notify()
+                    while (len(self._queue) >= self.capacity
+                           and not (self._closing or self._stopped)):
+                        self._space.wait()
+                    if self._stopped:
+                        self.dropped += 1
+                    if self._closing or self._stopped:
+                        return
+                else:
+                    self.dropped += 1
+                    if self.policy == 'drop_newest':
+                        return
+                    # drop_oldest: the bounded deque discards the head on append
+            self._queue.append(entry)
+            if len(self._queue) == self.max_batch:
+                self._work.notify()
+
+    def attach(self, system):
+        """Audit every register / login / password change of system from now on"""
+        wrappers = {
+            'register': self._audited_register,
+            'register_many': self._audited_register_many,
+            'login': self._audited_login,
+            'update_password': self._audited_update_password,
+        }
+        for operation, wrap in wrappers.items():
+            # Another wrapper (metrics, journal) if there is one, else None
+            original = vars(system).get(operation)
+            wrapper = wrap(system, getattr(system, operation))
+            setattr(system, operation, wrapper)
+            self._attached.append((system, operation, original, wrapper))
+
+    def _audited_register(self, system, method):
+        def audited(username, password):
+            result = method(username, password)
+            self.record('register', username, result.code)
+            return result
+        return audited
+
+    def _audited_register_many(self, system, method):
+        def audited(rows):
+            rows = list(rows)
+            results = method(rows)
+            for row, result in zip(rows, results):
+                self.record('register', row[0], result.code)
+            return results
+        return audited
+
+    def _audited_login(self, system, method):
+        def audited(username, password):
+            result = method(username, password)
+            self.record('login', username, result.code, result.token)
+            return result
+        return audited
+
+    def _audited_update_password(self, system, method):
+        def audited(token, old_password, new_password):
+            ws_username = system.session_user(token)
+            result = method(token, old_password, new_password)
+            self.record('password_change', ws_username, result.code, token)
+            return result
+        return audited
+
+    def flush(self):
+        """Block until every record queued so far is written"""
+        with self._lock:
+            self._flush_wanted = True
+            self._work.notify()
+            while (self._queue or self._busy) and not self._stopped:
+                self._idle.wait()
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+        if self.fmt == 'binary' and self._size == 0:
+            self._file.write(BINARY_MAGIC)
+            self._size = len(BINARY_MAGIC)
+
+    def _rotate(self):
+        """<path> becomes <path>.1, older backups shift up, the oldest is deleted"""
+        self._file.close()
+        for number in range(self.backups, 0, -1):
+            source = f"{self.path}.{number - 1}" if number > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number}")
+        if self.backups == 0:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+    def _write_loop(self):
+        try:
+            self._drain()
+        finally:
+            # Only reached on close() or a failure outside a batch; either
+            # way nobody may wait for this thread again
+            with self._lock:
+                self._stopped = True
+                self._busy = False
+                self._space.notify_all()
+                self._idle.notify_all()
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                full = len(self._queue) >= min(self.max_batch, self.capacity)
+                if not (self._closing or self._flush_wanted or full):
+                    self._work.wait(self.flush_interval)
+                self._flush_wanted = False
+                batch = list(self._queue)
+                self._queue.clear()
+                self._busy = bool(batch)
+                self._space.notify_all()
+                if not batch:
+                    self._idle.notify_all()
+                    if self._closing:
+                        return
+                    continue
+
+            try:
+                self._write_batch(batch)
+            except Exception as exc:
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = exc
+                    self.dropped += len(batch)
+                    self._busy = False
+                    self._idle.notify_all()
+                continue
+
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+                self._busy = False
+                self._idle.notify_all()
+
+    def _write_batch(self, batch):
+        parts = []
+        for start in range(0, len(batch), ENCODE_CHUNK):
+            parts.append(self._encode(batch[start:start + ENCODE_CHUNK]))
+            # Yield the GIL so a transaction never waits on a whole batch
+            time.sleep(0)
+        data = b''.join(parts)
+        if self._file.closed:
+            self._open()    # a failed rotation left no file open
+        if self.max_bytes is not None and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        """Write everything queued, stop the writer and unwrap the systems"""
+        for system, operation, original, wrapper in self._attached:
+            if vars(system).get(operation) is not wrapper:
+                continue    # wrapped again since; leave the chain alone
+            if original is None:
+                delattr(system, operation)
+            else:
+                setattr(system, operation, original)
+        self._attached = []
+        with self._lock:
+            self._closing = True
+            self._work.notify()
+            self._space.notify_all()
+        self._writer.join()
+        self._file.close()
+
+    def stats(self):
+        """Counters for monitoring the audit pipeline"""
+        with self._lock:
+            return {'queued': len(self._queue), 'written': self.written, 'dropped': self.dropped,
+                    'blocked': self.blocked, 'batches': self.batches,
+                    'rotations': self.rotations, 'errors': self.errors}
+
+
+def measure_overhead(ops=100000, users=1000, fmt='jsonl', policy='block', capacity=65536):
+    """Login latency without and with auditing; returns {'baseline'|'audited': summary}
+
+    Each run logs in ops times (every tenth with a wrong password) against
+    a fresh scaled-profile system of `users` users.
+    """
+    summaries = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for label in ('baseline', 'audited'):
+            system = UserManagementSystem(profile='scaled', max_sessions=max(ops, 1))
+            for i in range(users):
+                system.register(f'user{i}', 'pw')
+            audit = None
+            if label == 'audited':
+                audit = AuditLog(os.path.join(directory, f'audit.{fmt}'), fmt, policy, capacity)
+                audit.attach(system)
+            histogram = LatencyHistogram()
+            for i in range(ops):
+                password = 'wrong' if i % 10 == 9 else 'pw'
+                started = time.perf_counter()
+                system.login(f'user{i % users}', password)
+                histogram.record(time.perf_counter() - started)
+            summaries[label] = histogram.summary()
+            if audit is not None:
+                audit.close()
+                summaries['audit'] = audit.stats()
+    finally:
+        shutil.rmtree(directory, True)
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit log tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('bench', help="measure the login latency auditing adds")
+    bench.add_argument('--ops', type=int, default=100000)
+    bench.add_argument('--users', type=int, default=1000)
+    bench.add_argument('--format', choices=FORMATS, default='jsonl')
+    bench.add_argument('--policy', choices=POLICIES, default='block')
+    bench.add_argument('--capacity', type=int, default=65536, help="queue bound in records")
+    show = commands.add_parser('show', help="print an audit file as JSON lines")
+    show.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        for entry in read_records(args.path):
+            print(json.dumps(entry, ensure_ascii=False))
+        return 0
+
+    result = measure_overhead(args.ops, args.users, args.format, args.policy, args.capacity)
+    for label in ('baseline', 'audited'):
+        latency = result[label]
+        print(f"{label.upper():<9} LATENCY us: p50 {latency['p50_ms'] * 1e3:8.2f}  "
+              f"p99 {latency['p99_ms'] * 1e3:8.2f}  p99.9 {latency['p999_ms'] * 1e3:8.2f}")
+    added = (result['audited']['p99_ms'] - result['baseline']['p99_ms']) * 1e3
+    print(f"ADDED p99: {added:+.2f} us ({args.format}, {args.policy})")
+    audit = result['audit']
+    print(f"AUDIT: {audit['written']} WRITTEN IN {audit['batches']} BATCHES, "
+          f"{audit['dropped']} DROPPED, {audit['blocked']} BLOCKED")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
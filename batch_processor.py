@@ -0,0 +1,87 @@
+"""
+BATCH PROCESSOR - NIGHTLY TRANSACTION FILES
+Runs a transaction file through UserManagementSystem without a terminal
+
+The input file holds the same lines an operator would type at the menu
+(choice, then the answers to each prompt). Output is byte-identical to
+piping the file into `python modern_app.py`.
+
+Usage:
+    python batch_processor.py TRANSACTIONS [-o OUTPUT] [--storage compact]
+                               [--profile scaled] [--seed N]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from modern_app import PROFILES, MenuSession, UserManagementSystem
+
+
+def read_lines(stream):
+    """Yield input lines one at a time, newline removed (like input())"""
+    for line in stream:
+        if line.endswith('\n'):
+            line = line[:-1]
+        yield line
+
+
+def process_stream(system, lines, out, flush_every=4096):
+    """Feed input lines to the menu and write the screen output to out
+
+    Output is collected in memory and written in blocks covering
+    flush_every input lines. Returns the number of transactions applied.
+    """
+    session = MenuSession(system)
+    chunks = [session.start()]
+    try:
+        for line in lines:
+            chunks.append(session.feed(line))
+            if session.closed:
+                break
+            if len(chunks) >= flush_every:
+                out.write(''.join(chunks))
+                chunks.clear()
+    finally:
+        out.write(''.join(chunks))
+        out.flush()
+    return session.transactions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a transaction file to the user management system")
+    parser.add_argument('transactions', help="transaction file ('-' for stdin)")
+    parser.add_argument('-o', '--output', help="screen output file (default: stdout)")
+    parser.add_argument('--storage', default='dict', choices=['dict', 'compact'])
+    parser.add_argument('--profile', default='legacy', choices=sorted(PROFILES))
+    parser.add_argument('--seed', type=int, help="seed the token generator for repeatable runs")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    system = UserManagementSystem(storage=args.storage, profile=args.profile)
+
+    source = sys.stdin if args.transactions == '-' else open(args.transactions)
+    out = sys.stdout if args.output is None else open(args.output, 'w', buffering=1 << 20)
+    started = time.perf_counter()
+    try:
+        count = process_stream(system, read_lines(source), out)
+    except ValueError as e:
+        # Non-numeric session token: the interactive program stops here too
+        print(f"BATCH ABORTED: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"PROCESSED {count} TRANSACTIONS IN {elapsed:.3f}s ({rate:,.0f} TX/S)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
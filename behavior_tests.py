@@ -3,8 +3,51 @@ BEHAVIOR TESTS FOR USER MANAGEMENT SYSTEM
 Tests validate the exact functionality of the legacy COBOL application
 """
 
+import asyncio
+import io
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from modern_app import UserManagementSystem
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from unittest.mock import patch
+import audit_log
+import batch_processor
+import bulk_io
+import cobol_codec
+import columnar_storage
+import cow_storage
+import differential_test
+import journal
+import menu_loadtest
+import menu_server
+import modern_app
+import mapped_storage
+import password_hashing
+import run_benchmarks
+import sharded_app
+import snapshot
+import workload
+from metrics import LatencyHistogram, Metrics, PrometheusDumper
+from modern_app import MenuSession, UserManagementSystem
+from record_storage import SESSION_LAYOUT, USER_LAYOUT, RecordTable, RecordView
+from session_expiry import TimingWheel
+from token_allocator import TokenAllocator
+
+
+def run_interactive(method, *answers):
+    """Call an interactive method with canned input and return its output"""
+    output = io.StringIO()
+    with patch('builtins.input', side_effect=list(answers)), redirect_stdout(output):
+        method()
+    return output.getvalue()
 
 
 class TestUserManagementSystem(unittest.TestCase):
@@ -263,5 +306,1793 @@ class TestUserManagementSystem(unittest.TestCase):
         self.assertEqual(self.system.session_count, 50)
 
 
+class TestUserIndex(unittest.TestCase):
+    """Username index used by register, login and change password"""
+
+    def setUp(self):
+        self.system = UserManagementSystem()
+
+    def test_register_keeps_index_in_sync(self):
+        """Registered users are found without a table scan"""
+        for i in range(5):
+            run_interactive(self.system.register_user, f'user{i}', 'pw')
+        output = run_interactive(self.system.register_user, 'user3', 'other')
+
+        self.assertIn("ERROR: USERNAME ALREADY EXISTS!", output)
+        self.assertEqual(self.system._find_user('user3'), 3)
+        self.assertEqual(self.system.check_user_index(), [])
+
+    def test_index_follows_direct_table_writes(self):
+        """Rows written straight into user_table are picked up"""
+        self.system.user_table[0]['user_name'] = 'testuser'
+        self.system.user_table[0]['user_password'] = 'password123'
+        self.system.user_table[0]['user_active'] = 1
+        self.system.user_count = 1
+
+        output = run_interactive(self.system.login_user, 'testuser', 'password123')
+        self.assertIn("SUCCESS: LOGIN APPROVED", output)
+
+    def test_index_follows_renamed_rows(self):
+        """A name rewritten in an existing slot is found like the COBOL scan finds it"""
+        for storage, profile in (('dict', 'legacy'), ('dict', 'scaled'),
+                                 ('compact', 'legacy'), ('cow', 'legacy')):
+            system = UserManagementSystem(storage=storage, profile=profile)
+            system.register('alice', 'pw')
+            system.register('carol', 'pw')
+            self.assertTrue(system.login('alice', 'pw').ok)
+            system.user_table[0]['user_name'] = 'bob'
+
+            self.assertTrue(system.login('bob', 'pw').ok, storage)
+            self.assertEqual(system.login('alice', 'pw').code, modern_app.INVALID_CREDENTIALS)
+            self.assertEqual(system.register('alice', 'pw').code, modern_app.USER_REGISTERED)
+            self.assertEqual(system.check_user_index(), [])
+
+    def test_login_matches_first_valid_duplicate(self):
+        """Duplicate names behave like the COBOL first-match loop"""
+        for user_idx, password in enumerate(['first', 'second']):
+            self.system.user_table[user_idx]['user_name'] = 'dup'
+            self.system.user_table[user_idx]['user_password'] = password
+            self.system.user_table[user_idx]['user_active'] = 1
+        self.system.user_count = 2
+
+        output = run_interactive(self.system.login_user, 'dup', 'second')
+        self.assertIn("SUCCESS: LOGIN APPROVED", output)
+        self.assertEqual(self.system._find_user('dup'), 0)
+
+    def test_check_user_index_reports_stale_rows(self):
+        """Consistency checker spots rows changed behind the index"""
+        run_interactive(self.system.register_user, 'alice', 'pw')
+        self.system.user_table[0]['user_name'] = 'bob'
+
+        self.assertNotEqual(self.system.check_user_index(), [])
+        self.system.rebuild_user_index()
+        self.assertEqual(self.system.check_user_index(), [])
+
+
+class TestSessionTokens(unittest.TestCase):
+    """Token index and collision-free token allocation"""
+
+    def setUp(self):
+        self.system = UserManagementSystem()
+        run_interactive(self.system.register_user, 'testuser', 'oldpass')
+
+    def test_allocator_never_repeats_live_tokens(self):
+        """Every draw is unique until the space is exhausted"""
+        allocator = TokenAllocator(100000, 100999)
+        tokens = set()
+        for _ in range(1000):
+            token = allocator.draw()
+            self.assertTrue(allocator.claim(token))
+            tokens.add(token)
+
+        self.assertEqual(len(tokens), 1000)
+        self.assertTrue(all(100000 <= t <= 100999 for t in tokens))
+        self.assertRaises(RuntimeError, allocator.draw)
+
+        allocator.release(100500)
+        self.assertEqual(allocator.draw(), 100500)
+
+    def test_login_issues_distinct_tokens(self):
+        """Live sessions never share a token"""
+        for _ in range(50):
+            run_interactive(self.system.login_user, 'testuser', 'oldpass')
+        tokens = {self.system.session_table[i]['session_token'] for i in range(50)}
+
+        self.assertEqual(len(tokens), 50)
+        self.assertEqual(self.system.check_session_index(), [])
+
+    def test_change_password_uses_token_index(self):
+        """Sessions written directly into the table are found by token"""
+        self.system.session_table[0]['session_token'] = 123456
+        self.system.session_table[0]['session_user'] = 'testuser'
+        self.system.session_table[0]['session_active'] = 1
+        self.system.session_count = 1
+
+        output = run_interactive(self.system.change_password, '123456', 'oldpass', 'newpass')
+        self.assertIn("SUCCESS: PASSWORD CHANGED!", output)
+        self.assertTrue(self.system._tokens.is_live(123456))
+
+        output = run_interactive(self.system.change_password, '999999', 'newpass', 'x')
+        self.assertIn("ERROR: INVALID SESSION TOKEN!", output)
+
+    def test_token_rewritten_in_place_is_found(self):
+        """A live session's token overwritten directly resolves by its new value"""
+        old_token = self.system.login('testuser', 'oldpass').token
+        while old_token == 123456:
+            old_token = self.system.login('testuser', 'oldpass').token
+        sess_idx = self.system.session_count - 1
+        self.system.session_table[sess_idx]['session_token'] = 123456
+
+        result = self.system.update_password(123456, 'oldpass', 'newpass')
+        self.assertEqual(result.code, modern_app.PASSWORD_CHANGED)
+        self.assertEqual(self.system.check_session_index(), [])
+        self.assertEqual(self.system.update_password(old_token, 'newpass', 'x').code,
+                         modern_app.INVALID_SESSION_TOKEN)
+
+
+class TestHeadlessApi(unittest.TestCase):
+    """Transaction methods that take arguments and return results"""
+
+    def setUp(self):
+        self.system = UserManagementSystem()
+
+    def test_transactions_return_result_codes(self):
+        """Register, login and password change without any terminal I/O"""
+        self.assertEqual(self.system.register('alice', 'pw').code, modern_app.USER_REGISTERED)
+        self.assertEqual(self.system.register('alice', 'pw').code, modern_app.USERNAME_EXISTS)
+        self.assertEqual(self.system.login('alice', 'bad').code, modern_app.INVALID_CREDENTIALS)
+
+        result = self.system.login('alice', 'pw')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.token, self.system.session_table[0]['session_token'])
+
+        result = self.system.update_password(result.token, 'bad', 'new')
+        self.assertEqual(result.message, "ERROR: OLD PASSWORD INCORRECT!")
+        result = self.system.update_password(123, 'pw', 'new')
+        self.assertEqual(result.code, modern_app.INVALID_SESSION_TOKEN)
+
+    def test_limits_return_legacy_messages(self):
+        """Full tables are reported with the legacy error text"""
+        for i in range(100):
+            self.system.register(f'user{i}', 'pw')
+        self.assertEqual(self.system.register('extra', 'pw').message,
+                         "ERROR: USER DATABASE FULL!")
+        for _ in range(50):
+            self.system.login('user0', 'pw')
+        self.assertEqual(self.system.login('user0', 'pw').message,
+                         "ERROR: SESSION TABLE FULL!")
+
+    def test_console_adapter_prints_legacy_screen(self):
+        """Interactive methods still produce the exact legacy text"""
+        output = run_interactive(self.system.register_user, 'alice', 'pw')
+        self.assertEqual(output, "--- USER REGISTRATION ---\nSUCCESS: USER REGISTERED!\n")
+
+        output = run_interactive(self.system.login_user, 'alice', 'pw')
+        token = self.system.session_table[0]['session_token']
+        self.assertEqual(output, "--- USER LOGIN ---\nSUCCESS: LOGIN APPROVED\n"
+                                 f"YOUR SESSION TOKEN: {token}\n")
+
+
+class TestBatchProcessor(unittest.TestCase):
+    """Batch transaction files reproduce the interactive screen output"""
+
+    TRANSACTIONS = [
+        '1', 'alice', 'secret',
+        '1', 'alice', 'again',
+        '2', 'alice', 'wrong',
+        '2', 'alice', 'secret',
+        '3', '123', 'secret', 'x',
+        '9',
+        '1', 'bob', 'pw',
+        '2', 'bob', 'pw',
+        '4',
+        '1', 'ignored', 'after exit',
+    ]
+
+    def run_console(self, lines):
+        """Output of run() with lines piped to stdin"""
+        random.seed(7)
+        output = io.StringIO()
+        with patch.object(sys, 'stdin', io.StringIO('\n'.join(lines) + '\n')), \
+                redirect_stdout(output):
+            try:
+                UserManagementSystem().run()
+            except (EOFError, ValueError):
+                pass
+        return output.getvalue()
+
+    def run_batch(self, lines, flush_every=4096):
+        """Output of the batch processor for the same lines"""
+        random.seed(7)
+        output = io.StringIO()
+        try:
+            batch_processor.process_stream(
+                UserManagementSystem(),
+                batch_processor.read_lines(io.StringIO('\n'.join(lines) + '\n')),
+                output, flush_every=flush_every)
+        except ValueError:
+            pass
+        return output.getvalue()
+
+    def test_output_matches_interactive_menu(self):
+        """Same bytes as piping the file into the interactive program"""
+        expected = self.run_console(self.TRANSACTIONS)
+        self.assertIn("YOUR SESSION TOKEN: ", expected)
+        self.assertEqual(self.run_batch(self.TRANSACTIONS), expected)
+        self.assertEqual(self.run_batch(self.TRANSACTIONS, flush_every=1), expected)
+
+    def test_output_matches_when_input_stops_early(self):
+        """Missing EXIT or a bad token stops at the same point"""
+        for lines in (self.TRANSACTIONS[:8], ['1', 'a', 'b', '3', 'abc', 'x', 'y']):
+            self.assertEqual(self.run_batch(lines), self.run_console(lines))
+
+
+class TestCapacityProfiles(unittest.TestCase):
+    """Legacy fixed arrays versus tables that grow on demand"""
+
+    def test_legacy_profile_keeps_cobol_limits(self):
+        """Legacy profile preallocates 100 users and 50 sessions"""
+        system = UserManagementSystem(profile='legacy')
+        self.assertEqual((len(system.user_table), len(system.session_table)), (100, 50))
+        self.assertEqual((system.max_users, system.max_sessions), (100, 50))
+
+    def test_scaled_profile_grows_tables(self):
+        """Scaled tables start empty and grow one row per registration"""
+        for storage in ('dict', 'compact'):
+            system = UserManagementSystem(storage=storage, profile='scaled')
+            self.assertEqual(len(system.user_table), 0)
+            for i in range(1000):
+                self.assertTrue(system.register(f'user{i}', 'pw').ok)
+            self.assertEqual(len(system.user_table), 1000)
+            self.assertEqual(system.user_table[999]['user_name'], 'user999')
+
+            token = system.login('user500', 'pw').token
+            self.assertEqual(len(system.session_table), 1)
+            self.assertTrue(system.update_password(token, 'pw', 'new').ok)
+
+    def test_scaled_limits_use_legacy_messages(self):
+        """Configured limits are enforced with the legacy error text"""
+        system = UserManagementSystem(profile='scaled', max_users=3, max_sessions=2)
+        for i in range(3):
+            system.register(f'user{i}', 'pw')
+        self.assertEqual(system.register('user3', 'pw').message, "ERROR: USER DATABASE FULL!")
+        system.login('user0', 'pw')
+        system.login('user1', 'pw')
+        self.assertEqual(system.login('user2', 'pw').message, "ERROR: SESSION TABLE FULL!")
+
+    def test_rejects_unknown_profile_and_oversized_session_limit(self):
+        """Bad configuration fails at construction time"""
+        self.assertRaises(ValueError, UserManagementSystem, profile='huge')
+        self.assertRaises(ValueError, UserManagementSystem, profile='scaled',
+                          max_sessions=1_000_000)
+
+
+class FakeClock:
+    """Manually advanced clock for expiry tests"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionExpiry(unittest.TestCase):
+    """Session TTL, timing wheel reaping and slot reuse"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.system = UserManagementSystem(session_ttl=60, clock=self.clock)
+        self.system.register('alice', 'pw')
+
+    def test_timing_wheel_fires_on_time(self):
+        """Entries fire at their deadline, never early, across all levels"""
+        rng = random.Random(3)
+        wheel = TimingWheel(tick=1.0, slots=8, levels=2)
+        deadlines = {i: rng.uniform(0, 200) for i in range(500)}
+        for item, deadline in deadlines.items():
+            wheel.schedule(deadline, item)
+
+        fired = {}
+        now = 0.0
+        while len(fired) < len(deadlines):
+            now += 0.5
+            for item in wheel.advance(now):
+                fired[item] = now
+        for item, deadline in deadlines.items():
+            self.assertGreaterEqual(fired[item], deadline)
+            self.assertLessEqual(fired[item], deadline + 1.0)
+        self.assertEqual(len(wheel), 0)
+
+    def test_expired_session_is_rejected(self):
+        """A token stops working once its TTL has passed"""
+        token = self.system.login('alice', 'pw').token
+        self.clock.now += 59
+        self.assertTrue(self.system.update_password(token, 'pw', 'pw2').ok)
+        self.clock.now += 2
+        self.assertEqual(self.system.update_password(token, 'pw2', 'pw3').code,
+                         modern_app.INVALID_SESSION_TOKEN)
+        self.assertEqual(self.system.session_table[0]['session_active'], 0)
+
+    def test_slots_are_reused_after_expiry(self):
+        """Unlimited logins over time within the 50-slot table"""
+        for _ in range(20):
+            for _ in range(50):
+                self.assertTrue(self.system.login('alice', 'pw').ok)
+            self.assertEqual(self.system.login('alice', 'pw').code, modern_app.SESSION_TABLE_FULL)
+            self.clock.now += 61
+
+        self.assertEqual(self.system.session_count, 50)
+        self.assertEqual(self.system.check_session_index(), [])
+
+    def test_legacy_sessions_never_expire(self):
+        """Without a TTL the session table fills up for good"""
+        system = UserManagementSystem(clock=self.clock)
+        system.register('alice', 'pw')
+        for _ in range(50):
+            system.login('alice', 'pw')
+        self.clock.now += 10 ** 6
+        self.assertEqual(system.expire_sessions(), 0)
+        self.assertEqual(system.login('alice', 'pw').code, modern_app.SESSION_TABLE_FULL)
+
+
+class TestUserSessions(unittest.TestCase):
+    """Per-user session index: listing, revoking and the per-user cap"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.system = UserManagementSystem(clock=self.clock)
+        for name in ('alice', 'bob'):
+            self.system.register(name, 'pw')
+
+    def test_list_and_revoke_sessions(self):
+        """A user's sessions are listed and revoked without touching anyone else's"""
+        alice = [self.system.login('alice', 'pw').token for _ in range(3)]
+        bob = self.system.login('bob', 'pw').token
+        self.assertEqual(self.system.list_sessions('alice'), alice)
+        self.assertEqual(self.system.list_sessions('nobody'), [])
+
+        self.assertEqual(self.system.deactivate_user_sessions('alice'), 3)
+        self.assertEqual(self.system.list_sessions('alice'), [])
+        self.assertEqual(self.system.list_sessions('bob'), [bob])
+        self.assertTrue(self.system.update_password(bob, 'pw', 'new').ok)
+        self.assertEqual(self.system.check_session_index(), [])
+
+    def test_index_follows_expiry_and_direct_writes(self):
+        """Expired sessions leave the index; direct table writes are picked up"""
+        system = UserManagementSystem(session_ttl=60, clock=self.clock)
+        system.register('alice', 'pw')
+        first = system.login('alice', 'pw').token
+        self.clock.now += 30
+        second = system.login('alice', 'pw').token
+        self.clock.now += 31
+        system.expire_sessions()
+        self.assertEqual(system.list_sessions('alice'), [second])
+
+        system.session_table[1]['session_user'] = 'bob'
+        self.assertEqual(system.list_sessions('alice'), [])
+        self.assertEqual(system.list_sessions('bob'), [second])
+        self.assertNotEqual(first, second)
+        self.assertEqual(system.check_session_index(), [])
+
+    def test_per_user_session_cap(self):
+        """One account cannot fill the session table past its cap"""
+        system = UserManagementSystem(max_sessions_per_user=5)
+        system.register('noisy', 'pw')
+        system.register('quiet', 'pw')
+        for _ in range(5):
+            self.assertTrue(system.login('noisy', 'pw').ok)
+        result = system.login('noisy', 'pw')
+        self.assertEqual(result.code, modern_app.SESSION_LIMIT_REACHED)
+        self.assertEqual(result.screen_lines(), ["ERROR: USER SESSION LIMIT REACHED!"])
+        self.assertTrue(system.login('quiet', 'pw').ok)
+
+        # Revoking frees both the user's quota and the table slots
+        system.deactivate_user_sessions('noisy')
+        self.assertTrue(system.login('noisy', 'pw').ok)
+        self.assertEqual(system.session_count, 6)
+
+    def test_no_cap_by_default(self):
+        """Without a cap one user may take every slot, as in the legacy program"""
+        for _ in range(50):
+            self.assertTrue(self.system.login('alice', 'pw').ok)
+        self.assertEqual(self.system.login('bob', 'pw').code, modern_app.SESSION_TABLE_FULL)
+
+
+class TestMenuServer(unittest.TestCase):
+    """Asyncio front end speaking the interactive menu protocol"""
+
+    async def converse(self, lines):
+        """Send lines to a fresh server; returns everything it wrote back"""
+        server = await menu_server.start_server(UserManagementSystem(), port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(''.join(line + '\r\n' for line in lines).encode())
+            output = await reader.read()
+            writer.close()
+        return output.decode()
+
+    def test_server_sends_legacy_screens(self):
+        """A connection sees the same text as the piped console program"""
+        lines = ['1', 'alice', 'pw', '1', 'alice', 'pw', '2', 'alice', 'bad', '7', '4']
+        output = asyncio.run(self.converse(lines))
+
+        session = MenuSession(UserManagementSystem())
+        expected = session.start() + ''.join(session.feed(line) for line in lines)
+        self.assertEqual(output, expected)
+
+    def test_concurrent_terminals_share_one_system(self):
+        """Many connections drive one system without errors"""
+        report = asyncio.run(menu_loadtest.run_spawned(connections=50, ops=3))
+        self.assertEqual(report['connections_held'], 50)
+        self.assertEqual(report['operations'], 50 * 7)
+        self.assertEqual(report['operation_errors'], 0)
+        self.assertGreater(report['p99_ms'], 0)
+
+
+class TestThreadSafety(unittest.TestCase):
+    """Concurrent transactions in thread-safe mode"""
+
+    THREADS = 8
+
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)    # force frequent thread switches
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_concurrent_logins_lose_no_updates(self):
+        """Every login gets its own slot and token; counts stay exact"""
+        system = UserManagementSystem(profile='scaled', thread_safe=True)
+        users = [f'user{i}' for i in range(400)]
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            # Each name is registered twice; exactly one attempt may win
+            results = list(pool.map(lambda name: system.register(name, 'pw'), users * 2))
+            tokens = list(pool.map(lambda name: system.login(name, 'pw').token, users * 5))
+
+        self.assertEqual(sum(r.ok for r in results), len(users))
+        self.assertEqual(system.user_count, len(users))
+        self.assertEqual(system.session_count, len(users) * 5)
+        self.assertEqual(len(set(tokens)), len(tokens))
+        self.assertNotIn(None, tokens)
+        self.assertEqual(system.check_user_index(), [])
+        self.assertEqual(system.check_session_index(), [])
+
+    def test_concurrent_password_changes_apply_once(self):
+        """Racing changes from one old password: exactly one succeeds"""
+        system = UserManagementSystem(profile='scaled', thread_safe=True)
+        system.register('alice', 'old')
+        tokens = [system.login('alice', 'old').token for _ in range(40)]
+        with ThreadPoolExecutor(self.THREADS) as pool:
+            results = list(pool.map(
+                lambda i: system.update_password(tokens[i], 'old', f'new{i}'), range(40)))
+
+        winners = [i for i, result in enumerate(results) if result.ok]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(system.user_table[0]['user_password'], f'new{winners[0]}')
+
+    def test_slot_reuse_under_expiry(self):
+        """Expiry and reuse from many threads never double-books a slot"""
+        clock = FakeClock()
+        system = UserManagementSystem(session_ttl=10, clock=clock, thread_safe=True)
+        system.register('alice', 'pw')
+        for _ in range(5):
+            with ThreadPoolExecutor(self.THREADS) as pool:
+                results = list(pool.map(lambda _: system.login('alice', 'pw'), range(80)))
+            self.assertEqual(sum(r.ok for r in results), 50)
+            active = [system.session_table[i]['session_token'] for i in range(50)]
+            self.assertEqual(len(set(active)), 50)
+            clock.now += 11
+        self.assertEqual(system.check_session_index(), [])
+
+
+class TestShardedDeployment(unittest.TestCase):
+    """Users partitioned across worker processes"""
+
+    def test_shard_tokens_encode_their_shard(self):
+        """A shard's allocator only issues tokens congruent to the shard"""
+        allocator = sharded_app.shard_tokens(2, 3)
+        tokens = set()
+        for _ in range(500):
+            token = allocator.draw()
+            allocator.claim(token)
+            tokens.add(token)
+        self.assertEqual(len(tokens), 500)
+        self.assertTrue(all(t % 3 == 2 and 100000 <= t <= 999999 for t in tokens))
+        self.assertEqual(allocator.size, 300000)
+        self.assertFalse(allocator.claim(100002))    # belongs to shard 0
+
+    def test_router_dispatches_to_owning_shard(self):
+        """Register, login and change password through the router"""
+        with sharded_app.ShardedUserManagementSystem(3, profile='scaled') as system:
+            names = [f'user{i}' for i in range(30)]
+            results = system.submit_batch([('register', (name, 'pw')) for name in names])
+            self.assertTrue(all(result.ok for result in results))
+            self.assertEqual(system.register('user7', 'x').code, modern_app.USERNAME_EXISTS)
+
+            for name in names[:6]:
+                token = system.login(name, 'pw').token
+                self.assertEqual(system.shard_for_token(token), system.shard_for_user(name))
+                self.assertTrue(system.update_password(token, 'pw', 'new').ok)
+                self.assertEqual(system.login(name, 'pw').code, modern_app.INVALID_CREDENTIALS)
+            self.assertEqual(system.update_password(999999, 'new', 'x').code,
+                             modern_app.INVALID_SESSION_TOKEN)
+
+
+class TestPasswordHashing(unittest.TestCase):
+    """Salted KDF storage with a verified-credential cache"""
+
+    def setUp(self):
+        self.hasher = password_hashing.PasswordHasher(iterations=1000)
+        self.cache = password_hashing.CredentialCache(max_entries=2)
+        self.system = UserManagementSystem(password_hasher=self.hasher,
+                                           credential_cache=self.cache)
+
+    def test_passwords_are_stored_hashed(self):
+        """Rows hold salted hashes; logins and changes still work"""
+        self.system.register('alice', 'secret')
+        stored = self.system.user_table[0]['user_password']
+        self.assertTrue(stored.startswith('pbkdf2_sha256$1000$'))
+        self.assertNotIn('secret', stored)
+
+        token = self.system.login('alice', 'secret').token
+        self.assertEqual(self.system.login('alice', 'wrong').code, modern_app.INVALID_CREDENTIALS)
+        self.assertTrue(self.system.update_password(token, 'secret', 'better').ok)
+        self.assertTrue(self.system.login('alice', 'better').ok)
+
+    def test_scrypt_hashes_verify(self):
+        """scrypt is available as the alternative KDF"""
+        hasher = password_hashing.PasswordHasher('scrypt', n=2 ** 10)
+        stored = hasher.hash('pw')
+        self.assertTrue(stored.startswith('scrypt$1024$8$1$'))
+        self.assertTrue(hasher.verify(stored, 'pw'))
+        self.assertFalse(hasher.verify(stored, 'pw2'))
+
+    def test_repeat_logins_hit_the_cache(self):
+        """Only the first login pays for the KDF; a change invalidates it"""
+        self.system.register('alice', 'secret')
+        with patch.object(self.hasher, 'verify', wraps=self.hasher.verify) as verify:
+            for _ in range(5):
+                self.assertTrue(self.system.login('alice', 'secret').ok)
+            self.assertEqual(verify.call_count, 1)
+            self.assertEqual(self.cache.hits, 4)
+
+            token = self.system.session_table[0]['session_token']
+            self.system.update_password(token, 'secret', 'new')
+            self.assertEqual(self.system.login('alice', 'secret').code,
+                             modern_app.INVALID_CREDENTIALS)
+
+    def test_cache_is_bounded(self):
+        """Least recently used entries are evicted"""
+        for name in ('a', 'b', 'c'):
+            self.cache.remember(name, 'pw', 'stored')
+        self.assertEqual(len(self.cache), 2)
+        self.assertFalse(self.cache.check('a', 'pw', 'stored'))
+        self.assertTrue(self.cache.check('c', 'pw', 'stored'))
+
+    def test_bulk_migration_of_plaintext_rows(self):
+        """Existing plaintext rows are hashed in one pass"""
+        for i in range(3):
+            self.system.user_table[i]['user_name'] = f'user{i}'
+            self.system.user_table[i]['user_password'] = f'pw{i}'
+            self.system.user_table[i]['user_active'] = 1
+        self.system.user_count = 3
+
+        self.assertEqual(self.system.hash_plaintext_passwords(), 3)
+        self.assertTrue(all(password_hashing.is_hashed(self.system.user_table[i]['user_password'])
+                            for i in range(3)))
+        self.assertTrue(self.system.login('user2', 'pw2').ok)
+        self.assertEqual(self.system.hash_plaintext_passwords(), 0)
+
+    def test_compact_storage_is_rejected(self):
+        """Hashes do not fit PIC X(20)"""
+        self.assertRaises(ValueError, UserManagementSystem, storage='compact',
+                          password_hasher=self.hasher)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """Microbenchmark report and baseline comparison"""
+
+    def test_report_covers_every_operation_and_size(self):
+        """Each benchmark reports median, p95 and ops/sec per size"""
+        report = run_benchmarks.run_suite(sizes=[10, 50], ops=20, repeats=3, warmup=1)
+        self.assertEqual(set(report['results']),
+                         {f"{name}[{size}]" for name in run_benchmarks.BENCHMARKS
+                          for size in (10, 50)})
+        for stats in report['results'].values():
+            self.assertGreater(stats['ops_per_sec'], 0)
+            self.assertLessEqual(stats['median_us'], stats['p95_us'])
+
+    def test_slowdowns_beyond_threshold_are_regressions(self):
+        """Only medians slower than the threshold are flagged"""
+        baseline = {'results': {'login_user[10]': {'median_us': 10.0},
+                                'register_user[10]': {'median_us': 10.0}}}
+        report = {'results': {'login_user[10]': {'median_us': 12.0},
+                              'register_user[10]': {'median_us': 10.5},
+                              'generate_token[10]': {'median_us': 99.0}}}
+        regressions = run_benchmarks.find_regressions(report, baseline, 0.15)
+        self.assertEqual([key for key, *_ in regressions], ['login_user[10]'])
+
+
+class TestWorkload(unittest.TestCase):
+    """Synthetic workload generator and load driver"""
+
+    def test_same_seed_gives_same_stream(self):
+        """Streams are reproducible from the seed"""
+        first = list(workload.generate_operations(users=50, ops=500, seed=7))
+        self.assertEqual(first, list(workload.generate_operations(users=50, ops=500, seed=7)))
+        self.assertNotEqual(first, list(workload.generate_operations(users=50, ops=500, seed=8)))
+
+    def test_mix_and_zipf_skew(self):
+        """Operation mix follows the weights; low ranks dominate the usernames"""
+        operations = list(workload.generate_operations(users=1000, ops=20000, mix=(0, 1, 0),
+                                                       zipf=1.2, bad_password=0.0, seed=1))
+        self.assertEqual({kind for kind, *_ in operations}, {'login'})
+        top = sum(1 for _, name, *_ in operations if name == 'user0')
+        tail = sum(1 for _, name, *_ in operations if name == 'user999')
+        self.assertGreater(top, 50 * max(tail, 1))
+
+    def test_histogram_percentiles_are_within_bucket_error(self):
+        """Log-linear buckets keep percentiles within 1%"""
+        histogram = LatencyHistogram()
+        for micros in range(1, 10001):
+            histogram.record(micros / 1e6)
+        self.assertAlmostEqual(histogram.percentile(50), 0.005, delta=0.005 * 0.01)
+        self.assertAlmostEqual(histogram.percentile(99), 0.0099, delta=0.0099 * 0.01)
+        self.assertEqual(histogram.percentile(100), 0.01)
+
+    def test_closed_loop_counts_capacity_hits_separately(self):
+        """Legacy limits show up as capacity hits, not just outcomes"""
+        system = UserManagementSystem(thread_safe=True)
+        report = workload.LoadReport()
+        operations = workload.generate_operations(users=300, ops=2000, zipf=0.5, seed=3)
+        workload.LoadDriver(system, report).run_closed(operations, clients=3)
+        result = report.to_dict()
+        self.assertEqual(result['operations'], 2000)
+        self.assertEqual(sum(result['outcomes'].values()), 2000)
+        self.assertGreater(result['capacity_hits']["ERROR: USER DATABASE FULL!"], 0)
+        self.assertGreater(result['capacity_hits']["ERROR: SESSION TABLE FULL!"], 0)
+        self.assertEqual(result['capacity_hits']["ERROR: SESSION TABLE FULL!"],
+                         result['outcomes']["ERROR: SESSION TABLE FULL!"])
+        self.assertTrue(result['throughput_timeline'])
+
+    def test_open_loop_runs_every_operation(self):
+        """Open-loop arrivals are all served and timed"""
+        system = UserManagementSystem(profile='scaled', thread_safe=True)
+        workload.preregister(system, 100)
+        report = workload.LoadReport()
+        operations = workload.generate_operations(users=100, ops=300, invalid_token=1.0, seed=5)
+        workload.LoadDriver(system, report).run_open(operations, rate=20000, workers=2)
+        result = report.to_dict()
+        self.assertEqual(result['latency']['count'], 300)
+        self.assertNotIn("ERROR: SESSION TABLE FULL!", result['outcomes'])
+        self.assertNotIn("SUCCESS: PASSWORD CHANGED!", result['outcomes'])
+
+
+class TestMetrics(unittest.TestCase):
+    """Opt-in instrumentation and Prometheus export"""
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.system = UserManagementSystem(metrics=self.metrics)
+
+    def test_disabled_by_default(self):
+        """Without metrics the transaction methods are not wrapped"""
+        plain = UserManagementSystem()
+        self.assertEqual(plain.register.__func__, UserManagementSystem.register)
+        self.assertNotEqual(self.system.register, UserManagementSystem.register)
+
+    def test_counts_calls_outcomes_and_latency(self):
+        """Per-operation calls, outcomes by legacy message and latency"""
+        self.system.register('alice', 'pw')
+        self.system.register('alice', 'pw')
+        token = self.system.login('alice', 'pw').token
+        self.system.login('alice', 'bad')
+        self.system.update_password(token, 'pw', 'new')
+        run_interactive(self.system.register_user, 'bob', 'pw')
+
+        snapshot = self.metrics.to_dict()
+        self.assertEqual(snapshot['calls'], {'register': 3, 'login': 2, 'update_password': 1})
+        self.assertEqual(snapshot['outcomes']['register'],
+                         {"SUCCESS: USER REGISTERED!": 2, "ERROR: USERNAME ALREADY EXISTS!": 1})
+        self.assertEqual(snapshot['outcomes']['login']["ERROR: INVALID CREDENTIALS!"], 1)
+        self.assertEqual(snapshot['latency']['login']['count'], 2)
+        self.assertGreater(snapshot['latency']['register']['max_ms'], 0)
+
+    def test_counts_rows_examined(self):
+        """Index probes count one row each; rebuilds and scans count the whole table"""
+        for i in range(5):
+            self.system.register(f'user{i}', 'pw')
+        self.system.user_table[4]['user_name'] = 'renamed'   # forces a rebuild
+        self.system.login('user3', 'pw')
+        self.system.login('nobody', 'pw')
+        self.system.count_active_users()
+        scans = self.metrics.to_dict()['scans']
+        self.assertEqual(scans['user_index_rebuild']['rows_examined'], 5)
+        self.assertEqual(scans['user_lookup']['lookups'], 7)
+        self.assertEqual(scans['user_lookup']['mean_rows'], 1)
+        self.assertEqual(scans['active_user_count']['rows_examined'], 5)
+
+    def test_prometheus_file(self):
+        """Text format with counters and a cumulative histogram, written atomically"""
+        self.system.register('alice', 'pw')
+        self.system.login('alice', 'pw')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ums.prom')
+            with PrometheusDumper(self.metrics, path, interval=60):
+                pass
+            with open(path) as f:
+                text = f.read()
+            self.assertEqual(os.listdir(tmp), ['ums.prom'])
+        self.assertIn('# TYPE ums_operation_latency_seconds histogram', text)
+        self.assertIn('ums_operations_total{operation="login",'
+                      'outcome="SUCCESS: LOGIN APPROVED"} 1', text)
+        self.assertIn('ums_operation_latency_seconds_bucket{operation="register",le="+Inf"} 1', text)
+        self.assertIn('ums_operation_latency_seconds_count{operation="login"} 1', text)
+
+
+class TestCompactStorage(TestUserManagementSystem):
+    """Legacy behavior tests re-run against fixed-width record storage"""
+
+    def setUp(self):
+        self.system = UserManagementSystem(storage='compact')
+
+    def test_rows_are_views_into_one_buffer(self):
+        """Rows are dict-like views over USER-ENTRY/SESSION-ENTRY bytes"""
+        row = self.system.user_table[0]
+        self.assertIsInstance(row, RecordView)
+        self.assertIn('user_name', row)
+        self.assertEqual(len(self.system.user_table.buffer), 100 * 41)
+        self.assertEqual(len(self.system.session_table.buffer), 50 * 27)
+
+        row['user_name'] = 'bob'
+        row['user_active'] = 1
+        self.assertEqual(bytes(self.system.user_table.record_bytes(0)),
+                         b'bob'.ljust(40) + b'1')
+
+    def test_fields_are_padded_and_truncated(self):
+        """PIC X(20) truncation applies to input, like COBOL ACCEPT"""
+        long_name = 'a' * 25
+        run_interactive(self.system.register_user, long_name, 'pw')
+        self.assertEqual(self.system.user_table[0]['user_name'], 'a' * 20)
+
+        output = run_interactive(self.system.login_user, 'a' * 20 + 'zzz', 'pw  ')
+        self.assertIn("SUCCESS: LOGIN APPROVED", output)
+        token = self.system.session_table[0]['session_token']
+        self.assertIn(f"YOUR SESSION TOKEN: {token}", output)
+
+
+class TestColumnarStorage(TestUserManagementSystem):
+    """Legacy behavior tests re-run against NumPy column tables"""
+
+    def setUp(self):
+        self.system = UserManagementSystem(storage='columnar')
+
+    @unittest.skipIf(columnar_storage.numpy is None, "NumPy is not installed")
+    def test_rows_are_views_into_columns(self):
+        """Rows read and write through to one array per field"""
+        table = self.system.user_table
+        self.assertIsInstance(table, columnar_storage.ColumnTable)
+        self.assertIsInstance(table[0], columnar_storage.ColumnView)
+        self.assertEqual(table.columns['user_name'].dtype.str, '|S20')
+        table[0]['user_name'] = 'b' * 25
+        table[0]['user_active'] = 1
+        self.assertEqual(table.columns['user_name'][0], b'b' * 20)
+        self.assertEqual(dict(table[0]), {'user_name': 'b' * 20, 'user_password': '',
+                                          'user_active': 1})
+
+    def test_falls_back_without_numpy(self):
+        """Without NumPy the columnar backend is compact record storage"""
+        with patch.object(columnar_storage, 'numpy', None):
+            system = UserManagementSystem(storage='columnar')
+        self.assertIsInstance(system.user_table, RecordTable)
+        self.assertEqual(system.register('alice', 'pw').code, modern_app.USER_REGISTERED)
+
+    def test_bulk_session_operations(self):
+        """Active-session listing, per-user deactivation and counts agree on every backend"""
+        for storage in ('dict', 'compact', 'columnar'):
+            with self.subTest(storage=storage):
+                system = UserManagementSystem(storage=storage, profile='scaled')
+                for name in ('alice', 'bob', 'carol'):
+                    system.register(name, 'pw')
+                system.user_table[2]['user_active'] = 0
+                tokens = [system.login(name, 'pw').token for name in ('alice', 'bob', 'alice')]
+                self.assertEqual(system.count_active_users(), 2)
+                self.assertEqual(system.active_sessions(),
+                                 list(zip(tokens, ['alice', 'bob', 'alice'])))
+
+                events = []
+                system.add_listener(lambda event, *details: events.append((event,) + details))
+                self.assertEqual(system.deactivate_user_sessions('alice'), 2)
+                self.assertEqual(events, [('session_ended', 0, tokens[0]),
+                                          ('session_ended', 2, tokens[2])])
+                self.assertEqual(system.active_sessions(), [(tokens[1], 'bob')])
+                self.assertEqual(system.update_password(tokens[0], 'pw', 'x').code,
+                                 modern_app.INVALID_SESSION_TOKEN)
+                self.assertEqual(system.deactivate_user_sessions('alice'), 0)
+
+                # Ended slots are reused before the table grows
+                system.login('bob', 'pw')
+                self.assertEqual(system.session_count, 3)
+                self.assertEqual(system.check_session_index(), [])
+
+    def test_load_records_by_column(self):
+        """Raw records load into the columns and are indexed on the next lookup"""
+        users = RecordTable(USER_LAYOUT, 0)
+        sessions = RecordTable(SESSION_LAYOUT, 0)
+        users.append({'user_name': 'alice', 'user_password': 'pw', 'user_active': 1})
+        sessions.append({'session_token': 123456, 'session_user': 'alice', 'session_active': 1})
+        system = UserManagementSystem(storage='columnar', profile='scaled')
+        self.assertEqual(system.load_records(bytes(users.buffer), bytes(sessions.buffer)), (1, 1))
+        self.assertEqual(dict(system.user_table[0]), {'user_name': 'alice', 'user_password': 'pw',
+                                                      'user_active': 1})
+        self.assertEqual(system.update_password(123456, 'pw', 'new').code,
+                         modern_app.PASSWORD_CHANGED)
+        self.assertEqual(system.register('alice', 'x').code, modern_app.USERNAME_EXISTS)
+
+
+class TestMappedStorage(TestUserManagementSystem):
+    """Legacy behavior tests re-run against the memory-mapped data file"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'ums.dat')
+        self.system = UserManagementSystem(storage='mapped', data_file=self.path)
+
+    def tearDown(self):
+        self.system.close()
+        self.tmp.cleanup()
+
+    def reopen(self, **kwargs):
+        self.system.close()
+        self.system = UserManagementSystem(storage='mapped', data_file=self.path, **kwargs)
+        return self.system
+
+    def test_tables_survive_restart(self):
+        """Users, sessions and password changes are still there after reopening"""
+        self.system.register('alice', 'pw')
+        token = self.system.login('alice', 'pw').token
+        self.system.update_password(token, 'pw', 'new')
+
+        system = self.reopen()
+        self.assertEqual((system.user_count, system.session_count), (1, 1))
+        self.assertEqual(system.login('alice', 'new').code, modern_app.LOGIN_APPROVED)
+        self.assertEqual(system.update_password(token, 'new', 'newer').code,
+                         modern_app.PASSWORD_CHANGED)
+        self.assertEqual(system.register('alice', 'x').code, modern_app.USERNAME_EXISTS)
+
+    def test_updates_are_in_place_without_close(self):
+        """Mutations land in the mapped pages; the header counters track them"""
+        self.system.register('alice', 'pw')
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertIn(b'alice'.ljust(20) + b'pw'.ljust(20) + b'1', data)
+        self.assertEqual(mapped_storage.COUNTS.unpack_from(data, mapped_storage.COUNTS_OFFSET),
+                         (1, 0))
+
+    def test_file_keeps_its_capacity(self):
+        """A data file cannot be reopened with larger limits"""
+        self.system.close()
+        self.assertRaises(ValueError, UserManagementSystem, storage='mapped',
+                          data_file=self.path, max_users=101)
+        self.system = UserManagementSystem(storage='mapped', data_file=self.path)
+
+    def test_sync_policies(self):
+        """Every policy persists; unknown policies are rejected"""
+        for sync in mapped_storage.SYNC_POLICIES:
+            system = self.reopen(sync=sync, sync_interval=0)
+            system.register(f'user-{sync}', 'pw')
+        self.assertEqual(self.reopen().user_count, len(mapped_storage.SYNC_POLICIES))
+        self.assertRaises(ValueError, UserManagementSystem, storage='mapped',
+                          data_file=self.path, sync='sometimes')
+
+    def test_listeners_see_mutations(self):
+        """Table mutations are published to listeners in commit order"""
+        events = []
+        self.system.add_listener(lambda event, *details: events.append((event,) + details))
+        self.system.register('alice', 'pw')
+        token = self.system.login('alice', 'pw').token
+        self.system.update_password(token, 'pw', 'new')
+        self.assertEqual(events, [('user_added', 0, 'alice', 'pw'),
+                                  ('session_added', 0, token, 'alice'),
+                                  ('password_changed', 0, 'alice', 'new')])
+
+    def test_large_files_are_sparse_and_filled_ahead_of_the_counters(self):
+        """A big capacity costs no disk until used; blank chunks follow the counters"""
+        path = os.path.join(self.tmp.name, 'big.dat')
+        chunk = mapped_storage._FILL_RECORDS
+        system = UserManagementSystem(storage='mapped', data_file=path, profile='scaled',
+                                      max_users=chunk * 4, max_sessions=10)
+        stat = os.stat(path)
+        self.assertLess(stat.st_blocks * 512, stat.st_size // 2)
+        self.assertEqual(system.user_table[chunk - 1]['user_name'], '')
+        self.assertEqual(system.user_table[chunk]['user_name'].strip('\0'), '')
+
+        record = b'user'.ljust(20) + b'pw'.ljust(20) + b'1'
+        system.load_records(record * (chunk + 1))
+        system.register('last', 'pw')
+        system.close()
+        system = UserManagementSystem(storage='mapped', data_file=path, profile='scaled',
+                                      max_users=chunk * 4, max_sessions=10)
+        self.addCleanup(system.close)
+        self.assertEqual(system.user_table[chunk]['user_name'], 'user')
+        self.assertEqual(system.user_table[chunk + 1]['user_name'], 'last')
+        self.assertEqual(system.user_table[chunk * 2 - 1]['user_active'], 0)
+        self.assertEqual(system.login('last', 'pw').code, modern_app.LOGIN_APPROVED)
+
+
+class TestCowStorage(TestUserManagementSystem):
+    """Legacy behavior tests re-run against copy-on-write pages, plus read snapshots"""
+
+    def setUp(self):
+        self.system = UserManagementSystem(storage='cow')
+        # Keep a view open so every write goes through the copy-on-write path
+        self.held = self.system.snapshot()
+        self.addCleanup(self.held.close)
+
+    def populate(self, system):
+        for name in ('alice', 'bob', 'carol'):
+            system.register(name, 'pw')
+        return [system.login(name, 'pw').token for name in ('alice', 'alice', 'bob')]
+
+    def test_snapshot_ignores_later_writes(self):
+        """A view keeps the rows, counts and reports of the moment it was taken"""
+        tokens = self.populate(self.system)
+        with self.system.snapshot() as snap:
+            before = (list(snap.user_table), list(snap.session_table))
+            self.system.register('dave', 'pw')
+            self.system.update_password(tokens[0], 'pw', 'new')
+            self.system.deactivate_user_sessions('bob')
+            self.system.user_table[2]['user_active'] = 0
+            self.assertEqual((list(snap.user_table), list(snap.session_table)), before)
+            self.assertEqual((snap.user_count, snap.session_count), (3, 3))
+            self.assertEqual(snap.active_users(), ['alice', 'bob', 'carol'])
+            self.assertEqual(snap.active_sessions(),
+                             [(tokens[0], 'alice'), (tokens[1], 'alice'), (tokens[2], 'bob')])
+            self.assertEqual(snap.sessions_per_user(), {'alice': 2, 'bob': 1})
+            self.assertEqual(snap.user_table[0]['user_password'], 'pw')
+        self.assertEqual(self.system.user_table[0]['user_password'], 'new')
+        self.assertEqual(self.system.snapshot().sessions_per_user(), {'alice': 2})
+
+    def test_pages_are_copied_once_and_only_while_viewed(self):
+        """Writers copy a shared page on its first write, then write in place"""
+        self.held.close()
+        table = cow_storage.CowRecordTable(USER_LAYOUT, 10, page_rows=4)
+        table[0]['user_name'] = 'alice'
+        self.assertEqual(table.page_copies, 0)
+        view = table.freeze(10)
+        table[1]['user_name'] = 'bob'
+        table[2]['user_name'] = 'carol'
+        records = RecordTable(USER_LAYOUT, 0)
+        for ws_username in ('dave', 'erin'):
+            records.append({'user_name': ws_username, 'user_password': 'pw', 'user_active': 1})
+        table.write_records(3, records.buffer)
+        self.assertEqual(table.page_copies, 2)
+        self.assertEqual(view.values('user_name')[:5], ['alice', '', '', '', ''])
+        self.assertEqual([table[idx]['user_name'] for idx in range(5)],
+                         ['alice', 'bob', 'carol', 'dave', 'erin'])
+        view.release()
+        table[8]['user_name'] = 'frank'
+        self.assertEqual(table.page_copies, 2)
+
+    def test_writers_keep_going_during_a_long_scan(self):
+        """Transactions complete while a reader is part-way through a view"""
+        system = UserManagementSystem(storage='cow', profile='scaled', thread_safe=True)
+        self.populate(system)
+        writes_done = threading.Event()
+        scanned = []
+
+        def reader():
+            with system.snapshot() as snap:
+                for idx in range(snap.user_count):
+                    if idx == 1:
+                        writes_done.wait(10)
+                    scanned.append(snap.user_table[idx]['user_name'])
+                scanned.append(snap.active_sessions())
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda i: system.register(f'user{i}', 'pw'), range(500)))
+        system.deactivate_user_sessions('alice')
+        writes_done.set()
+        thread.join()
+        self.assertEqual(scanned[:3], ['alice', 'bob', 'carol'])
+        self.assertEqual([ws_username for _, ws_username in scanned[3]], ['alice', 'alice', 'bob'])
+        self.assertEqual(system.user_count, 503)
+
+    def test_concurrent_writers_to_a_viewed_page_keep_both_writes(self):
+        """A registration and a password change racing to copy one page both land"""
+        system = UserManagementSystem(storage='cow', profile='scaled', thread_safe=True)
+        system.register('alice', 'pw0')
+        token = system.login('alice', 'pw0').token
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        start = threading.Barrier(2)
+
+        def register(rnd):
+            start.wait()
+            return system.register(f'user{rnd}', 'pw').code
+
+        def change_password(rnd):
+            start.wait()
+            return system.update_password(token, f'pw{rnd}', f'pw{rnd + 1}').code
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for rnd in range(100):
+                # A fresh view each round, so both writers find page 0 shared
+                with system.snapshot():
+                    results = [pool.submit(register, rnd), pool.submit(change_password, rnd)]
+                    self.assertEqual([result.result() for result in results],
+                                     [modern_app.USER_REGISTERED, modern_app.PASSWORD_CHANGED])
+        self.assertEqual(system.user_table[0]['user_password'], 'pw100')
+        self.assertEqual(system.user_count, 101)
+        self.assertEqual(system.check_user_index(), [])
+        self.assertEqual(system.login('user99', 'pw').code, modern_app.LOGIN_APPROVED)
+
+    def test_other_storages_snapshot_by_copying(self):
+        """Every storage hands out the same isolated, versioned view"""
+        system = UserManagementSystem()
+        self.populate(system)
+        first = system.snapshot()
+        system.register('dave', 'pw')
+        second = system.snapshot()
+        self.assertEqual((first.version, second.version), (1, 2))
+        self.assertEqual((first.user_count, second.user_count), (3, 4))
+        self.assertEqual(first.active_users(), ['alice', 'bob', 'carol'])
+
+    def test_snapshot_exports_a_loadable_file(self):
+        """save() writes the view in the load_snapshot() format"""
+        self.populate(self.system)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'report.snap')
+        with self.system.snapshot() as snap:
+            self.system.register('dave', 'pw')
+            self.assertEqual(snap.save(path), (3, 3))
+        restored = UserManagementSystem(profile='scaled')
+        self.assertEqual(restored.load_snapshot(path), (3, 3))
+        self.assertEqual(restored.snapshot().sessions_per_user(), {'alice': 2, 'bob': 1})
+
+
+class TestJournal(unittest.TestCase):
+    """Write-ahead journal, group commit and snapshot recovery"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def open_journal(self, system, **kwargs):
+        log = journal.Journal(self.tmp.name, fsync=False, **kwargs)
+        recovered = log.recover(system)
+        log.attach(system)
+        return log, recovered
+
+    def test_recovery_replays_every_mutation(self):
+        """Users, sessions and password changes come back after a restart"""
+        system = UserManagementSystem(profile='scaled')
+        log, recovered = self.open_journal(system)
+        self.assertEqual(recovered, (0, 0))
+        system.register('alice', 'pw')
+        token = system.login('alice', 'pw').token
+        system.update_password(token, 'pw', 'new')
+        log.close()
+
+        restored = UserManagementSystem(profile='scaled')
+        log, recovered = self.open_journal(restored)
+        self.assertEqual(recovered, (0, 3))
+        self.assertEqual(restored.check_user_index(), [])
+        self.assertEqual(restored.update_password(token, 'new', 'newer').code,
+                         modern_app.PASSWORD_CHANGED)
+        self.assertEqual(restored.register('alice', 'x').code, modern_app.USERNAME_EXISTS)
+        log.close()
+        self.assertEqual(log.last_lsn, 4)
+
+    def test_checkpoint_limits_replay_to_the_tail(self):
+        """Recovery loads the snapshot and replays only later records"""
+        system = UserManagementSystem(profile='scaled')
+        log, _ = self.open_journal(system)
+        for i in range(10):
+            system.register(f'user{i}', 'pw')
+        self.assertEqual(log.checkpoint(system), 10)
+        system.login('user3', 'pw')
+        log.close()
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+        restored = UserManagementSystem(profile='scaled')
+        log, recovered = self.open_journal(restored)
+        self.assertEqual(recovered, (10, 1))
+        self.assertEqual((restored.user_count, restored.session_count), (10, 1))
+        self.assertEqual(restored.check_session_index(), [])
+        log.close()
+
+    def test_torn_tail_is_ignored(self):
+        """A record cut short by a crash is dropped and overwritten"""
+        system = UserManagementSystem()
+        log, _ = self.open_journal(system)
+        system.register('alice', 'pw')
+        system.register('bob', 'pw')
+        log.close()
+        (segment,) = os.listdir(self.tmp.name)
+        path = os.path.join(self.tmp.name, segment)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+
+        restored = UserManagementSystem()
+        log, recovered = self.open_journal(restored)
+        self.assertEqual(recovered, (0, 1))
+        restored.register('carol', 'pw')
+        log.close()
+        self.assertEqual([lsn for lsn, *_ in journal.read_records(path)], [1, 2])
+
+    def test_group_commit_batches_concurrent_transactions(self):
+        """Concurrent durable transactions share fsyncs"""
+        system = UserManagementSystem(profile='scaled', thread_safe=True)
+        log, _ = self.open_journal(system, commit_window=0.01)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: system.register(f'user{i}', 'pw'), range(200)))
+        self.assertEqual(log.durable_lsn, 200)
+        self.assertLess(log.commits, 100)
+        log.close()
+
+    def test_automatic_checkpoints(self):
+        """checkpoint_every snapshots the tables without an explicit call"""
+        system = UserManagementSystem(profile='scaled')
+        log = journal.Journal(self.tmp.name, fsync=False, wait_durable=False)
+        log.attach(system, checkpoint_every=25)
+        for i in range(60):
+            system.register(f'user{i}', 'pw')
+        log.close()
+        snapshots = [name for name in os.listdir(self.tmp.name) if name.endswith('.snap')]
+        self.assertEqual(snapshots, ['snapshot-%016d.snap' % 50])
+
+        restored = UserManagementSystem(profile='scaled')
+        log, recovered = self.open_journal(restored)
+        self.assertEqual(recovered, (50, 10))
+        log.close()
+
+
+class TestWarmStart(unittest.TestCase):
+    """Lazily materialized slots and save_snapshot() / load_snapshot()"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'tables.snap')
+
+    def populated(self, **kwargs):
+        system = UserManagementSystem(**kwargs)
+        for name in ('alice', 'bob', 'carol', 'dav\u00efd'):
+            system.register(name, f'{name}-pw')
+        self.tokens = [system.login(name, f'{name}-pw').token for name in ('alice', 'bob', 'carol')]
+        system.deactivate_user_sessions('bob')
+        return system
+
+    def assert_restored(self, restored):
+        self.assertEqual((restored.user_count, restored.session_count), (4, 3))
+        self.assertEqual(restored.register('carol', 'x').code, modern_app.USERNAME_EXISTS)
+        self.assertTrue(restored.login('dav\u00efd', 'dav\u00efd-pw').ok)
+        self.assertEqual(restored.list_sessions('alice'), [self.tokens[0]])
+        self.assertEqual(restored.list_sessions('bob'), [])
+        self.assertEqual(restored.update_password(self.tokens[2], 'carol-pw', 'new').code,
+                         modern_app.PASSWORD_CHANGED)
+        self.assertEqual(restored.check_user_index(), [])
+        self.assertEqual(restored.check_session_index(), [])
+
+    def test_preallocated_slots_materialize_on_first_use(self):
+        """The legacy 100 / 50 slots exist but hold no row dicts until touched"""
+        system = UserManagementSystem()
+        self.assertEqual((len(system.user_table), len(system.session_table)), (100, 50))
+        self.assertEqual(system.user_table.materialized(), 0)
+        system.register('alice', 'pw')
+        system.login('alice', 'pw')
+        self.assertEqual(system.user_table.materialized(), 1)
+        self.assertEqual(system.session_table.materialized(), 1)
+        self.assertEqual(system.user_table[99], modern_app.BLANK_USER)
+        self.assertEqual(system.session_table[-1], modern_app.BLANK_SESSION)
+
+    def test_round_trip_dict_storage(self):
+        """A restored dict system answers like the saved one, building rows on demand"""
+        self.assertEqual(self.populated(profile='scaled').save_snapshot(self.path), (4, 3))
+        restored = UserManagementSystem(profile='scaled')
+        self.assertEqual(restored.load_snapshot(self.path), (4, 3))
+        self.assert_restored(restored)
+
+        lazy = UserManagementSystem(profile='scaled')
+        lazy.load_snapshot(self.path)
+        self.assertEqual(lazy.user_table.materialized(), 0)
+        self.assertTrue(lazy.login('alice', 'alice-pw').ok)
+        self.assertEqual(lazy.user_table.materialized(), 1)
+        self.assertEqual(lazy.session_table.materialized(), 1)
+
+    def test_round_trip_across_storages(self):
+        """Snapshots load into record storage and keep the legacy slot count"""
+        self.populated().save_snapshot(self.path)
+        restored = UserManagementSystem(storage='compact')
+        restored.load_snapshot(self.path)
+        self.assert_restored(restored)
+        legacy = UserManagementSystem()
+        legacy.load_snapshot(self.path)
+        self.assertEqual(len(legacy.user_table), 100)
+        self.assert_restored(legacy)
+
+    def test_direct_writes_after_restore_are_seen(self):
+        """Rows written behind the index after a restore still resync it"""
+        self.populated(profile='scaled').save_snapshot(self.path)
+        restored = UserManagementSystem(profile='scaled')
+        restored.load_snapshot(self.path)
+        restored.user_table[3]['user_name'] = 'alice'
+        restored._user_index_count = -1
+        self.assertEqual(restored._user_slots('alice'), [0, 3])
+        self.assertEqual(restored.check_user_index(), [])
+
+    def test_load_needs_an_empty_system_within_limits(self):
+        """Restores never merge into live tables or overflow the capacity"""
+        system = self.populated()
+        system.save_snapshot(self.path)
+        with self.assertRaises(ValueError):
+            system.load_snapshot(self.path)
+        with self.assertRaises(ValueError):
+            UserManagementSystem(max_users=3).load_snapshot(self.path)
+
+    def test_restored_sessions_get_a_fresh_ttl(self):
+        """With expiry on, restored active sessions end one TTL after the load"""
+        self.populated().save_snapshot(self.path)
+        clock = FakeClock()
+        restored = UserManagementSystem(session_ttl=60, clock=clock)
+        restored.load_snapshot(self.path)
+        clock.now += 61
+        self.assertEqual(restored.expire_sessions(), 2)
+
+    def test_reads_row_layout_snapshots(self):
+        """UMSSNAP1 files from earlier releases still load"""
+        def text(value):
+            raw = value.encode('utf-8')
+            return struct.pack('<H', len(raw)) + raw
+        body = (snapshot.HEADER.pack(snapshot.MAGIC_V1, 7, 1, 1)
+                + text('alice') + text('pw') + bytes([1])
+                + struct.pack('<I', 123456) + text('alice') + bytes([1]))
+        with open(self.path, 'wb') as f:
+            f.write(body + snapshot.TRAILER.pack(zlib.crc32(body)))
+        self.assertEqual(snapshot.read_snapshot(self.path),
+                         (7, [('alice', 'pw', 1)], [(123456, 'alice', 1)]))
+        restored = UserManagementSystem()
+        restored.load_snapshot(self.path)
+        self.assertEqual(restored.generate_token() != 123456, True)
+        self.assertEqual(restored.list_sessions('alice'), [123456])
+
+    def test_damaged_snapshots_are_rejected(self):
+        """A flipped byte fails the checksum"""
+        self.populated().save_snapshot(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(40)
+            byte = f.read(1)
+            f.seek(40)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        with self.assertRaises(ValueError):
+            UserManagementSystem().load_snapshot(self.path)
+
+    def test_text_columns_slice_on_read(self):
+        """TextColumn values come back exactly, including lone surrogates"""
+        values = ['', 'a', '\u00e9t\u00e9', '\ud800', 'zz']
+        data = snapshot.encode_columns(0, (values, values, [1] * 5), ([], [], []))
+        _, (names, _, _), _ = snapshot.decode_columns(data)
+        self.assertIsInstance(names, snapshot.TextColumn)
+        self.assertEqual(list(names), values)
+        self.assertEqual(names[1:4], values[1:4])
+        self.assertEqual(names[-1], 'zz')
+
+
+class TestAuditLog(unittest.TestCase):
+    """Queued audit records, background writer, rotation and backpressure"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'audit.log')
+
+    def stalled(self, **kwargs):
+        """AuditLog whose writer is stuck on its first record until the gate opens"""
+        audit = audit_log.AuditLog(self.path, flush_interval=0.01, capacity=3, **kwargs)
+        self.addCleanup(audit.close)
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        encode = audit._encode
+        audit._encode = lambda batch: gate.wait() and encode(batch)
+        audit.record('register', 'first', modern_app.USER_REGISTERED)
+        while not audit._busy:
+            time.sleep(0.001)
+        return audit, gate
+
+    def users(self):
+        return [entry['user'] for entry in audit_log.read_records(self.path)]
+
+    def test_every_transaction_is_recorded(self):
+        """Registrations, logins (both outcomes) and password changes, no passwords"""
+        for fmt in audit_log.FORMATS:
+            with self.subTest(fmt=fmt):
+                path = os.path.join(self.tmp.name, f'audit.{fmt}')
+                system = UserManagementSystem(thread_safe=True)
+                audit = audit_log.AuditLog(path, fmt)
+                audit.attach(system)
+                system.register('alice', 'secret-pw')
+                system.register_many([('bob', 'pw'), ('alice', 'pw')])
+                token = system.login('alice', 'secret-pw').token
+                system.login('alice', 'wrong')
+                system.update_password(token, 'secret-pw', 'next-pw')
+                audit.close()
+                self.assertEqual(
+                    [(entry['event'], entry['user'], entry['outcome'], entry['token'])
+                     for entry in audit_log.read_records(path)],
+                    [('register', 'alice', modern_app.USER_REGISTERED, 0),
+                     ('register', 'bob', modern_app.USER_REGISTERED, 0),
+                     ('register', 'alice', modern_app.USERNAME_EXISTS, 0),
+                     ('login', 'alice', modern_app.LOGIN_APPROVED, token),
+                     ('login', 'alice', modern_app.INVALID_CREDENTIALS, 0),
+                     ('password_change', 'alice', modern_app.PASSWORD_CHANGED, token)])
+                with open(path, 'rb') as f:
+                    self.assertNotIn(b'secret-pw', f.read())
+                # Closing unwraps the system
+                self.assertNotIn('login', vars(system))
+
+    def test_writer_batches_records(self):
+        """Records reach the file in batches, and flush() waits for them"""
+        audit = audit_log.AuditLog(self.path, flush_interval=60, max_batch=50)
+        for i in range(120):
+            audit.record('login', f'user{i}', modern_app.LOGIN_APPROVED, 100000 + i)
+        audit.flush()
+        self.assertEqual(len(self.users()), 120)
+        self.assertLess(audit.stats()['batches'], 120)
+        audit.close()
+
+    def test_files_rotate_at_max_bytes(self):
+        """Full files move to .1, .2 ...; only `backups` of them are kept"""
+        audit = audit_log.AuditLog(self.path, 'binary', max_bytes=300, backups=2)
+        for i in range(40):
+            audit.record('register', f'user{i:02d}', modern_app.USER_REGISTERED)
+            audit.flush()
+        audit.close()
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['audit.log', 'audit.log.1', 'audit.log.2'])
+        kept = [entry['user'] for suffix in ('.2', '.1', '')
+                for entry in audit_log.read_records(self.path + suffix)]
+        self.assertEqual(kept, [f'user{i:02d}' for i in range(40 - len(kept), 40)])
+        self.assertGreater(audit.rotations, 2)
+
+    def test_drop_oldest_keeps_the_newest_records(self):
+        """A full queue discards its head and counts it"""
+        audit, gate = self.stalled(policy='drop_oldest')
+        for name in 'abcde':
+            audit.record('register', name, modern_app.USER_REGISTERED)
+        gate.set()
+        audit.flush()
+        self.assertEqual(self.users(), ['first', 'c', 'd', 'e'])
+        self.assertEqual(audit.stats()['dropped'], 2)
+
+    def test_drop_newest_keeps_the_queued_records(self):
+        """A full queue turns new records away and counts them"""
+        audit, gate = self.stalled(policy='drop_newest')
+        for name in 'abcde':
+            audit.record('register', name, modern_app.USER_REGISTERED)
+        gate.set()
+        audit.flush()
+        self.assertEqual(self.users(), ['first', 'a', 'b', 'c'])
+        self.assertEqual(audit.stats()['dropped'], 2)
+
+    def test_block_waits_for_space(self):
+        """A full queue holds the transaction until the writer catches up"""
+        audit, gate = self.stalled(policy='block')
+        for name in 'abc':
+            audit.record('register', name, modern_app.USER_REGISTERED)
+        producer = threading.Thread(target=audit.record,
+                                    args=('register', 'd', modern_app.USER_REGISTERED))
+        producer.start()
+        producer.join(0.05)
+        self.assertTrue(producer.is_alive())
+        gate.set()
+        producer.join()
+        audit.flush()
+        self.assertEqual(self.users(), ['first', 'a', 'b', 'c', 'd'])
+        self.assertEqual((audit.stats()['blocked'], audit.stats()['dropped']), (1, 0))
+
+    def test_password_change_names_the_session_user(self):
+        """The user is recorded even when the login record was never written"""
+        system = UserManagementSystem()
+        system.register('alice', 'pw')
+        token = system.login('alice', 'pw').token
+        audit = audit_log.AuditLog(self.path)
+        audit.attach(system)
+        system.update_password(token, 'pw', 'new')
+        system.update_password(999999, 'pw', 'new')
+        audit.close()
+        self.assertEqual([(entry['event'], entry['user'], entry['outcome'])
+                          for entry in audit_log.read_records(self.path)],
+                         [('password_change', 'alice', modern_app.PASSWORD_CHANGED),
+                          ('password_change', '', modern_app.INVALID_SESSION_TOKEN)])
+
+    def test_writer_survives_failed_batches(self):
+        """A batch that cannot be written is dropped and counted; blocking callers carry on"""
+        audit = audit_log.AuditLog(self.path, flush_interval=0.01, capacity=2, policy='block')
+        self.addCleanup(audit.close)
+        encode = audit._encode
+        audit._encode = lambda batch: 1 / 0
+        for name in 'abcdef':
+            audit.record('register', name, modern_app.USER_REGISTERED)
+        audit.flush()
+        self.assertGreater(audit.stats()['errors'], 0)
+        self.assertIsInstance(audit.last_error, ZeroDivisionError)
+        self.assertEqual(audit.stats()['dropped'], 6)
+
+        audit._encode = encode
+        audit._file.close()    # e.g. a failed rotation
+        audit.record('register', 'g', modern_app.USER_REGISTERED)
+        audit.flush()
+        self.assertEqual(self.users(), ['g'])
+
+    def test_dead_writer_never_blocks_transactions(self):
+        """If the writer thread dies, block-policy records are dropped instead of waiting"""
+        audit = audit_log.AuditLog(self.path, flush_interval=0.01, capacity=3, policy='block')
+        self.addCleanup(audit.close)
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+
+        def die(batch):
+            gate.wait()
+            raise SystemExit    # gets past the writer's per-batch error handling
+        audit._encode = die
+        audit.record('register', 'first', modern_app.USER_REGISTERED)
+        while not audit._busy:
+            time.sleep(0.001)
+        for name in 'abc':
+            audit.record('register', name, modern_app.USER_REGISTERED)
+        producer = threading.Thread(target=audit.record,
+                                    args=('register', 'd', modern_app.USER_REGISTERED))
+        producer.start()
+        producer.join(0.05)
+        self.assertTrue(producer.is_alive())
+
+        gate.set()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        audit._writer.join(5)
+        audit.record('register', 'e', modern_app.USER_REGISTERED)
+        audit.flush()
+        self.assertEqual(audit.stats()['dropped'], 2)
+
+    def test_overhead_benchmark_reports_p99(self):
+        """The benchmark compares login latency with and without auditing"""
+        result = audit_log.measure_overhead(ops=200, users=10)
+        self.assertGreater(result['audited']['p99_ms'], 0)
+        self.assertGreater(result['baseline']['p99_ms'], 0)
+        self.assertEqual(result['audit']['written'], 200)
+
+
+class TestBulkIo(unittest.TestCase):
+    """Streaming CSV / fixed-width user import and export"""
+
+    def import_csv(self, system, text):
+        rejects = []
+        counts = bulk_io.import_users(system, bulk_io.read_csv(io.StringIO(text)),
+                                      lambda *reject: rejects.append(reject))
+        return counts, rejects
+
+    def test_csv_import_reports_legacy_reasons(self):
+        """Duplicates (in the table or the file) and a full table are rejected by message"""
+        system = UserManagementSystem(max_users=3)
+        system.register('alice', 'pw')
+        counts, rejects = self.import_csv(
+            system, "username,password\nbob,pw1\nalice,x\nbob,pw2\ncarol,pw3\ndave,pw4\nodd\n")
+        self.assertEqual(counts, {"SUCCESS: USER REGISTERED!": 2,
+                                  "ERROR: USERNAME ALREADY EXISTS!": 2,
+                                  "ERROR: USER DATABASE FULL!": 1,
+                                  bulk_io.INVALID_RECORD: 1})
+        self.assertEqual(rejects, [(3, 'alice', "ERROR: USERNAME ALREADY EXISTS!"),
+                                   (4, 'bob', "ERROR: USERNAME ALREADY EXISTS!"),
+                                   (6, 'dave', "ERROR: USER DATABASE FULL!"),
+                                   (7, None, bulk_io.INVALID_RECORD)])
+        self.assertEqual(system.login('bob', 'pw1').code, modern_app.LOGIN_APPROVED)
+        self.assertEqual(system.check_user_index(), [])
+
+    def test_matches_register_one_by_one(self):
+        """Bulk results equal per-row register() results"""
+        rows = [(f'user{i % 70}', f'pw{i}') for i in range(150)]
+        bulk, single = UserManagementSystem(), UserManagementSystem()
+        self.assertEqual(bulk.register_many(rows),
+                         [single.register(username, password) for username, password in rows])
+        self.assertEqual(bulk.user_table, single.user_table)
+
+    def test_fixed_width_round_trip(self):
+        """USER-ENTRY export re-imports identically, from any storage"""
+        for storage in ('dict', 'compact'):
+            system = UserManagementSystem(storage=storage, profile='scaled')
+            for i in range(25):
+                system.register(f'user{i}', f'pw{i}')
+            out = io.BytesIO()
+            self.assertEqual(bulk_io.export_users(system, out, 'fixed'), 25)
+            data = out.getvalue()
+            self.assertEqual(len(data), 25 * 41)
+            self.assertEqual(data[:41], b'user0'.ljust(20) + b'pw0'.ljust(20) + b'1')
+
+            copy = UserManagementSystem(storage=storage, profile='scaled')
+            with patch.object(bulk_io, 'CHUNK_ROWS', 4):
+                counts = bulk_io.import_users(copy, bulk_io.read_fixed(io.BytesIO(data)))
+            self.assertEqual(counts, {"SUCCESS: USER REGISTERED!": 25})
+            self.assertEqual([copy.user_table[i]['user_password'] for i in range(25)],
+                             [f'pw{i}' for i in range(25)])
+
+    def test_fixed_width_lines_and_short_records(self):
+        """Newline-terminated records are accepted; a truncated last record is rejected"""
+        record = b'alice'.ljust(20) + b'pw'.ljust(20) + b'1'
+        records = list(bulk_io.read_fixed(io.BytesIO(record + b'\n' + record + b'\nbob\n')))
+        self.assertEqual(records, [(1, 'alice', 'pw', 1), (2, 'alice', 'pw', 1),
+                                   (3, None, None, None)])
+
+    def test_disabled_accounts_stay_disabled(self):
+        """USER-ACTIVE 0 survives fixed-width and CSV round trips and journal recovery"""
+        record = b'alice'.ljust(20) + b'pw'.ljust(20) + b'0' + b'bob'.ljust(20) + b'pw'.ljust(20) + b'1'
+        with tempfile.TemporaryDirectory() as directory:
+            system = UserManagementSystem(profile='scaled')
+            log = journal.Journal(directory, fsync=False, wait_durable=False)
+            log.attach(system)
+            counts = bulk_io.import_users(system, bulk_io.read_fixed(io.BytesIO(record)))
+            log.close()
+            self.assertEqual(counts, {"SUCCESS: USER REGISTERED!": 2})
+            self.assertEqual(system.login('alice', 'pw').code, modern_app.INVALID_CREDENTIALS)
+            self.assertEqual(system.login('bob', 'pw').code, modern_app.LOGIN_APPROVED)
+
+            recovered = UserManagementSystem(profile='scaled')
+            log = journal.Journal(directory, fsync=False)
+            log.recover(recovered)
+            log.close()
+            self.assertEqual([recovered.user_table[i]['user_active'] for i in range(2)], [0, 1])
+
+        out = io.BytesIO()
+        bulk_io.export_users(system, out, 'fixed')
+        self.assertEqual(out.getvalue(), record)
+        text = io.StringIO()
+        bulk_io.export_users(system, text)
+        self.assertEqual(text.getvalue(), 'username,password,active\nalice,pw,0\nbob,pw,1\n')
+        copy = UserManagementSystem(storage='compact')
+        counts, rejects = self.import_csv(copy, text.getvalue() + 'carol,pw\ndave,pw,2\n')
+        self.assertEqual([copy.user_table[i]['user_active'] for i in range(3)], [0, 1, 1])
+        self.assertEqual(rejects, [(5, None, bulk_io.INVALID_RECORD)])
+
+    def test_csv_export(self):
+        """CSV export has a header and one row per user"""
+        system = UserManagementSystem()
+        system.register('alice', 'p,w')
+        out = io.StringIO()
+        bulk_io.export_users(system, out)
+        self.assertEqual(out.getvalue(), 'username,password,active\nalice,"p,w",1\n')
+        counts, _ = self.import_csv(UserManagementSystem(), out.getvalue())
+        self.assertEqual(counts, {"SUCCESS: USER REGISTERED!": 1})
+
+
+class TestCobolCodec(unittest.TestCase):
+    """EBCDIC / ASCII USER-ENTRY and SESSION-ENTRY dataset codec"""
+
+    def setUp(self):
+        self.users = cobol_codec.RecordCodec(USER_LAYOUT)
+        self.sessions = cobol_codec.RecordCodec(SESSION_LAYOUT)
+
+    def test_cp037_encoding(self):
+        """Text is EBCDIC, PIC X is space (0x40) padded, PIC 9 is F-zoned"""
+        data = self.users.encode_rows([('AB', 'x1', 1)])
+        self.assertEqual(len(data), 41)
+        self.assertEqual(data[:3], b'\xc1\xc2\x40')
+        self.assertEqual(data[20:22], b'\xa7\xf1')
+        self.assertEqual(data[40:], b'\xf1')
+        self.assertEqual(list(self.users.iter_rows(data)), [('AB', 'x1', 1)])
+
+    def test_zoned_decimal_signs(self):
+        """A C sign nibble on the last digit is accepted; D (negative) is not"""
+        record = bytearray(self.sessions.encode_rows([(100000, 'bob', 1), (123456, 'amy', 1)]))
+        record[27 + 5] = 0xC6
+        self.assertEqual(list(self.sessions.iter_rows(bytes(record))),
+                         [(100000, 'bob', 1), (123456, 'amy', 1)])
+        record[27 + 5] = 0xD6
+        with self.assertRaisesRegex(ValueError, 'record 2'):
+            self.sessions.to_native(bytes(record))
+        with self.assertRaises(ValueError):
+            self.users.to_native(b'\x40' * 40)
+
+    def test_load_and_dump_round_trip(self):
+        """Datasets load into any storage and dump back byte for byte"""
+        users = self.users.encode_rows([(f'user{i}', f'pw{i}', 1) for i in range(30)])
+        sessions = self.sessions.encode_rows([(100000 + i, f'user{i}', i % 2) for i in range(10)])
+        for storage in ('dict', 'compact'):
+            system = UserManagementSystem(storage=storage, profile='scaled')
+            with patch.object(cobol_codec, 'CHUNK_RECORDS', 7):
+                loaded = cobol_codec.load_dataset(system, io.BytesIO(users), io.BytesIO(sessions))
+            self.assertEqual(loaded, (30, 10, len(users) + len(sessions)))
+            self.assertEqual(system.login('user29', 'pw29').code, modern_app.LOGIN_APPROVED)
+            self.assertEqual(system.update_password(100001, 'pw1', 'new').code,
+                             modern_app.PASSWORD_CHANGED)
+            self.assertEqual(system.update_password(100002, 'pw2', 'new').code,
+                             modern_app.INVALID_SESSION_TOKEN)
+
+            system.update_password(100001, 'new', 'pw1')
+            user_out, session_out = io.BytesIO(), io.BytesIO()
+            cobol_codec.dump_dataset(system, user_out, session_out)
+            self.assertEqual(user_out.getvalue(), users)
+            self.assertEqual(session_out.getvalue()[:len(sessions)], sessions)
+
+    def test_ascii_datasets_and_capacity(self):
+        """ASCII records load as is; a dataset larger than the table is refused"""
+        data = b''.join(b'user%-16dpw%-18d1' % (i, i) for i in range(101))
+        system = UserManagementSystem(storage='compact')
+        self.assertRaises(ValueError, cobol_codec.load_dataset, system, io.BytesIO(data),
+                          codepage='ascii')
+        self.assertEqual(system.user_count, 0)
+        cobol_codec.load_dataset(system, io.BytesIO(data[:41 * 100]), codepage='ascii')
+        self.assertEqual(system.register('new', 'pw').code, modern_app.USER_DATABASE_FULL)
+        self.assertEqual(system.check_user_index(), [])
+
+    def test_overflowing_sessions_load_nothing(self):
+        """When only the sessions do not fit, no user rows are written either"""
+        user = b'alice'.ljust(20) + b'pw'.ljust(20) + b'1'
+        session = b'123456' + b'alice'.ljust(20) + b'1'
+        for storage, profile in (('dict', 'legacy'), ('dict', 'scaled'), ('compact', 'scaled')):
+            system = UserManagementSystem(storage=storage, profile=profile, max_sessions=1)
+            rows_before = len(system.user_table)
+            self.assertRaises(ValueError, system.load_records, user, session * 2)
+            self.assertEqual((system.user_count, system.session_count), (0, 0))
+            self.assertEqual(len(system.user_table), rows_before)
+            self.assertEqual(system.register('bob', 'pw').code, modern_app.USER_REGISTERED)
+            self.assertEqual(system.user_table[0]['user_name'], 'bob')
+            self.assertEqual(system.login('alice', 'pw').code, modern_app.INVALID_CREDENTIALS)
+
+    def test_non_numeric_records_load_nothing(self):
+        """A PIC 9 field holding a non-digit rejects both batches before any row is stored"""
+        users = b''.join(b'user%-16dpw%-18d1' % (i, i) for i in range(3))
+        sessions = b'123456' + b'user0'.ljust(20) + b'1' + b'12x456' + b'user1'.ljust(20) + b'1'
+        for storage, profile in (('dict', 'legacy'), ('dict', 'scaled'), ('compact', 'scaled')):
+            system = UserManagementSystem(storage=storage, profile=profile)
+            with self.assertRaisesRegex(ValueError, 'record 2: session_token'):
+                system.load_records(users, sessions)
+            self.assertEqual((system.user_count, system.session_count), (0, 0))
+            self.assertEqual(system.register('bob', 'pw').code, modern_app.USER_REGISTERED)
+            self.assertEqual(system.user_table[0]['user_name'], 'bob')
+
+    def test_failed_dataset_loads_nothing(self):
+        """A bad record in a later chunk leaves even the earlier chunks unloaded"""
+        users = self.users.encode_rows([(f'user{i}', f'pw{i}', 1) for i in range(30)])
+        sessions = bytearray(self.sessions.encode_rows([(100000 + i, f'user{i}', 1)
+                                                        for i in range(10)]))
+        sessions[27 * 8] = 0x81
+        system = UserManagementSystem(storage='compact', profile='scaled')
+        with patch.object(cobol_codec, 'CHUNK_RECORDS', 7):
+            with self.assertRaisesRegex(ValueError, 'record 9'):
+                cobol_codec.load_dataset(system, io.BytesIO(users), io.BytesIO(bytes(sessions)))
+        self.assertEqual((system.user_count, system.session_count), (0, 0))
+
+    def test_loaded_rows_reach_listeners(self):
+        """Bulk loads are published row by row (so a journal records them)"""
+        system = UserManagementSystem(profile='scaled')
+        events = []
+        system.add_listener(lambda event, *details: events.append((event,) + details))
+        system.load_records(b'alice'.ljust(20) + b'pw'.ljust(20) + b'1',
+                            b'123456' + b'alice'.ljust(20) + b'0')
+        self.assertEqual(events, [('user_added', 0, 'alice', 'pw'),
+                                  ('session_added', 0, 123456, 'alice'),
+                                  ('session_ended', 0, 123456)])
+
+
+class TestDifferential(unittest.TestCase):
+    """Randomized differential testing against the reference engine"""
+
+    def test_backends_match_reference(self):
+        """Every backend agrees with the linear-scan reference step by step"""
+        for seed in (1, 2, 3):
+            sequence = differential_test.generate_sequence(seed, 1500)
+            self.assertIsNone(differential_test.run_sequence(sequence, differential_test.ENGINES,
+                                                             full_check_every=50))
+
+    def test_reused_tokens_keep_their_sessions_apart(self):
+        """An engine that reissues an ended session's token still matches the reference"""
+        limits = {'profile': 'scaled', 'max_users': 3, 'max_sessions': 2,
+                  'max_sessions_per_user': None}
+        operations = [('register', 'alice', 'pw'), ('login', 'alice', 'pw'),
+                      ('login', 'alice', 'pw'), ('deactivate_user_sessions', 'alice'),
+                      ('login', 'alice', 'pw'), ('update_password', 0, 'pw', 'a'),
+                      ('update_password', 1, 'pw', 'b'), ('update_password', 2, 'pw', 'c'),
+                      ('active_sessions',), ('login', 'alice', 'c'), ('list_sessions', 'alice')]
+        # Two tokens for two sessions: the third login must reuse one
+        engines = {'reusing': lambda limits, directory: UserManagementSystem(
+            **limits, token_allocator=TokenAllocator(100000, 100001))}
+        self.assertIsNone(differential_test.run_sequence((limits, operations), engines,
+                                                         full_check_every=1))
+
+    def test_failure_shrinks_to_reproducer(self):
+        """A divergence is reported at its step and shrunk to a few operations"""
+        class Broken(UserManagementSystem):
+            def count_active_users(self):
+                count = super().count_active_users()
+                return count + 1 if count >= 2 else count
+
+        engines = {'dict': differential_test.ENGINES['dict'],
+                   'broken': lambda limits, directory: Broken(**limits)}
+        sequence = differential_test.generate_sequence(5, 2000)
+        self.assertIsNotNone(differential_test.run_sequence(sequence, engines))
+        (limits, operations), (step, problem) = differential_test.shrink(sequence, engines)
+        self.assertEqual(len(operations), 3)
+        self.assertEqual([operation[0] for operation in operations],
+                         ['register', 'register', 'count_active_users'])
+        self.assertEqual(step, 2)
+        self.assertIn('broken', problem)
+
+    def test_command_line_pool(self):
+        """The CLI fans seeds out to worker processes and reports the total"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = differential_test.main(['--sequences', '2', '--length', '200',
+                                             '--workers', '2', '--engines', 'dict,compact'])
+        self.assertEqual(status, 0)
+        self.assertIn("CHECKED 400 TRANSACTIONS", output.getvalue())
+        self.assertIn("ALL ENGINES MATCH THE REFERENCE", output.getvalue())
+
+
+class TestEvaluation(unittest.TestCase):
+    """Parallel, cached grading runs"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp.name, 'cache.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def evaluate(self, **kwargs):
+        import evaluate_refactor
+        evaluator = evaluate_refactor.RefactorEvaluator(workers=1, cache_path=self.cache_path,
+                                                        **kwargs)
+        report_path = os.path.join(self.tmp.name, 'report.json')
+        with redirect_stdout(io.StringIO()):
+            report = evaluator.evaluate(report_path)
+        with open(report_path) as f:
+            self.assertEqual(json.load(f)['total_score'], report['total_score'])
+        return report
+
+    def test_test_cases_run_in_worker_processes(self):
+        """Every legacy test runs in the pool, in suite order, with its own wall time"""
+        import evaluate_refactor
+        tests = evaluate_refactor.run_test_cases(TestUserManagementSystem, workers=2)
+        names = [test.id() for test in
+                 unittest.TestLoader().loadTestsFromTestCase(TestUserManagementSystem)]
+        self.assertEqual([test['id'] for test in tests], names)
+        self.assertTrue(all(test['outcome'] == 'pass' and test['seconds'] >= 0 for test in tests))
+
+    def test_unchanged_sections_come_from_cache(self):
+        """A second run reuses every section; a changed input re-runs it"""
+        import evaluate_refactor
+        first = self.evaluate()
+        self.assertEqual(first['total_score'], 100)
+        self.assertEqual(first['cached_sections'], [])
+        self.assertEqual(len(first['breakdown']['behavior_tests']['tests']), 12)
+
+        second = self.evaluate()
+        self.assertEqual(second['total_score'], 100)
+        self.assertEqual(second['cached_sections'],
+                         ['behavior_tests', 'code_quality', 'legacy_compatibility'])
+
+        hashes = evaluate_refactor.source_hashes
+        with patch.object(evaluate_refactor, 'source_hashes',
+                          lambda paths: dict(hashes(paths), **{'modern_app.py': 'changed'})):
+            third = self.evaluate()
+        self.assertEqual(third['cached_sections'], [])
+        self.assertEqual(self.evaluate(use_cache=False)['cached_sections'], [])
+
+    def test_inputs_include_imported_modules(self):
+        """Editing a module modern_app imports invalidates its sections"""
+        import evaluate_refactor
+        inputs = evaluate_refactor.source_hashes(['modern_app.py'])
+        self.assertIn('record_storage.py', inputs)
+        self.assertIn('evaluate_refactor.py', inputs)
+        self.assertNotIn('behavior_tests.py', inputs)
+
+
 if __name__ == '__main__':
-    unittest.main(verbosity=2)
\ No newline at end of file
+    unittest.main(verbosity=2)
@@ -0,0 +1,242 @@
+"""
+BULK IO - STREAMING USER IMPORT / EXPORT
+Loads and dumps USER-TABLE as CSV or 41-byte fixed-width USER-ENTRY records
+
+Imports stream the input in chunks through UserManagementSystem.
+register_many(), so memory stays flat however large the file is and each
+row costs one hashed duplicate check. Every rejected row is reported with
+the legacy screen message (USERNAME ALREADY EXISTS, USER DATABASE FULL) or
+INVALID RECORD FORMAT for rows that cannot be parsed.
+
+Formats:
+    csv    username,password[,active] per line (a header line naming those
+           columns is skipped); active is 1 or 0 and defaults to 1. Export
+           writes all three columns
+    fixed  USER-ENTRY records: USER-NAME PIC X(20), USER-PASSWORD PIC X(20),
+           USER-ACTIVE PIC 9; back to back (RECFM=F) or one per line
+
+Usage:
+    python bulk_io.py import users.csv --data-file ums.dat [--rejects rejects.csv]
+    python bulk_io.py export users.dat --format fixed --journal ums.journal
+"""
+
+import argparse
+import csv
+import io
+import sys
+import time
+
+from journal import Journal
+from modern_app import PROFILES, UserManagementSystem
+from record_storage import TEXT_ENCODING, USER_LAYOUT, RecordTable, encode_field
+
+FORMATS = ('csv', 'fixed')
+
+# Rows handed to register_many() at a time
+CHUNK_ROWS = 10_000
+
+USER_RECORD_LENGTH = sum(length for _, _, length in USER_LAYOUT)
+
+# Reason reported for rows that cannot be parsed (not a legacy screen message)
+INVALID_RECORD = "ERROR: INVALID RECORD FORMAT!"
+
+CSV_HEADER = ['username', 'password', 'active']
+
+
+def read_csv(stream):
+    """Yield (record number, username, password, active) from CSV text
+
+    Malformed rows (wrong column count, active other than 0 / 1) yield None fields.
+    """
+    for record_no, row in enumerate(csv.reader(stream), 1):
+        if record_no == 1 and row in (CSV_HEADER, CSV_HEADER[:2]):
+            continue
+        if len(row) == 2:
+            yield record_no, row[0], row[1], 1
+        elif len(row) == 3 and row[2] in ('0', '1'):
+            yield record_no, row[0], row[1], int(row[2])
+        else:
+            yield record_no, None, None, None
+
+
+def read_fixed(stream):
+    """Yield (record number, username, password, active) from USER-ENTRY records
+
+    stream is binary. Records may be back to back or newline-terminated
+    (detected from the first record).
+    """
+    first = stream.read(USER_RECORD_LENGTH + 2)
+    terminator = b''
+    if first[USER_RECORD_LENGTH:USER_RECORD_LENGTH + 2] == b'\r\n':
+        terminator = b'\r\n'
+    elif first[USER_RECORD_LENGTH:USER_RECORD_LENGTH + 1] == b'\n':
+        terminator = b'\n'
+    stride = USER_RECORD_LENGTH + len(terminator)
+
+    pending = first
+    record_no = 0
+    while True:
+        chunk = stream.read(stride * CHUNK_ROWS)
+        if chunk:
+            pending += chunk
+        usable = len(pending) - len(pending) % stride
+        view = memoryview(pending)
+        for start in range(0, usable, stride):
+            record_no += 1
+            record = view[start:start + USER_RECORD_LENGTH]
+            if record[40] not in b'01' or view[start + USER_RECORD_LENGTH:start + stride] != terminator:
+                yield record_no, None, None, None
+                continue
+            yield (record_no,
+                   bytes(record[:20]).decode(TEXT_ENCODING).rstrip(' '),
+                   bytes(record[20:40]).decode(TEXT_ENCODING).rstrip(' '),
+                   record[40] - 0x30)
+        view.release()
+        pending = pending[usable:]
+        if not chunk:
+            break
+    if pending.rstrip(b'\r\n'):
+        yield record_no + 1, None, None, None
+
+
+def import_users(system, records, rejects=None):
+    """Register every (record number, username, password, active) record
+
+    Records with active 0 are registered disabled (USER-ACTIVE = 0).
+    rejects, if given, is called as rejects(record_no, username, reason) for
+    each row that was not registered. Returns {message: count} of outcomes.
+    """
+    counts = {}
+    chunk = []
+
+    def flush():
+        results = iter(system.register_many([(username, password, active)
+                                             for _, username, password, active in chunk
+                                             if username is not None]))
+        for record_no, username, _, _ in chunk:
+            result = None if username is None else next(results)
+            message = INVALID_RECORD if result is None else result.message
+            counts[message] = counts.get(message, 0) + 1
+            if rejects is not None and (result is None or not result.ok):
+                rejects(record_no, username, message)
+        chunk.clear()
+
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= CHUNK_ROWS:
+            flush()
+    if chunk:
+        flush()
+    return counts
+
+
+def export_users(system, out, fmt='csv'):
+    """Write every registered user to out (text for csv, binary for fixed); returns the count"""
+    count = system.user_count
+    table = system.user_table
+    if fmt == 'csv':
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(CSV_HEADER)
+        for user_idx in range(count):
+            entry = table[user_idx]
+            writer.writerow([entry['user_name'], entry['user_password'], entry['user_active']])
+        return count
+
+    if isinstance(table, RecordTable):
+        # Compact and mapped tables already hold USER-ENTRY bytes
+        step = USER_RECORD_LENGTH * CHUNK_ROWS
+        end = count * USER_RECORD_LENGTH
+        for start in range(0, end, step):
+            out.write(table.buffer[start:min(end, start + step)])
+        return count
+
+    for start in range(0, count, CHUNK_ROWS):
+        parts = []
+        for user_idx in range(start, min(count, start + CHUNK_ROWS)):
+            entry = table[user_idx]
+            if len(entry['user_password']) > 20:
+                raise ValueError("hashed passwords do not fit USER-PASSWORD PIC X(20); use csv")
+            parts.extend(encode_field(kind, length, entry[name]) for name, kind, length in USER_LAYOUT)
+        out.write(b''.join(parts))
+    return count
+
+
+def open_system(args):
+    """System backed by the --data-file or --journal named on the command line"""
+    if args.data_file:
+        return UserManagementSystem(storage='mapped', data_file=args.data_file,
+                                    profile=args.profile), None
+    system = UserManagementSystem(profile=args.profile)
+    log = Journal(args.journal, wait_durable=False)
+    log.recover(system)
+    log.attach(system)
+    return system, log
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of user records")
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="input or output file ('-' for stdin/stdout)")
+    parser.add_argument('--format', choices=FORMATS,
+                        help="record format (default: from the file extension, else csv)")
+    store = parser.add_mutually_exclusive_group(required=True)
+    store.add_argument('--data-file', help="memory-mapped data file holding the tables")
+    store.add_argument('--journal', help="journal directory holding the tables")
+    parser.add_argument('--profile', default='scaled', choices=sorted(PROFILES))
+    parser.add_argument('--rejects', help="write rejected rows here as CSV (default: stderr)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('fixed' if args.path.endswith(('.dat', '.fb')) else 'csv')
+    system, log = open_system(args)
+    started = time.perf_counter()
+    try:
+        if args.command == 'import':
+            rejects_out = sys.stderr if args.rejects is None else open(args.rejects, 'w', newline='')
+            rejects = csv.writer(rejects_out, lineterminator='\n')
+            if args.rejects is not None:
+                rejects.writerow(['record', 'username', 'reason'])
+            if args.path == '-':
+                source = sys.stdin.buffer
+            else:
+                source = open(args.path, 'rb')
+            try:
+                if fmt == 'csv':
+                    records = read_csv(io.TextIOWrapper(source, encoding='utf-8', newline=''))
+                else:
+                    records = read_fixed(source)
+                counts = import_users(system, records,
+                                      lambda record_no, username, reason:
+                                      rejects.writerow([record_no, username, reason]))
+            finally:
+                if source is not sys.stdin.buffer:
+                    source.close()
+                if rejects_out is not sys.stderr:
+                    rejects_out.close()
+            for message, count in sorted(counts.items()):
+                print(f"{count:>12}  {message}", file=sys.stderr)
+            done = sum(counts.values())
+        else:
+            if fmt == 'csv':
+                out = sys.stdout if args.path == '-' else open(args.path, 'w', newline='')
+            else:
+                out = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+            try:
+                done = export_users(system, out, fmt)
+            finally:
+                if out not in (sys.stdout, sys.stdout.buffer):
+                    out.close()
+    finally:
+        if log is not None:
+            log.checkpoint(system)
+            log.close()
+        system.close()
+
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"{args.command.upper()}ED {done} RECORDS IN {elapsed:.2f}s ({rate:,.0f} REC/S)",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+COBOL CODEC - MAINFRAME USER-TABLE / SESSION-TABLE DATASETS
+Decodes and encodes fixed-length USER-ENTRY and SESSION-ENTRY records in
+EBCDIC (cp037) or ASCII
+
+Whole buffers are converted with one bytes.translate() into the native
+record layout used by compact storage (Latin-1 text, ASCII digits), then
+checked column by column with strided slices, so no Python code runs per
+field. PIC X fields are space padded. PIC 9 fields are unsigned zoned
+decimal: digits in the F zone, with a C (positive) sign nibble allowed on
+the last digit, which is normalized to F. A D (negative) sign nibble or a
+non-digit makes the record invalid.
+
+load_dataset() converts and checks both datasets in full, then copies the
+records straight into a compact or mapped UserManagementSystem's table
+buffers with one load_records() call, so a dataset that fails to convert
+or does not fit loads nothing.
+
+Usage:
+    python cobol_codec.py load --users USERS.EBCDIC [--sessions SESSIONS.EBCDIC]
+                               --data-file ums.dat [--codepage cp037]
+    python cobol_codec.py dump --users USERS.EBCDIC [--sessions SESSIONS.EBCDIC]
+                               --data-file ums.dat [--codepage cp037]
+"""
+
+import argparse
+import struct
+import sys
+import time
+
+from modern_app import PROFILES, UserManagementSystem
+from record_storage import SESSION_LAYOUT, TEXT_ENCODING, USER_LAYOUT, RecordTable
+
+CODEPAGES = ('cp037', 'ascii')
+
+# Records converted per chunk when streaming files
+CHUNK_RECORDS = 65536
+
+_IDENTITY = bytes(range(256))
+_DIGITS = b'0123456789'
+# Positive overpunch on the last digit once translated: EBCDIC C0-C9 are
+# '{', 'A'-'I' in cp037; an ASCII dataset converted as text carries the same
+_POSITIVE_SIGN = bytes.maketrans(b'{ABCDEFGHI', _DIGITS)
+
+
+def _tables(codepage):
+    """(to native, from native) translate tables for a codepage"""
+    if codepage == 'ascii':
+        return _IDENTITY, _IDENTITY
+    if codepage != 'cp037':
+        raise ValueError(f"unknown codepage: {codepage!r}")
+    # cp037 is a permutation of Latin-1, so both directions are byte maps
+    to_native = _IDENTITY.decode('cp037').encode(TEXT_ENCODING)
+    from_native = bytearray(256)
+    for ebcdic, native in enumerate(to_native):
+        from_native[native] = ebcdic
+    return to_native, bytes(from_native)
+
+
+class RecordCodec:
+    """Converts one record layout between a dataset codepage and native bytes"""
+
+    def __init__(self, layout, codepage='cp037'):
+        self.layout = layout
+        self.codepage = codepage
+        self._to_native, self._from_native = _tables(codepage)
+        self.struct = struct.Struct(''.join(f'{length}s' for _, _, length in layout))
+        self.record_length = self.struct.size
+        # Byte offsets of every PIC 9 digit, and of each field's last digit
+        self._digit_columns = []
+        self._sign_columns = []
+        offset = 0
+        for _, kind, length in layout:
+            if kind == '9':
+                self._digit_columns.extend(range(offset, offset + length))
+                self._sign_columns.append(offset + length - 1)
+            offset += length
+
+    def to_native(self, data, first_record=1):
+        """Native record bytes for a whole number of dataset records
+
+        ASCII data without sign nibbles is returned as is. Raises ValueError
+        naming the first invalid record, counting data's first as first_record.
+        """
+        if len(data) % self.record_length:
+            raise ValueError(f"dataset is not a whole number of {self.record_length}-byte records")
+        native = data if self.codepage == 'ascii' else data.translate(self._to_native)
+        step = self.record_length
+        for column in self._sign_columns:
+            signs = native[column::step]
+            if signs.translate(None, _DIGITS):
+                native = bytearray(native)
+                native[column::step] = signs.translate(_POSITIVE_SIGN)
+        for column in self._digit_columns:
+            if native[column::step].translate(None, _DIGITS):
+                record_no = self._first_bad(native, column, first_record)
+                raise ValueError(f"record {record_no}: PIC 9 field is not unsigned zoned decimal")
+        return native
+
+    def _first_bad(self, native, column, first_record):
+        for record_no, value in enumerate(native[column::self.record_length], first_record):
+            if value not in _DIGITS:
+                return record_no
+
+    def from_native(self, data):
+        """Dataset bytes for native record bytes"""
+        if self.codepage == 'ascii':
+            return bytes(data)
+        return bytes(data).translate(self._from_native)
+
+    def iter_rows(self, data):
+        """Yield each record of a dataset as a tuple of field values"""
+        native = self.to_native(data)
+        kinds = [kind for _, kind, _ in self.layout]
+        for fields in self.struct.iter_unpack(native):
+            yield tuple(value.decode(TEXT_ENCODING).rstrip(' ') if kind == 'X' else int(value)
+                        for kind, value in zip(kinds, fields))
+
+    def encode_rows(self, rows):
+        """Dataset bytes for an iterable of field-value tuples"""
+        table = RecordTable(self.layout, 0)
+        for row in rows:
+            table.append(dict(zip((name for name, _, _ in self.layout), row)))
+        return self.from_native(table.buffer)
+
+
+def read_chunks(stream, record_length):
+    """Yield whole-record chunks of a binary stream"""
+    size = record_length * CHUNK_RECORDS
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        while len(chunk) % record_length:
+            more = stream.read(record_length - len(chunk) % record_length)
+            if not more:
+                break
+            chunk += more
+        yield chunk
+
+
+def load_dataset(system, users=None, sessions=None, codepage='cp037'):
+    """Load USER-TABLE / SESSION-TABLE dataset streams into system
+
+    Both streams are read and converted chunk by chunk before anything is
+    stored; a ValueError leaves system as it was.
+    Returns (users loaded, sessions loaded, bytes read).
+    """
+    staged = [bytearray(), bytearray()]
+    size = 0
+    for position, (stream, layout) in enumerate(((users, USER_LAYOUT), (sessions, SESSION_LAYOUT))):
+        if stream is None:
+            continue
+        codec = RecordCodec(layout, codepage)
+        records = 0
+        for chunk in read_chunks(stream, codec.record_length):
+            staged[position] += codec.to_native(chunk, first_record=records + 1)
+            records += len(chunk) // codec.record_length
+            size += len(chunk)
+    return system.load_records(*staged) + (size,)
+
+
+def dump_dataset(system, users=None, sessions=None, codepage='cp037'):
+    """Write USER-TABLE / SESSION-TABLE to binary streams as dataset records"""
+    for stream, table, count, layout in ((users, system.user_table, system.user_count, USER_LAYOUT),
+                                         (sessions, system.session_table, system.session_count,
+                                          SESSION_LAYOUT)):
+        if stream is None:
+            continue
+        codec = RecordCodec(layout, codepage)
+        names = [name for name, _, _ in layout]
+        for start in range(0, count, CHUNK_RECORDS):
+            end = min(count, start + CHUNK_RECORDS)
+            if isinstance(table, RecordTable):
+                native = table.buffer[start * codec.record_length:end * codec.record_length]
+                stream.write(codec.from_native(native))
+            else:
+                stream.write(codec.encode_rows(tuple(table[idx][name] for name in names)
+                                               for idx in range(start, end)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load or dump mainframe USER/SESSION datasets")
+    parser.add_argument('command', choices=['load', 'dump'])
+    parser.add_argument('--users', help="USER-TABLE dataset file")
+    parser.add_argument('--sessions', help="SESSION-TABLE dataset file")
+    parser.add_argument('--codepage', default='cp037', choices=CODEPAGES)
+    parser.add_argument('--data-file', required=True, help="memory-mapped data file")
+    parser.add_argument('--profile', default='scaled', choices=sorted(PROFILES))
+    args = parser.parse_args(argv)
+
+    mode = 'rb' if args.command == 'load' else 'wb'
+    streams = [open(path, mode) if path else None for path in (args.users, args.sessions)]
+    system = UserManagementSystem(storage='mapped', data_file=args.data_file, profile=args.profile)
+    started = time.perf_counter()
+    try:
+        if args.command == 'load':
+            users, sessions, size = load_dataset(system, *streams, codepage=args.codepage)
+        else:
+            dump_dataset(system, *streams, codepage=args.codepage)
+            users, sessions = system.user_count, system.session_count
+            size = sum(stream.tell() for stream in streams if stream is not None)
+    except ValueError as e:
+        print(f"{args.command.upper()} FAILED: {e}", file=sys.stderr)
+        return 1
+    finally:
+        for stream in streams:
+            if stream is not None:
+                stream.close()
+        system.close()
+    elapsed = time.perf_counter() - started
+
+    rate = size / elapsed / 1e6 if elapsed > 0 else 0.0
+    print(f"{args.command.upper()}: {users} USERS, {sessions} SESSIONS, {size:,} BYTES "
+          f"IN {elapsed:.3f}s ({rate:,.0f} MB/S)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+COLUMNAR STORAGE - NUMPY COLUMN TABLES
+Holds USER-TABLE and SESSION-TABLE as one NumPy array per field
+
+PIC X(n) fields are fixed-width byte-string arrays (dtype S<n>, Latin-1,
+truncated to the field width like compact storage) and PIC 9 fields are
+integer arrays. Whole-table questions - which sessions are active, which
+belong to a user, how many users are active - become one vectorized
+comparison over a column instead of a Python loop over rows, and raw
+USER-ENTRY / SESSION-ENTRY records are loaded a column at a time.
+
+NumPy is optional: without it column_table() returns a compact RecordTable,
+and find_rows() / count_rows() / field_values() loop over the rows of any
+table (dict rows, RecordTables or ColumnTables) with the same results.
+"""
+
+from collections.abc import Mapping
+
+from lazy_table import LazyTable
+from record_storage import TEXT_ENCODING, RecordTable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _int_dtype(length):
+    """Smallest signed integer dtype holding a PIC 9(length) value"""
+    for dtype, digits in (('i1', 2), ('i2', 4), ('i4', 9)):
+        if length <= digits:
+            return dtype
+    return 'i8'
+
+
+class ColumnView(Mapping):
+    """Dict-style view of one row of a ColumnTable"""
+
+    __slots__ = ('_table', '_idx')
+
+    def __init__(self, table, idx):
+        self._table = table
+        self._idx = idx
+
+    def __getitem__(self, field):
+        value = self._table.columns[field][self._idx]
+        if self._table.fields[field][0] == 'X':
+            return value.decode(TEXT_ENCODING)
+        return int(value)
+
+    def __setitem__(self, field, value):
+        table = self._table
+        table.columns[field][self._idx] = table.encode(field, value)
+        if field == table.key_field:
+            table.generation += 1
+
+    def __contains__(self, field):
+        return field in self._table.fields
+
+    def __iter__(self):
+        return iter(self._table.fields)
+
+    def __len__(self):
+        return len(self._table.fields)
+
+    def __repr__(self):
+        return f"ColumnView({dict(self)!r})"
+
+
+class ColumnTable:
+    """Fixed-width rows stored column by column in NumPy arrays
+
+    Indexing returns a ColumnView that reads and writes through to the
+    arrays. columns maps each field to an array of at least size rows;
+    append() doubles the arrays when they are full. generation counts
+    writes to the key field (the layout's first) and write_records() calls.
+    """
+
+    def __init__(self, layout, size):
+        if numpy is None:
+            raise RuntimeError("columnar storage needs NumPy")
+        self.layout = layout
+        self.fields = {name: (kind, length) for name, kind, length in layout}
+        self.record_length = sum(length for _, _, length in layout)
+        self.key_field = layout[0][0]
+        self.generation = 0
+        self.size = size
+        self.columns = {name: numpy.zeros(size, f'S{length}' if kind == 'X' else _int_dtype(length))
+                        for name, kind, length in layout}
+        # Raw record layout, for loading USER-ENTRY / SESSION-ENTRY bytes
+        self._record_dtype = numpy.dtype([(name, f'S{length}') for name, _, length in layout])
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError("record index out of range")
+        return ColumnView(self, idx)
+
+    def encode(self, field, value):
+        """Column value for a field value (PIC X truncation, PIC 9 low-order digits)"""
+        kind, length = self.fields[field]
+        if kind == 'X':
+            return value.encode(TEXT_ENCODING, 'replace')[:length].rstrip(b' ')
+        return abs(int(value)) % 10 ** length
+
+    def _reserve(self, rows):
+        capacity = len(next(iter(self.columns.values())))
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2, 16)
+        for name, column in self.columns.items():
+            grown = numpy.zeros(capacity, column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def append(self, values):
+        """Add a row built from a field -> value mapping"""
+        self._reserve(self.size + 1)
+        for name, column in self.columns.items():
+            column[self.size] = self.encode(name, values[name])
+        self.size += 1
+
+    def write_records(self, idx, data):
+        """Store raw fixed-width records in rows idx onwards, one column at a time"""
+        count, extra = divmod(len(data), self.record_length)
+        if extra:
+            raise ValueError(f"data is not a whole number of {self.record_length}-byte records")
+        records = numpy.frombuffer(data, dtype=self._record_dtype, count=count)
+        self._reserve(idx + count)
+        for name, (kind, length) in self.fields.items():
+            raw = records[name]
+            if kind == 'X':
+                self.columns[name][idx:idx + count] = numpy.char.rstrip(raw, b' ')
+            else:
+                self.columns[name][idx:idx + count] = raw.astype('i8') % 10 ** length
+        self.generation += 1
+        self.size = max(self.size, idx + count)
+        return count
+
+    def _mask(self, count, criteria):
+        mask = numpy.ones(count, bool)
+        for field, value in criteria.items():
+            mask &= self.columns[field][:count] == self.encode(field, value)
+        return mask
+
+    def find(self, count, criteria):
+        """Rows below count whose fields equal criteria's values"""
+        return numpy.flatnonzero(self._mask(count, criteria)).tolist()
+
+    def count(self, count, criteria):
+        """Number of rows below count whose fields equal criteria's values"""
+        return int(numpy.count_nonzero(self._mask(count, criteria)))
+
+    def values(self, field, rows):
+        """Field values of the given rows, as Python strings or ints"""
+        column = self.columns[field]
+        if isinstance(rows, range) and rows.step == 1:
+            picked = column[rows.start:rows.stop]
+        else:
+            picked = column[numpy.asarray(rows, dtype='i8')]
+        if self.fields[field][0] == 'X':
+            return [value.decode(TEXT_ENCODING) for value in picked.tolist()]
+        return picked.tolist()
+
+
+def column_table(layout, size=0):
+    """ColumnTable of size blank rows, or a compact RecordTable without NumPy"""
+    if numpy is None:
+        return RecordTable(layout, size)
+    return ColumnTable(layout, size)
+
+
+def find_rows(table, count, **criteria):
+    """Slots below count whose fields equal the keyword values, in table order"""
+    if isinstance(table, (ColumnTable, LazyTable)):
+        return table.find(count, criteria)
+    return [idx for idx in range(count)
+            if all(table[idx][field] == value for field, value in criteria.items())]
+
+
+def count_rows(table, count, **criteria):
+    """Number of slots below count whose fields equal the keyword values"""
+    if isinstance(table, (ColumnTable, LazyTable)):
+        return table.count(count, criteria)
+    return sum(1 for idx in range(count)
+               if all(table[idx][field] == value for field, value in criteria.items()))
+
+
+def field_values(table, field, slots):
+    """Value of one field for each slot"""
+    if isinstance(table, (ColumnTable, LazyTable)):
+        return table.values(field, slots)
+    return [table[idx][field] for idx in slots]
@@ -0,0 +1,313 @@
+"""
+COW STORAGE - COPY-ON-WRITE PAGED TABLES AND READ SNAPSHOTS
+Compact records kept in fixed-size pages that read snapshots share with the live table
+
+A CowRecordTable holds the same USER-ENTRY / SESSION-ENTRY bytes as a
+compact RecordTable, split into pages of page_rows records. freeze()
+hands out a FrozenRecords view that keeps references to the current
+pages instead of copying them. Each freeze starts a new epoch; while any
+view is open, a writer about to change a page from an older epoch first
+replaces it with a private copy, so the views never see a later write.
+Each page is copied at most once per snapshot and only if it is written.
+Once every view is released, writes go straight to the pages again.
+
+TablesSnapshot pairs a frozen user table and session table taken at the
+same moment (UserManagementSystem.snapshot()) and answers the reporting
+questions from them without touching the live system's locks.
+"""
+
+import threading
+import weakref
+from collections import Counter
+from collections.abc import Mapping, Sequence
+
+from record_storage import TEXT_ENCODING, blank_record, encode_field
+from snapshot import SESSION_FIELDS, USER_FIELDS, write_columns
+
+PAGE_ROWS = 1024
+
+
+def _decode(kind, raw):
+    if kind == 'X':
+        return bytes(raw).decode(TEXT_ENCODING).rstrip(' ')
+    return int(raw)
+
+
+class PagedRecordView(Mapping):
+    """Dict-style view of one record of a CowRecordTable"""
+
+    __slots__ = ('_table', '_idx')
+
+    def __init__(self, table, idx):
+        self._table = table
+        self._idx = idx
+
+    def __getitem__(self, field):
+        return self._table.read(self._idx, field)
+
+    def __setitem__(self, field, value):
+        self._table.write(self._idx, field, value)
+
+    def __contains__(self, field):
+        return field in self._table.fields
+
+    def __iter__(self):
+        return iter(self._table.fields)
+
+    def __len__(self):
+        return len(self._table.fields)
+
+    def __repr__(self):
+        return f"PagedRecordView({dict(self)!r})"
+
+
+class CowRecordTable:
+    """Fixed-width records in copy-on-write pages
+
+    Same row interface as RecordTable: indexing returns a dict-style view
+    whose writes go through write(). size rows are preallocated blank.
+    generation counts writes to the key field and write_records() calls.
+    """
+
+    def __init__(self, layout, size, page_rows=PAGE_ROWS):
+        self.layout = layout
+        self.fields = {}
+        offset = 0
+        for name, kind, length in layout:
+            self.fields[name] = (offset, length, kind)
+            offset += length
+        self.record_length = offset
+        self.key_field = layout[0][0]
+        self.generation = 0
+        self.page_rows = page_rows
+        self._blank_page = blank_record(layout) * page_rows
+        self.pages = []
+        self._page_epochs = []
+        self.epoch = 0
+        self.page_copies = 0
+        # Open FrozenRecords views; pages are only copied while there are any
+        self._readers = 0
+        self._readers_lock = threading.Lock()
+        self.size = 0
+        self._reserve(size)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError("record index out of range")
+        return PagedRecordView(self, idx)
+
+    def _reserve(self, size):
+        while len(self.pages) * self.page_rows < size:
+            self.pages.append(bytearray(self._blank_page))
+            self._page_epochs.append(self.epoch)
+
+    def _writable(self, page_no):
+        """Page page_no, copied first if an open view may still be reading it"""
+        if self._readers and self._page_epochs[page_no] != self.epoch:
+            # Writers holding different row locks can share a page: copy it
+            # once, and have every one of them write to the published copy
+            with self._readers_lock:
+                if self._readers and self._page_epochs[page_no] != self.epoch:
+                    self.pages[page_no] = bytearray(self.pages[page_no])
+                    self._page_epochs[page_no] = self.epoch
+                    self.page_copies += 1
+        return self.pages[page_no]
+
+    def read(self, idx, field):
+        """Value of one field of record idx"""
+        page_no, row = divmod(idx, self.page_rows)
+        start, length, kind = self.fields[field]
+        start += row * self.record_length
+        return _decode(kind, self.pages[page_no][start:start + length])
+
+    def write(self, idx, field, value):
+        """Store one field of record idx"""
+        page_no, row = divmod(idx, self.page_rows)
+        start, length, kind = self.fields[field]
+        start += row * self.record_length
+        self._writable(page_no)[start:start + length] = encode_field(kind, length, value)
+        if field == self.key_field:
+            self.generation += 1
+
+    def append(self, values):
+        """Add a record built from a field -> value mapping"""
+        record = b''.join(encode_field(kind, length, values[name])
+                          for name, kind, length in self.layout)
+        self.write_records(self.size, record)
+
+    def write_records(self, idx, data):
+        """Copy raw records into slots idx onwards, growing the table if needed"""
+        count, extra = divmod(len(data), self.record_length)
+        if extra:
+            raise ValueError(f"data is not a whole number of {self.record_length}-byte records")
+        self._reserve(idx + count)
+        page_bytes = self.page_rows * self.record_length
+        view = memoryview(data)
+        position = idx * self.record_length
+        done = 0
+        while done < len(data):
+            page_no, start = divmod(position, page_bytes)
+            step = min(page_bytes - start, len(data) - done)
+            self._writable(page_no)[start:start + step] = view[done:done + step]
+            position += step
+            done += step
+        self.generation += 1
+        self.size = max(self.size, idx + count)
+        return count
+
+    def freeze(self, count):
+        """Read-only FrozenRecords view of the first count records
+
+        Call while no writer is running (UserManagementSystem.snapshot()
+        holds every table lock); the view stays valid after they resume.
+        """
+        with self._readers_lock:
+            self.epoch += 1
+            self._readers += 1
+        pages = tuple(self.pages[:-(-count // self.page_rows)])
+        return FrozenRecords(self, pages, count)
+
+    def _release(self):
+        with self._readers_lock:
+            self._readers -= 1
+
+
+class FrozenRecords(Sequence):
+    """Immutable view of a CowRecordTable at one epoch; rows read as dicts"""
+
+    def __init__(self, table, pages, count):
+        self.fields = table.fields
+        self._pages = pages
+        self._count = count
+        self._page_rows = table.page_rows
+        self._record_length = table.record_length
+        # Releasing the view (or dropping it) lets writers stop copying
+        self._finalizer = weakref.finalize(self, table._release)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._count))]
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError("record index out of range")
+        page_no, row = divmod(idx, self._page_rows)
+        page = self._pages[page_no]
+        offset = row * self._record_length
+        return {field: _decode(kind, page[offset + start:offset + start + length])
+                for field, (start, length, kind) in self.fields.items()}
+
+    def values(self, field, slots=None):
+        """Value of one field for each slot (default: every row), page by page"""
+        start, length, kind = self.fields[field]
+        if slots is not None:
+            return [self[idx][field] for idx in slots]
+        ws_values = []
+        step = self._record_length
+        for page_no, page in enumerate(self._pages):
+            rows = min(self._page_rows, self._count - page_no * self._page_rows)
+            raw = [page[offset:offset + length]
+                   for offset in range(start, start + rows * step, step)]
+            if kind == 'X':
+                ws_values.extend(bytes(value).decode(TEXT_ENCODING).rstrip(' ') for value in raw)
+            else:
+                ws_values.extend(map(int, raw))
+        return ws_values
+
+    def release(self):
+        """Stop protecting these pages from writers (the view must not be used after)"""
+        self._finalizer()
+
+
+class FrozenColumns(Sequence):
+    """Immutable view built from copied columns (snapshots of other storages)"""
+
+    def __init__(self, fields, columns):
+        self.fields = dict.fromkeys(fields)
+        self._columns = dict(zip(fields, columns))
+        self._count = len(columns[0])
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._count))]
+        if idx < -self._count or idx >= self._count:
+            raise IndexError("record index out of range")
+        return {field: column[idx] for field, column in self._columns.items()}
+
+    def values(self, field, slots=None):
+        """Value of one field for each slot (default: every row)"""
+        column = self._columns[field]
+        if slots is None:
+            return list(column)
+        return [column[idx] for idx in slots]
+
+    def release(self):
+        """Nothing to release: the columns are private copies"""
+
+
+class TablesSnapshot:
+    """Consistent read-only view of USER-TABLE and SESSION-TABLE at one moment
+
+    user_table / session_table are sequences of row dicts (user_count and
+    session_count rows). Use as a context manager, or call close(), so
+    copy-on-write tables stop copying pages for it.
+    """
+
+    def __init__(self, version, user_table, session_table):
+        self.version = version
+        self.user_table = user_table
+        self.session_table = session_table
+        self.user_count = len(user_table)
+        self.session_count = len(session_table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the view's pages"""
+        self.user_table.release()
+        self.session_table.release()
+
+    def active_users(self):
+        """Usernames with USER-ACTIVE = 1, in slot order"""
+        return [ws_username for ws_username, active in zip(self.user_table.values('user_name'),
+                                                            self.user_table.values('user_active'))
+                if active == 1]
+
+    def active_sessions(self):
+        """(token, username) of every active session, in slot order"""
+        return [(token, ws_username) for token, ws_username, active in zip(
+                    self.session_table.values('session_token'),
+                    self.session_table.values('session_user'),
+                    self.session_table.values('session_active'))
+                if active == 1]
+
+    def sessions_per_user(self):
+        """Username -> number of active sessions"""
+        return dict(Counter(ws_username for _, ws_username in self.active_sessions()))
+
+    def columns(self):
+        """(users, sessions) as one list per field, in snapshot.py field order"""
+        return ([self.user_table.values(field) for field in USER_FIELDS],
+                [self.session_table.values(field) for field in SESSION_FIELDS])
+
+    def save(self, path):
+        """Export both tables as a snapshot file (loadable with load_snapshot())"""
+        users, sessions = self.columns()
+        write_columns(path, 0, users, sessions)
+        return self.user_count, self.session_count
@@ -0,0 +1,522 @@
+"""
+DIFFERENTIAL TEST - REFERENCE ENGINE VS OPTIMIZED BACKENDS
+Runs seeded random transaction sequences against a linear-scan reference
+and every UserManagementSystem backend, comparing them step by step
+
+The reference engine is the original line-by-line translation of
+legacy_app.cob: each lookup is a PERFORM VARYING loop over plain dict
+tables, with no indexes, token pools or caches. Sequences are generated to
+hit duplicate usernames, full user and session tables, the per-user
+session cap, invalid and stale tokens, wrong passwords and PIC X(20)
+truncation. After every step the result and the rows the reference touched
+must match; the whole tables and the index consistency checks are compared
+every --full-check-every steps and at the end.
+
+Session tokens are random, so a sequence never names one: change password
+uses "the n-th token this engine issued" (or a token no engine issues), and
+tokens are compared by the order they were issued in. Engines reuse the
+tokens of ended sessions, so a token alone does not name one session:
+table rows are numbered by (token, slot) as of the login that wrote them,
+and a reference to a session whose token has since gone to a later login
+is passed as a token no session holds, as the ended session's would be.
+
+Seeds are spread over a process pool. A failing sequence is shrunk to a
+minimal reproducer (delta debugging over its operations), which is printed
+as JSON and can be re-run with --replay.
+
+Usage:
+    python differential_test.py [--sequences 200] [--length 5000] [--seed 1]
+                                [--workers N] [--engines dict,compact,columnar,mapped,threadsafe,cow]
+    python differential_test.py --replay failure.json
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from modern_app import (INVALID_CREDENTIALS, INVALID_SESSION_TOKEN, LOGIN_APPROVED,
+                        OLD_PASSWORD_INCORRECT, PASSWORD_CHANGED, SESSION_LIMIT_REACHED,
+                        SESSION_TABLE_FULL, SESSION_USER_MISSING, USER_DATABASE_FULL,
+                        USER_REGISTERED, USERNAME_EXISTS, Result, UserManagementSystem)
+from record_storage import USER_LAYOUT, fit_text
+
+# Width of the PIC X fields in the fixed-width backends
+FIELD_WIDTH = USER_LAYOUT[0][2]
+
+# Tokens no engine ever issues (outside 100000-999999 or never drawn)
+BAD_TOKENS = (0, 99999, 1000000)
+
+FULL_CHECK_EVERY = 100
+
+# Operation mix: kind -> weight
+OPERATION_WEIGHTS = {
+    'register': 25,
+    'login': 35,
+    'update_password': 25,
+    'list_sessions': 5,
+    'deactivate_user_sessions': 4,
+    'active_sessions': 3,
+    'count_active_users': 3,
+}
+
+
+class ReferenceEngine:
+    """The legacy transactions as plain linear scans over dict tables
+
+    field_width applies COBOL ACCEPT truncation (for the fixed-width
+    backends). Sessions ended by deactivate_user_sessions() free their
+    slots, most recently freed first. touched lists the (table, slot) rows
+    the last transactions wrote.
+    """
+
+    def __init__(self, max_users, max_sessions, max_sessions_per_user=None, field_width=None,
+                 seed=0):
+        self.max_users = max_users
+        self.max_sessions = max_sessions
+        self.max_sessions_per_user = max_sessions_per_user
+        self.field_width = field_width
+        self.storage = 'reference'
+        self.user_table = []
+        self.session_table = []
+        self.user_count = 0
+        self.session_count = 0
+        self.free_sessions = []
+        self.touched = []
+        self._random = random.Random(seed)
+
+    def _accept(self, value):
+        if self.field_width is None:
+            return value
+        return fit_text(value, self.field_width)
+
+    def register(self, username, password):
+        ws_username = self._accept(username)
+        ws_password = self._accept(password)
+        for user_idx in range(self.user_count):
+            if self.user_table[user_idx]['user_name'] == ws_username:
+                return Result(USERNAME_EXISTS)
+        if self.user_count >= self.max_users:
+            return Result(USER_DATABASE_FULL)
+        self.user_table.append({'user_name': ws_username, 'user_password': ws_password,
+                                'user_active': 1})
+        self.user_count += 1
+        self.touched.append(('user', self.user_count - 1))
+        return Result(USER_REGISTERED)
+
+    def login(self, username, password):
+        ws_username = self._accept(username)
+        ws_password = self._accept(password)
+        ws_user_found = 0
+        for user_idx in range(self.user_count):
+            entry = self.user_table[user_idx]
+            if entry['user_name'] == ws_username:
+                if entry['user_password'] == ws_password:
+                    if entry['user_active'] == 1:
+                        ws_user_found = 1
+                        break
+        if ws_user_found == 0:
+            return Result(INVALID_CREDENTIALS)
+
+        if (self.max_sessions_per_user is not None
+                and len(self._session_slots(ws_username)) >= self.max_sessions_per_user):
+            return Result(SESSION_LIMIT_REACHED)
+        if self.free_sessions:
+            sess_idx = self.free_sessions.pop()
+        elif self.session_count < self.max_sessions:
+            sess_idx = self.session_count
+            self.session_table.append({})
+            self.session_count += 1
+        else:
+            return Result(SESSION_TABLE_FULL)
+
+        live = {entry['session_token'] for entry in self.session_table
+                if entry and entry['session_active'] == 1}
+        ws_random_num = int(self._random.random() * 900000 + 100000)
+        while ws_random_num in live:
+            ws_random_num = int(self._random.random() * 900000 + 100000)
+        self.session_table[sess_idx] = {'session_token': ws_random_num,
+                                        'session_user': ws_username, 'session_active': 1}
+        self.touched.append(('session', sess_idx))
+        return Result(LOGIN_APPROVED, ws_random_num)
+
+    def update_password(self, token, old_password, new_password):
+        ws_old_password = self._accept(old_password)
+        ws_new_password = self._accept(new_password)
+        ws_temp_user = None
+        for sess_idx in range(self.session_count):
+            entry = self.session_table[sess_idx]
+            if entry['session_token'] == token and entry['session_active'] == 1:
+                ws_temp_user = entry['session_user']
+                break
+        if ws_temp_user is None:
+            return Result(INVALID_SESSION_TOKEN)
+
+        for user_idx in range(self.user_count):
+            entry = self.user_table[user_idx]
+            if entry['user_name'] == ws_temp_user:
+                if entry['user_password'] != ws_old_password:
+                    return Result(OLD_PASSWORD_INCORRECT)
+                entry['user_password'] = ws_new_password
+                self.touched.append(('user', user_idx))
+                return Result(PASSWORD_CHANGED)
+        return Result(SESSION_USER_MISSING)
+
+    def _session_slots(self, ws_username):
+        return [sess_idx for sess_idx in range(self.session_count)
+                if self.session_table[sess_idx]['session_user'] == ws_username
+                and self.session_table[sess_idx]['session_active'] == 1]
+
+    def list_sessions(self, username):
+        return [self.session_table[sess_idx]['session_token']
+                for sess_idx in self._session_slots(self._accept(username))]
+
+    def deactivate_user_sessions(self, username):
+        slots = self._session_slots(self._accept(username))
+        for sess_idx in slots:
+            self.session_table[sess_idx]['session_active'] = 0
+            self.free_sessions.append(sess_idx)
+            self.touched.append(('session', sess_idx))
+        return len(slots)
+
+    def active_sessions(self):
+        return [(entry['session_token'], entry['session_user'])
+                for entry in self.session_table[:self.session_count]
+                if entry['session_active'] == 1]
+
+    def count_active_users(self):
+        return sum(1 for entry in self.user_table[:self.user_count] if entry['user_active'] == 1)
+
+
+class Subject:
+    """One engine under test, with its tokens numbered in issue order"""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.issued = []
+        # Token -> its latest issue number (the live session, if any)
+        self.issue_no = {}
+        # (token, session slot) -> issue number of the login that wrote the row
+        self.slot_issue = {}
+
+    def token(self, ref):
+        """Token for a sequence's token reference"""
+        if ref < 0:
+            return BAD_TOKENS[-ref - 1]
+        if not self.issued:
+            return BAD_TOKENS[0]
+        ref %= len(self.issued)
+        token = self.issued[ref]
+        if self.issue_no[token] != ref:
+            # That session ended and a later login reuses its token
+            return BAD_TOKENS[0]
+        return token
+
+    def _slot_of(self, token):
+        """Slot of the active session holding token"""
+        for sess_idx in range(self.engine.session_count):
+            entry = self.engine.session_table[sess_idx]
+            if entry['session_token'] == token and entry['session_active'] == 1:
+                return sess_idx
+        return None
+
+    def execute(self, operation):
+        """Run one operation; returns its outcome with tokens as issue numbers"""
+        kind, *args = operation
+        if kind == 'update_password':
+            ref, old_password, new_password = args
+            return self.engine.update_password(self.token(ref), old_password, new_password).code
+        result = getattr(self.engine, kind)(*args)
+        if kind == 'login':
+            if result.token is None:
+                return result.code, None
+            issue = len(self.issued)
+            self.issue_no[result.token] = issue
+            self.slot_issue[(result.token, self._slot_of(result.token))] = issue
+            self.issued.append(result.token)
+            return result.code, issue
+        if kind == 'register':
+            return result.code
+        if kind == 'list_sessions':
+            return [self.issue_no.get(token, token) for token in result]
+        if kind == 'active_sessions':
+            return [(self.issue_no.get(token, token), ws_username) for token, ws_username in result]
+        return result
+
+    def row(self, table, idx):
+        """A table row as a comparable tuple"""
+        if table == 'user':
+            entry = self.engine.user_table[idx]
+            return entry['user_name'], entry['user_password'], entry['user_active']
+        entry = self.engine.session_table[idx]
+        token = entry['session_token']
+        return self.slot_issue.get((token, idx), token), entry['session_user'], entry['session_active']
+
+    def state(self):
+        """Both tables up to their counts"""
+        return ([self.row('user', idx) for idx in range(self.engine.user_count)],
+                [self.row('session', idx) for idx in range(self.engine.session_count)])
+
+
+def _make_system(options, limits, directory):
+    options = dict(options)
+    hold_snapshot = options.pop('hold_snapshot', False)
+    if options.get('storage') == 'mapped':
+        options['data_file'] = os.path.join(directory, f'engine-{len(os.listdir(directory))}.dat')
+    system = UserManagementSystem(**limits, **options)
+    if hold_snapshot:
+        # Every write then runs with a read view open (copy-on-write path)
+        system.held_snapshot = system.snapshot()
+    return system
+
+
+# Engine name -> factory(limits, scratch directory)
+ENGINES = {
+    'dict': functools.partial(_make_system, {}),
+    'compact': functools.partial(_make_system, {'storage': 'compact'}),
+    'columnar': functools.partial(_make_system, {'storage': 'columnar'}),
+    'mapped': functools.partial(_make_system, {'storage': 'mapped', 'sync': 'explicit'}),
+    'threadsafe': functools.partial(_make_system, {'thread_safe': True}),
+    'cow': functools.partial(_make_system, {'storage': 'cow', 'hold_snapshot': True}),
+}
+
+
+def generate_sequence(seed, length):
+    """(limits, operations) for one seeded random transaction sequence"""
+    rng = random.Random(seed)
+    max_users = rng.choice([3, 10, 100])
+    limits = {
+        'profile': rng.choice(['legacy', 'scaled']),
+        'max_users': max_users,
+        'max_sessions': rng.choice([2, 10, 50]),
+        'max_sessions_per_user': rng.choice([None, None, 2, 5]),
+    }
+    # More names than slots, plus names that collide once fitted to PIC X(20)
+    names = [f'user{i}' for i in range(max_users * 3 // 2 + 1)]
+    names += ['', 'x' * FIELD_WIDTH, 'x' * FIELD_WIDTH + 'tail', 'bob', 'bob  ', ' bob',
+              'josé', 'user名']
+    passwords = ['pw', 'secret', 'p' * 25, 'pw  ', '']
+
+    # Operations are picked against a model run of the reference engine, so
+    # logins mostly use a real password and token references a real session
+    model = Subject('model', ReferenceEngine(max_users, limits['max_sessions'],
+                                             limits['max_sessions_per_user']))
+    users = model.engine.user_table
+    kinds = list(OPERATION_WEIGHTS)
+    weights = list(OPERATION_WEIGHTS.values())
+    operations = []
+    for kind in rng.choices(kinds, weights, k=length):
+        if kind == 'register':
+            operation = (kind, rng.choice(names), rng.choice(passwords))
+        elif kind == 'login':
+            if users and rng.random() < 0.9:
+                entry = rng.choice(users)
+                ws_password = entry['user_password'] if rng.random() < 0.8 else rng.choice(passwords)
+                operation = (kind, entry['user_name'], ws_password)
+            else:
+                operation = (kind, rng.choice(names), rng.choice(passwords))
+        elif kind == 'update_password':
+            old = rng.choice(passwords)
+            if model.issued and rng.random() < 0.85:
+                ref = rng.randrange(len(model.issued))
+                owner = [entry['session_user'] for entry in model.engine.session_table
+                         if entry['session_token'] == model.issued[ref]]
+                for entry in users:
+                    if owner and entry['user_name'] == owner[0] and rng.random() < 0.75:
+                        old = entry['user_password']
+                        break
+            else:
+                ref = -rng.randrange(1, len(BAD_TOKENS) + 1)
+            operation = (kind, ref, old, rng.choice(passwords))
+        elif kind in ('list_sessions', 'deactivate_user_sessions'):
+            name = rng.choice(users)['user_name'] if users else rng.choice(names)
+            operation = (kind, name)
+        else:
+            operation = (kind,)
+        model.execute(operation)
+        operations.append(operation)
+    return limits, operations
+
+
+def _compare_state(reference, subject):
+    """Description of the first difference in whole-table state, or None"""
+    expected_users, expected_sessions = reference.state()
+    users, sessions = subject.state()
+    for table, expected, actual in (('user', expected_users, users),
+                                    ('session', expected_sessions, sessions)):
+        if len(expected) != len(actual):
+            return f"{table} count {len(actual)}, reference {len(expected)}"
+        for idx, (want, got) in enumerate(zip(expected, actual)):
+            if want != got:
+                return f"{table} slot {idx} is {got!r}, reference {want!r}"
+    if isinstance(subject.engine, UserManagementSystem):
+        problems = subject.engine.check_user_index() + subject.engine.check_session_index()
+        if problems:
+            return f"index check: {problems[0]}"
+    return None
+
+
+def run_sequence(sequence, engines, full_check_every=FULL_CHECK_EVERY):
+    """Run a sequence on every engine and its reference
+
+    engines maps names to factory(limits, directory). Returns None if they
+    all agree, else (failing step, description).
+    """
+    limits, operations = sequence
+    directory = tempfile.mkdtemp(prefix='ums-diff-')
+    systems = []
+    try:
+        # One reference per field width, shared by the engines that use it
+        groups = {}
+        for name, factory in engines.items():
+            system = factory(limits, directory)
+            systems.append(system)
+            width = None if system.storage == 'dict' else FIELD_WIDTH
+            if width not in groups:
+                reference = ReferenceEngine(limits['max_users'], limits['max_sessions'],
+                                            limits['max_sessions_per_user'], width)
+                groups[width] = (Subject(f'reference(width={width})', reference), [])
+            groups[width][1].append(Subject(name, system))
+
+        last = len(operations) - 1
+        for step, operation in enumerate(operations):
+            for reference, subjects in groups.values():
+                reference.engine.touched.clear()
+                expected = reference.execute(operation)
+                for subject in subjects:
+                    try:
+                        outcome = subject.execute(operation)
+                    except Exception as e:
+                        return step, f"{subject.name}: {operation!r} raised {e!r}"
+                    if outcome != expected:
+                        return step, (f"{subject.name}: {operation!r} returned {outcome!r}, "
+                                      f"reference {expected!r}")
+                    if (subject.engine.user_count != reference.engine.user_count
+                            or subject.engine.session_count != reference.engine.session_count):
+                        return step, (f"{subject.name}: counts "
+                                      f"{subject.engine.user_count}/{subject.engine.session_count}, "
+                                      f"reference {reference.engine.user_count}/"
+                                      f"{reference.engine.session_count}")
+                    for table, idx in reference.engine.touched:
+                        if subject.row(table, idx) != reference.row(table, idx):
+                            return step, (f"{subject.name}: {table} slot {idx} is "
+                                          f"{subject.row(table, idx)!r}, reference "
+                                          f"{reference.row(table, idx)!r}")
+                    if (step + 1) % full_check_every == 0 or step == last:
+                        problem = _compare_state(reference, subject)
+                        if problem is not None:
+                            return step, f"{subject.name}: {problem}"
+        return None
+    finally:
+        for system in systems:
+            system.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def shrink(sequence, engines, full_check_every=FULL_CHECK_EVERY):
+    """Smallest failing sequence found by delta debugging; (sequence, failure)
+
+    Operations after the failing step are dropped, then chunks of halving
+    size are removed for as long as the sequence still fails.
+    """
+    limits, operations = sequence
+    failure = run_sequence(sequence, engines, full_check_every)
+    if failure is None:
+        raise ValueError("sequence does not fail")
+    operations = operations[:failure[0] + 1]
+    chunk = max(1, len(operations) // 2)
+    while True:
+        start = 0
+        while start < len(operations):
+            candidate = operations[:start] + operations[start + chunk:]
+            result = run_sequence((limits, candidate), engines, 1)
+            if result is not None:
+                operations, failure = candidate[:result[0] + 1], result
+            else:
+                start += chunk
+        if chunk == 1:
+            break
+        chunk //= 2
+    return (limits, operations), failure
+
+
+def check_seed(seed, length, engine_names, full_check_every=FULL_CHECK_EVERY):
+    """Worker: generate, run and (on failure) shrink one sequence
+
+    Returns (seed, transactions run, None) or (seed, transactions run,
+    (failure, reproducer)).
+    """
+    sequence = generate_sequence(seed, length)
+    engines = {name: ENGINES[name] for name in engine_names}
+    if run_sequence(sequence, engines, full_check_every) is None:
+        return seed, length, None
+    reproducer, failure = shrink(sequence, engines, full_check_every)
+    return seed, length, (failure, reproducer)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Differential test of the backends against "
+                                                 "the linear-scan reference engine")
+    parser.add_argument('--sequences', type=int, default=200)
+    parser.add_argument('--length', type=int, default=5000, help="transactions per sequence")
+    parser.add_argument('--seed', type=int, default=1, help="first sequence seed")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help="comma-separated engines to check (default: all)")
+    parser.add_argument('--full-check-every', type=int, default=FULL_CHECK_EVERY,
+                        help="compare whole tables every N steps")
+    parser.add_argument('--replay', help="re-run a JSON reproducer printed by a failed run")
+    args = parser.parse_args(argv)
+
+    engine_names = args.engines.split(',')
+    unknown = sorted(set(engine_names) - set(ENGINES))
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(unknown)}")
+
+    if args.replay:
+        with open(args.replay) as f:
+            data = json.load(f)
+        sequence = (data['limits'], [tuple(operation) for operation in data['operations']])
+        failure = run_sequence(sequence, {name: ENGINES[name] for name in engine_names}, 1)
+        if failure is None:
+            print("REPLAY PASSED")
+            return 0
+        print(f"REPLAY FAILED AT STEP {failure[0]}: {failure[1]}")
+        return 1
+
+    started = time.perf_counter()
+    checked = 0
+    failures = []
+    seeds = range(args.seed, args.seed + args.sequences)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for seed, count, failure in pool.map(check_seed, seeds, itertools.repeat(args.length),
+                                             itertools.repeat(engine_names),
+                                             itertools.repeat(args.full_check_every)):
+            checked += count
+            if failure is not None:
+                failures.append((seed, failure))
+                (step, problem), (limits, operations) = failure
+                print(f"SEED {seed} FAILED: {problem}")
+                print(json.dumps({'seed': seed, 'limits': limits, 'operations': operations}))
+
+    elapsed = time.perf_counter() - started
+    rate = checked / elapsed if elapsed > 0 else 0.0
+    print(f"CHECKED {checked:,} TRANSACTIONS IN {args.sequences} SEQUENCES ON "
+          f"{', '.join(engine_names)} IN {elapsed:.1f}s ({rate:,.0f} TX/S)")
+    if failures:
+        print(f"{len(failures)} SEQUENCES FAILED")
+        return 1
+    print("ALL ENGINES MATCH THE REFERENCE")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
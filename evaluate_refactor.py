@@ -1,46 +1,203 @@
 """
 EVALUATE REFACTOR - GRADING SYSTEM
 Grades the refactored Python code based on Behavior Tests, Code Quality and Legacy Compatibility.
+
+Behavior test cases run in parallel worker processes, each timed on its
+own. A section is skipped when the files it depends on (modern_app.py,
+behavior_tests.py, the local modules they import, and this grader) hash
+the same as in the cached report; its cached result is reused. The full
+report is also written as JSON.
+
+Usage:
+    python evaluate_refactor.py [--workers N] [--no-cache] [--json evaluation_report.json]
 """
 
+import argparse
+import ast
+import hashlib
+import json
+import os
+import time
 import unittest
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from io import StringIO
 from behavior_tests import TestUserManagementSystem
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Section results from the last run, keyed by the hashes of their inputs
+CACHE_FILE = os.path.join(HERE, '.evaluation_cache.json')
+REPORT_FILE = os.path.join(HERE, 'evaluation_report.json')
+
+# Files each section depends on (plus the local modules they import)
+SECTION_SOURCES = {
+    'behavior_tests': ('modern_app.py', 'behavior_tests.py'),
+    'code_quality': ('modern_app.py',),
+    'legacy_compatibility': ('modern_app.py',),
+}
+
+
+def local_sources(paths):
+    """paths plus every module in this directory they import, transitively"""
+    found = []
+    pending = [os.path.join(HERE, path) for path in paths]
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.exists(path):
+            continue
+        found.append(path)
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                pending.append(os.path.join(HERE, name.split('.')[0] + '.py'))
+    return sorted(found)
+
+
+def source_hashes(paths):
+    """{file name: sha256} for a section's inputs and this grader"""
+    hashes = {}
+    for path in local_sources(paths) + [os.path.abspath(__file__)]:
+        with open(path, 'rb') as f:
+            hashes[os.path.relpath(path, HERE)] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+class EvaluationCache:
+    """Section results from earlier runs, reused while their input hashes match"""
+
+    def __init__(self, path=CACHE_FILE, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.sections = {}
+        if enabled and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.sections = json.load(f)
+            except ValueError:
+                self.sections = {}
+
+    def get(self, section, inputs):
+        """Cached entry for section if its inputs are unchanged, else None"""
+        entry = self.sections.get(section)
+        if self.enabled and entry is not None and entry['inputs'] == inputs:
+            return entry
+        return None
+
+    def put(self, section, inputs, result, output=''):
+        """Store a section result and save the cache file"""
+        self.sections[section] = {'inputs': inputs, 'result': result, 'output': output}
+        if self.enabled:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.sections, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def _run_test(test_id):
+    """Worker: run one test case; returns its id, description, outcome, seconds and detail"""
+    suite = unittest.defaultTestLoader.loadTestsFromName(test_id)
+    test = next(iter(suite))
+    result = unittest.TestResult()
+    started = time.perf_counter()
+    suite.run(result)
+    elapsed = time.perf_counter() - started
+    outcome, detail = 'pass', ''
+    if result.errors:
+        outcome, detail = 'error', result.errors[0][1]
+    elif result.failures:
+        outcome, detail = 'fail', result.failures[0][1]
+    elif result.skipped:
+        outcome, detail = 'skip', result.skipped[0][1]
+    return {'id': test_id, 'description': test.shortDescription() or test_id,
+            'outcome': outcome, 'seconds': elapsed, 'detail': detail}
+
+
+def run_test_cases(test_case, workers=None):
+    """Run every test of a TestCase class, spread over worker processes
+
+    Returns one result dict per test (see _run_test), in suite order.
+    workers=1 runs them in this process.
+    """
+    test_ids = [test.id() for test in unittest.TestLoader().loadTestsFromTestCase(test_case)]
+    if workers == 1 or len(test_ids) < 2:
+        return [_run_test(test_id) for test_id in test_ids]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_test, test_ids))
+
+
+def behavior_test_results(workers=None, cache=None):
+    """(per-test results, cached?) for TestUserManagementSystem, from cache when unchanged"""
+    cache = EvaluationCache(enabled=False) if cache is None else cache
+    inputs = source_hashes(SECTION_SOURCES['behavior_tests'])
+    entry = cache.get('behavior_tests', inputs)
+    if entry is not None:
+        return entry['result']['tests'], True
+    tests = run_test_cases(TestUserManagementSystem, workers)
+    cache.put('behavior_tests', inputs, summarize_tests(tests))
+    return tests, False
+
+
+def summarize_tests(tests):
+    """Behavior test section result (60% of the total grade) from per-test results"""
+    counts = {outcome: sum(1 for test in tests if test['outcome'] == outcome)
+              for outcome in ('pass', 'fail', 'error', 'skip')}
+    tests_run = len(tests)
+    tests_passed = tests_run - counts['fail'] - counts['error']
+    return {
+        'passed': tests_passed,
+        'failed': counts['fail'],
+        'errors': counts['error'],
+        'total': tests_run,
+        'score': (tests_passed / tests_run) * 60 if tests_run > 0 else 0,
+        'seconds': sum(test['seconds'] for test in tests),
+        'tests': tests,
+    }
+
 
 class RefactorEvaluator:
     """Grading system for refactored code"""
 
-    def __init__(self):
+    def __init__(self, workers=None, use_cache=True, cache_path=CACHE_FILE):
         self.total_score = 0
         self.max_score = 100
         self.results = {}
+        self.workers = workers
+        self.cache = EvaluationCache(cache_path, use_cache)
+        self.cached_sections = []
 
     def run_behavior_tests(self):
         """Run all behavior tests and calculate score"""
-        # Create test suite
-        loader = unittest.TestLoader()
-        suite = loader.loadTestsFromTestCase(TestUserManagementSystem)
-
-        # Run tests silently
-        runner = unittest.TextTestRunner(stream=StringIO(), verbosity=0)
-        result = runner.run(suite)
-
-        # Calculate behavior test score (60% of total grade)
-        tests_run = result.testsRun
-        tests_passed = tests_run - len(result.failures) - len(result.errors)
-        behavior_score = (tests_passed / tests_run) * 60 if tests_run > 0 else 0
-
-        self.results['behavior_tests'] = {
-            'passed': tests_passed,
-            'failed': len(result.failures),
-            'errors': len(result.errors),
-            'total': tests_run,
-            'score': behavior_score
-        }
-
-        return behavior_score
+        tests, cached = behavior_test_results(self.workers, self.cache)
+        if cached:
+            self.cached_sections.append('behavior_tests')
+        self.results['behavior_tests'] = summarize_tests(tests)
+        return self.results['behavior_tests']['score']
+
+    def _run_section(self, section, evaluate):
+        """Run a printing section, or replay its cached output when its inputs are unchanged"""
+        inputs = source_hashes(SECTION_SOURCES[section])
+        entry = self.cache.get(section, inputs)
+        if entry is not None:
+            print(entry['output'], end='')
+            print("(cached: inputs unchanged)")
+            self.cached_sections.append(section)
+            self.results[section] = entry['result']
+            return entry['result']['score']
+        output = StringIO()
+        with redirect_stdout(output):
+            score = evaluate()
+        print(output.getvalue(), end='')
+        self.cache.put(section, inputs, self.results[section], output.getvalue())
+        return score
 
     def evaluate_code_quality(self):
         """Evaluate code quality metrics"""
@@ -188,6 +345,9 @@ class RefactorEvaluator:
         print(f"1. Behavior Tests (60 points max)")
         print(f"   Tests Passed: {bt.get('passed', 0)}/{bt.get('total', 0)}")
         print(f"   Score: {behavior_score:.1f}/60.0")
+        slowest = sorted(bt.get('tests', []), key=lambda test: test['seconds'], reverse=True)[:3]
+        for test in slowest:
+            print(f"   {test['seconds'] * 1000:8.1f} ms  {test['description']}")
 
         # Code quality
         cq = self.results.get('code_quality', {})
@@ -205,13 +365,16 @@ class RefactorEvaluator:
         # Grade letter
         grade = self.calculate_grade(self.total_score)
         print(f"GRADE: {grade}")
+        if self.cached_sections:
+            print(f"CACHED SECTIONS: {', '.join(self.cached_sections)}")
         print("=" * 60)
 
         return {
             'total_score': self.total_score,
             'max_score': self.max_score,
             'grade': grade,
-            'breakdown': self.results
+            'breakdown': self.results,
+            'cached_sections': self.cached_sections,
         }
 
     def calculate_grade(self, score):
@@ -227,22 +390,36 @@ class RefactorEvaluator:
         else:
             return 'F (Fail)'
 
-    def evaluate(self):
-        """Run complete evaluation"""
+    def evaluate(self, json_path=None):
+        """Run complete evaluation; the report is also written to json_path if given"""
+        started = time.perf_counter()
         # Run all evaluation components silently
         behavior_score = self.run_behavior_tests()
-        quality_score = self.evaluate_code_quality()
-        compatibility_score = self.evaluate_legacy_compatibility()
+        quality_score = self._run_section('code_quality', self.evaluate_code_quality)
+        compatibility_score = self._run_section('legacy_compatibility',
+                                                self.evaluate_legacy_compatibility)
 
         # Generate final report
         report = self.generate_report()
+        report['elapsed_seconds'] = time.perf_counter() - started
+
+        if json_path is not None:
+            with open(json_path, 'w') as f:
+                json.dump(report, f, indent=2)
 
         return report
 
 
 if __name__ == '__main__':
-    evaluator = RefactorEvaluator()
-    report = evaluator.evaluate()
+    parser = argparse.ArgumentParser(description="Grade the refactored code")
+    parser.add_argument('--workers', type=int, help="test worker processes (default: CPU count)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="re-run every section even if its inputs are unchanged")
+    parser.add_argument('--json', default=REPORT_FILE, help="machine-readable report path")
+    args = parser.parse_args()
+
+    evaluator = RefactorEvaluator(workers=args.workers, use_cache=not args.no_cache)
+    report = evaluator.evaluate(args.json)
 
     # Exit with appropriate code
     if report['total_score'] >= 70:
@@ -0,0 +1,312 @@
+"""
+JOURNAL - WRITE-AHEAD TRANSACTION LOG WITH GROUP COMMIT
+Makes registrations, logins and password changes durable without an fsync each
+
+Every table mutation the system publishes (see UserManagementSystem.
+add_listener) becomes one journal record with a log sequence number (LSN).
+A writer thread collects records for up to commit_window seconds (or
+max_batch records), writes them with one write() and one fsync(), then
+releases every transaction waiting on that batch. With wait_durable=True a
+transaction returns only once its records are on disk; with False it
+returns at once and at most one commit window of records is at risk.
+
+A checkpoint writes a snapshot (see snapshot.py) of the tables at some LSN
+and starts a new journal segment; older segments and snapshots are then
+deleted. Recovery loads the newest snapshot and replays only the records
+after it. A torn record at the end of the log (crash mid-write) is ignored
+and cut off.
+
+Directory contents:
+    journal-<first LSN>.log     segments of CRC-framed records
+    snapshot-<LSN>.snap         table checkpoints
+
+Usage:
+    system = UserManagementSystem(profile='scaled', thread_safe=True)
+    journal = Journal('ums.journal')
+    journal.recover(system)
+    journal.attach(system, checkpoint_every=100_000)
+    ...
+    journal.close()
+"""
+
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import snapshot
+
+# Record framing: payload length, CRC-32 of payload; payload is a JSON array
+# [lsn, event, *details]
+RECORD_HEADER = struct.Struct('<II')
+
+SEGMENT_PATTERN = 'journal-%016d.log'
+SNAPSHOT_PATTERN = 'snapshot-%016d.snap'
+
+
+def encode_record(lsn, event, details):
+    """One framed journal record"""
+    payload = json.dumps([lsn, event, *details], separators=(',', ':')).encode('ascii')
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    """Yield (lsn, event, details, end_offset) for each intact record in a segment
+
+    Stops at the first truncated or corrupt record.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset = start + length
+        lsn, event, *details = json.loads(payload)
+        yield lsn, event, details, offset
+
+
+def _numbered(directory, pattern):
+    """(number, path) for files matching pattern, in ascending order"""
+    prefix, suffix = pattern.split('%016d')
+    found = []
+    for path in glob.glob(os.path.join(directory, prefix + '*' + suffix)):
+        number = os.path.basename(path)[len(prefix):-len(suffix)]
+        if number.isdigit():
+            found.append((int(number), path))
+    return sorted(found)
+
+
+class Journal:
+    """Write-ahead journal and checkpoints in one directory
+
+    commit_window is the group commit latency budget in seconds: the
+    writer waits at most this long after the first record of a batch for
+    more to arrive. fsync=False skips the fsync (for tests and benchmarks).
+    """
+
+    def __init__(self, directory, commit_window=0.002, max_batch=4096, fsync=True,
+                 wait_durable=True):
+        self.directory = directory
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.wait_durable = wait_durable
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._synced = threading.Condition(self._lock)
+        self._pending = []
+        self._first_pending_at = 0.0
+        self._closing = False
+        self._local = threading.local()
+        self._system = None
+        self._checkpoint_every = None
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoint_wanted = threading.Event()
+        self._checkpointer = None
+        self.commits = 0
+        self.records_since_checkpoint = 0
+
+        # The newest segment is opened for appending by recover() or attach()
+        self._file = None
+        self.last_lsn = 0
+        self.durable_lsn = 0
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _open_tail(self, scanned=None):
+        """Open the newest segment for appending, cutting off any torn tail
+
+        scanned is (path, last LSN, intact length) of the newest segment
+        when recover() has already read it; otherwise it is read here.
+        """
+        last_lsn = 0
+        snapshots = _numbered(self.directory, SNAPSHOT_PATTERN)
+        if snapshots:
+            last_lsn = snapshots[-1][0]
+        segments = _numbered(self.directory, SEGMENT_PATTERN)
+        if segments:
+            first_lsn, path = segments[-1]
+            if scanned is None or scanned[0] != path:
+                scanned = (path, first_lsn - 1, 0)
+                for lsn, _, _, end in read_records(path):
+                    scanned = (path, lsn, end)
+            _, tail_lsn, good_end = scanned
+            last_lsn = max(last_lsn, first_lsn - 1, tail_lsn)
+            if good_end < os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(good_end)
+        else:
+            path = os.path.join(self.directory, SEGMENT_PATTERN % (last_lsn + 1))
+        self._file = open(path, 'ab')
+        self.last_lsn = self.durable_lsn = last_lsn
+
+    def attach(self, system, checkpoint_every=None):
+        """Journal every mutation of system from now on
+
+        checkpoint_every (records) triggers an automatic checkpoint; it runs
+        on a background thread when the system is thread-safe, otherwise
+        inline after the transaction that crossed the threshold.
+        """
+        if self._file is None:
+            self._open_tail()
+        self._system = system
+        self._checkpoint_every = checkpoint_every
+        system.add_listener(self.on_event)
+        if checkpoint_every is not None and system.thread_safe:
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, daemon=True)
+            self._checkpointer.start()
+        if self.wait_durable or checkpoint_every is not None:
+            for operation in ('register', 'register_many', 'login', 'update_password',
+                              'deactivate_user_sessions'):
+                setattr(system, operation, self._committed(getattr(system, operation)))
+
+    def _committed(self, method):
+        """Wrap a transaction: return once its records are durable, then maybe checkpoint"""
+        def committed(*args):
+            self._local.lsn = 0
+            result = method(*args)
+            if self.wait_durable and self._local.lsn:
+                self.sync(self._local.lsn)
+            if (self._checkpoint_every is not None
+                    and self.records_since_checkpoint >= self._checkpoint_every):
+                if self._checkpointer is not None:
+                    self._checkpoint_wanted.set()
+                else:
+                    self.checkpoint(self._system)
+            return result
+        return committed
+
+    def on_event(self, event, *details):
+        """UserManagementSystem listener: queue one record for the next group commit"""
+        with self._lock:
+            self.last_lsn += 1
+            record = encode_record(self.last_lsn, event, details)
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+                self._work.notify()
+            self._pending.append(record)
+            if len(self._pending) >= self.max_batch:
+                self._work.notify()
+            self.records_since_checkpoint += 1
+            self._local.lsn = self.last_lsn
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closing:
+                    self._work.wait()
+                if not self._pending:
+                    return
+                deadline = self._first_pending_at + self.commit_window
+                while len(self._pending) < self.max_batch and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._work.wait(remaining)
+                batch, self._pending = self._pending, []
+                batch_lsn = self.last_lsn
+                out = self._file
+
+            out.write(b''.join(batch))
+            out.flush()
+            if self.fsync:
+                os.fsync(out.fileno())
+
+            with self._lock:
+                self.durable_lsn = batch_lsn
+                self.commits += 1
+                self._synced.notify_all()
+
+    def sync(self, lsn=None):
+        """Block until every record up to lsn (default: all so far) is durable"""
+        with self._lock:
+            if lsn is None:
+                lsn = self.last_lsn
+            while self.durable_lsn < lsn:
+                self._synced.wait()
+
+    def checkpoint(self, system):
+        """Snapshot the tables and drop the journal segments the snapshot covers
+
+        Transactions are paused only while the rows are copied; the snapshot
+        file is written after they resume.
+        """
+        with self._checkpoint_lock:
+            with system.exclusive():
+                cut = self.last_lsn
+                self.sync(cut)
+                with self._lock:
+                    # Nothing can be pending: every record up to cut is written
+                    self._file.close()
+                    self._file = open(os.path.join(self.directory, SEGMENT_PATTERN % (cut + 1)), 'ab')
+                    self.records_since_checkpoint = 0
+                users, sessions = snapshot.capture(system)
+
+            snapshot.write_snapshot(os.path.join(self.directory, SNAPSHOT_PATTERN % cut),
+                                    cut, users, sessions)
+            for lsn, path in _numbered(self.directory, SNAPSHOT_PATTERN):
+                if lsn < cut:
+                    os.remove(path)
+            for first_lsn, path in _numbered(self.directory, SEGMENT_PATTERN):
+                if first_lsn <= cut:
+                    os.remove(path)
+        return cut
+
+    def _checkpoint_loop(self):
+        while not self._closing:
+            if self._checkpoint_wanted.wait(0.5):
+                self._checkpoint_wanted.clear()
+                if not self._closing:
+                    self.checkpoint(self._system)
+
+    def recover(self, system):
+        """Load the newest snapshot into an empty system and replay the journal tail
+
+        Call before attach(). Returns (snapshot LSN, records replayed).
+        """
+        if self._file is not None:
+            raise RuntimeError("recover() must run before the journal is attached")
+        snapshot_lsn = 0
+        for lsn, path in reversed(_numbered(self.directory, SNAPSHOT_PATTERN)):
+            try:
+                snapshot_lsn, users, sessions = snapshot.read_snapshot(path)
+            except ValueError:
+                continue
+            snapshot.restore(system, users, sessions)
+            break
+
+        replayed = 0
+        scanned = None
+        for first_lsn, path in _numbered(self.directory, SEGMENT_PATTERN):
+            scanned = (path, first_lsn - 1, 0)
+            for lsn, event, details, end in read_records(path):
+                scanned = (path, lsn, end)
+                if lsn > snapshot_lsn:
+                    system.apply_event(event, *details)
+                    replayed += 1
+        system.reindex()
+        self._open_tail(scanned)
+        return snapshot_lsn, replayed
+
+    def close(self):
+        """Commit outstanding records and stop the background threads"""
+        with self._lock:
+            self._closing = True
+            self._work.notify()
+        self._checkpoint_wanted.set()
+        self._writer.join()
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        if self._file is not None:
+            self._file.close()
+        if self._system is not None:
+            self._system.remove_listener(self.on_event)
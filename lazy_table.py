@@ -0,0 +1,141 @@
+"""
+LAZY TABLE - DICT ROWS CREATED ON FIRST USE
+Stands in for the preallocated list of row dicts without building them up front
+
+A slot holds nothing until it is first read or written; it then gets its
+own dict, copied from the blank row or, for tables restored from a
+snapshot, built from that slot's column values. Creating a table of any
+size costs one list of None, so startup no longer pays for rows that are
+never used. Column reads (values(), find()) of slots that were never
+touched come straight from the columns without building their dicts.
+
+Rows are Row dicts: a write to the key field (the first field, e.g.
+user_name) bumps the table's generation, so an index built over the
+table can tell that a row was renamed behind its back.
+"""
+
+
+class Row(dict):
+    """Row dict of a LazyTable; writes to the key field bump the table's generation"""
+
+    __slots__ = ('_table',)
+
+    def __init__(self, table, values):
+        dict.__init__(self, values)
+        self._table = table
+
+    def __setitem__(self, field, value):
+        dict.__setitem__(self, field, value)
+        if field == self._table.key_field:
+            self._table.generation += 1
+
+
+class LazyTable:
+    """List-like table of dict rows materialized on first access
+
+    blank is the INITIALIZEd row ({'user_name': '', ...}). columns, if
+    given, is one sequence of values per field (in blank's field order) for
+    the first len(columns[0]) slots. generation counts writes to the key
+    field; rows stored with table[idx] = row or append() are copied into
+    Row dicts.
+    """
+
+    __slots__ = ('_blank', '_fields', '_columns', '_rows', '_touched', 'key_field', 'generation')
+    __hash__ = None
+
+    def __init__(self, blank, size=0, columns=None):
+        self._blank = blank
+        self._fields = tuple(blank)
+        self._columns = columns
+        self._rows = [None] * max(size, self._column_rows())
+        # Column slots that have a row dict (it may differ from the columns)
+        self._touched = set()
+        self.key_field = self._fields[0]
+        self.generation = 0
+
+    def _column_rows(self):
+        return len(self._columns[0]) if self._columns is not None else 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self._rows)))]
+        row = self._rows[idx]
+        if row is None:
+            if idx < 0:
+                idx += len(self._rows)
+            if idx < self._column_rows():
+                row = Row(self, zip(self._fields, [column[idx] for column in self._columns]))
+                self._touched.add(idx)
+            else:
+                row = Row(self, self._blank)
+            self._rows[idx] = row
+        return row
+
+    def __setitem__(self, idx, row):
+        if idx < 0:
+            idx += len(self._rows)
+        self._rows[idx] = Row(self, row)
+        self.generation += 1
+        if idx < self._column_rows():
+            self._touched.add(idx)
+
+    def __iter__(self):
+        for idx in range(len(self._rows)):
+            yield self[idx]
+
+    def __eq__(self, other):
+        if isinstance(other, (LazyTable, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"LazyTable({len(self._rows)} rows, {self.materialized()} materialized)"
+
+    def append(self, row):
+        """Add a row at the end"""
+        self._rows.append(Row(self, row))
+
+    def values(self, field, slots):
+        """Field values of the given slots, read from the columns where unmaterialized"""
+        position = self._fields.index(field)
+        split = self._column_rows()
+        if isinstance(slots, range) and slots.step == 1 and slots.start < split:
+            # Whole column run in one slice, then patch the touched slots
+            start, stop = slots.start, min(slots.stop, split)
+            ws_values = list(self._columns[position][start:stop])
+            for idx in self._touched:
+                if start <= idx < stop:
+                    ws_values[idx - start] = self._rows[idx][field]
+            return ws_values + self.values(field, range(stop, slots.stop))
+        column = self._columns[position] if split else ()
+        blank = self._blank[field]
+        rows = self._rows
+        ws_values = []
+        for idx in slots:
+            row = rows[idx]
+            if row is not None:
+                ws_values.append(row[field])
+            elif idx < split:
+                ws_values.append(column[idx])
+            else:
+                ws_values.append(blank)
+        return ws_values
+
+    def find(self, count, criteria):
+        """Slots below count whose fields equal criteria's values"""
+        matches = range(count)
+        for field, value in criteria.items():
+            matches = [idx for idx, found in zip(matches, self.values(field, matches))
+                       if found == value]
+        return list(matches)
+
+    def count(self, count, criteria):
+        """Number of slots below count whose fields equal criteria's values"""
+        return len(self.find(count, criteria))
+
+    def materialized(self):
+        """Number of slots that hold a row dict"""
+        return len(self._rows) - self._rows.count(None)
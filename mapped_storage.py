@@ -0,0 +1,194 @@
+"""
+MAPPED STORAGE - MEMORY-MAPPED FIXED-LENGTH RECORD DATASET
+Keeps USER-TABLE and SESSION-TABLE in one file that outlives the process
+
+File layout (every region starts on an mmap allocation boundary):
+    header   magic, version, capacities, USER-COUNT, SESSION-COUNT
+    users    <user capacity> x 41-byte USER-ENTRY records
+    sessions <session capacity> x 27-byte SESSION-ENTRY records
+
+Records use the same PIC layout as compact storage, so the tables are
+RecordTables whose buffers are the mapped regions: a registration or
+password change writes its fields straight into the mapped pages and
+nothing else. Opening an existing file maps it and reads the header only.
+
+A new file is sized with a sparse truncate, so a 10M-user capacity costs
+no disk space or time until it is used. Blank records are written a
+chunk of _FILL_RECORDS at a time, ahead of the counters: the records from
+USER-COUNT / SESSION-COUNT to the end of their chunk are always blank,
+the ones past that read as NUL bytes until the counters get there.
+
+Sync policies (when dirty pages are forced to disk with msync):
+    always   - after every mutation (only the touched pages are flushed)
+    interval - on the first mutation at least sync_interval seconds after
+               the last sync, and on flush()/close()
+    explicit - only on flush()/close(); the OS writes pages back on its own
+               schedule in between, so a machine crash can lose updates
+"""
+
+import mmap
+import os
+import struct
+import time
+
+from record_storage import SESSION_LAYOUT, USER_LAYOUT, RecordTable, blank_record
+
+MAGIC = b'UMSDATA1'
+VERSION = 1
+# magic, version, user capacity, session capacity, USER-COUNT, SESSION-COUNT
+HEADER = struct.Struct('<8sIQQQQ')
+COUNTS_OFFSET = 28
+COUNTS = struct.Struct('<QQ')
+
+SYNC_POLICIES = ('always', 'interval', 'explicit')
+
+# Blank records are written this many at a time, ahead of the counters
+_FILL_RECORDS = 65536
+
+
+def _align(offset):
+    return -(-offset // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+
+
+def _region_sizes(user_capacity, session_capacity):
+    user_bytes = user_capacity * len(blank_record(USER_LAYOUT))
+    session_bytes = session_capacity * len(blank_record(SESSION_LAYOUT))
+    user_offset = _align(HEADER.size)
+    session_offset = _align(user_offset + user_bytes)
+    return user_offset, user_bytes, session_offset, session_bytes
+
+
+class MappedStore:
+    """A data file mapped into USER-TABLE and SESSION-TABLE record tables
+
+    A new file is allocated for user_capacity users and session_capacity
+    sessions, like a fixed-length dataset; an existing file keeps the
+    capacities it was created with. Records past the counters' blank-filled
+    chunk read as NUL until the counters reach them. Use it through
+    UserManagementSystem(storage='mapped', data_file=path).
+    """
+
+    def __init__(self, path, user_capacity, session_capacity, sync='interval',
+                 sync_interval=1.0, clock=time.monotonic):
+        if sync not in SYNC_POLICIES:
+            raise ValueError(f"unknown sync policy: {sync!r}")
+        self.path = path
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self._clock = clock
+
+        self.created = not os.path.exists(path) or os.path.getsize(path) == 0
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if self.created:
+                self._allocate(fd, user_capacity, session_capacity)
+            with mmap.mmap(fd, HEADER.size, offset=0) as header:
+                magic, version, self.user_capacity, self.session_capacity, \
+                    self.user_count, self.session_count = HEADER.unpack(header[:HEADER.size])
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a user management data file")
+
+            user_offset, user_bytes, session_offset, session_bytes = \
+                _region_sizes(self.user_capacity, self.session_capacity)
+            self._header = mmap.mmap(fd, HEADER.size, offset=0)
+            self._user_map = self._map(fd, user_offset, user_bytes)
+            self._session_map = self._map(fd, session_offset, session_bytes)
+        finally:
+            os.close(fd)
+
+        self.user_table = RecordTable(USER_LAYOUT, self.user_capacity, self._user_map)
+        self.session_table = RecordTable(SESSION_LAYOUT, self.session_capacity, self._session_map)
+        # Records [0, ready) are known to be written or blank
+        self._user_ready = self.user_count
+        self._session_ready = self.session_count
+        self._prepare()
+        self._last_sync = clock()
+
+    @staticmethod
+    def _map(fd, offset, length):
+        if length == 0:
+            return bytearray()
+        return mmap.mmap(fd, length, offset=offset)
+
+    def _allocate(self, fd, user_capacity, session_capacity):
+        """Size a new (sparse) file and write its header; records are blank-filled later"""
+        _, _, session_offset, session_bytes = _region_sizes(user_capacity, session_capacity)
+        os.ftruncate(fd, session_offset + session_bytes)
+        os.pwrite(fd, HEADER.pack(MAGIC, VERSION, user_capacity, session_capacity, 0, 0), 0)
+        os.fsync(fd)
+
+    def _prepare(self):
+        """Blank-fill the records from each counter to the end of its chunk"""
+        self._user_ready = self._fill(self._user_map, USER_LAYOUT, self._user_ready,
+                                      self.user_count, self.user_capacity)
+        self._session_ready = self._fill(self._session_map, SESSION_LAYOUT, self._session_ready,
+                                         self.session_count, self.session_capacity)
+
+    @staticmethod
+    def _fill(mapped, layout, ready, count, capacity):
+        target = min(capacity, (count // _FILL_RECORDS + 1) * _FILL_RECORDS)
+        if target <= ready:
+            return ready
+        # Records below count are in use (a journal replay or bulk load
+        # may have written them past ready without the counters moving)
+        start = max(ready, count)
+        blank = blank_record(layout)
+        # Only a hole reads as NUL; a chunk filled in an earlier run is left alone
+        if mapped[(target - 1) * len(blank)] == 0:
+            mapped[start * len(blank):target * len(blank)] = blank * (target - start)
+        return target
+
+    def on_event(self, event, *details):
+        """UserManagementSystem listener: persist counters and apply the sync policy"""
+        if event == 'user_added':
+            self.user_count = max(self.user_count, details[0] + 1)
+            self._write_counts()
+        elif event == 'session_added':
+            self.session_count = max(self.session_count, details[0] + 1)
+            self._write_counts()
+
+        if self.sync == 'always':
+            self._sync_record(event, details[0])
+        elif self.sync == 'interval' and self._clock() - self._last_sync >= self.sync_interval:
+            self._sync_all()
+
+    def _write_counts(self):
+        if self.user_count >= self._user_ready or self.session_count >= self._session_ready:
+            self._prepare()
+        COUNTS.pack_into(self._header, COUNTS_OFFSET, self.user_count, self.session_count)
+
+    def _sync_record(self, event, idx):
+        """msync only the pages holding one record (and the header)"""
+        if event.startswith('session'):
+            table, mapped = self.session_table, self._session_map
+        else:
+            table, mapped = self.user_table, self._user_map
+        start = idx * table.record_length
+        page_start = start - start % mmap.PAGESIZE
+        mapped.flush(page_start, min(len(mapped), start + table.record_length) - page_start)
+        self._header.flush()
+
+    def _sync_all(self):
+        for mapped in (self._user_map, self._session_map):
+            if isinstance(mapped, mmap.mmap):
+                mapped.flush()
+        self._header.flush()
+        self._last_sync = self._clock()
+
+    def flush(self, user_count=None, session_count=None):
+        """Record the counters and force every dirty page to disk"""
+        if user_count is not None:
+            self.user_count = user_count
+        if session_count is not None:
+            self.session_count = session_count
+        self._write_counts()
+        self._sync_all()
+
+    def close(self, user_count=None, session_count=None):
+        """Flush and unmap the file"""
+        if self._header.closed:
+            return
+        self.flush(user_count, session_count)
+        for mapped in (self._user_map, self._session_map, self._header):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
@@ -0,0 +1,142 @@
+"""
+MENU LOAD TEST - CONCURRENT TERMINAL SIMULATOR
+Opens many connections to menu_server.py and measures operation latency
+
+Every simulated terminal registers its own user, then alternates logins
+and password changes through the menu screens. Latency is measured from
+sending a transaction's input lines to receiving the next menu prompt.
+
+Usage:
+    python menu_loadtest.py [--host 127.0.0.1] [--port 7878] [--unix PATH]
+                            [--connections 1000] [--ops 20] [--spawn]
+
+--spawn starts a scaled-profile server inside this process on a free port.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+
+import menu_server
+from modern_app import CHOICE_PROMPT, UserManagementSystem
+
+PROMPT = CHOICE_PROMPT.encode()
+TOKEN_PATTERN = re.compile(rb"YOUR SESSION TOKEN: (\d+)")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+async def open_terminal(host, port, path):
+    """Connect and read up to the first menu prompt"""
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    await reader.readuntil(PROMPT)
+    return reader, writer
+
+
+async def transact(reader, writer, lines, latencies):
+    """Send one transaction's input lines; returns the screen output"""
+    started = time.perf_counter()
+    writer.write(''.join(line + '\n' for line in lines).encode())
+    output = await reader.readuntil(PROMPT)
+    latencies.append(time.perf_counter() - started)
+    return output
+
+
+async def run_terminal(reader, writer, username, ops, latencies, stats):
+    """Register, then alternate login and change password ops times"""
+    password = 'pw0'
+    output = await transact(reader, writer, ['1', username, password], latencies)
+    stats['errors'] += output.count(b"ERROR:")
+    for op in range(ops):
+        output = await transact(reader, writer, ['2', username, password], latencies)
+        match = TOKEN_PATTERN.search(output)
+        if match is None:
+            stats['errors'] += 1
+            continue
+        new_password = f'pw{op + 1}'
+        output = await transact(reader, writer, ['3', match.group(1).decode(), password, new_password],
+                                latencies)
+        if b"SUCCESS" in output:
+            password = new_password
+        else:
+            stats['errors'] += 1
+    writer.write(b'4\n')
+    await writer.drain()
+    writer.close()
+
+
+async def run_load(host='127.0.0.1', port=menu_server.DEFAULT_PORT, path=None,
+                   connections=1000, ops=20, prefix=None):
+    """Hold `connections` terminals open and drive them concurrently"""
+    prefix = prefix or f"lt{os.getpid()}_"
+    opened = await asyncio.gather(*(open_terminal(host, port, path) for _ in range(connections)),
+                                  return_exceptions=True)
+    terminals = [t for t in opened if not isinstance(t, BaseException)]
+    connect_errors = len(opened) - len(terminals)
+
+    latencies = []
+    stats = {'errors': 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_terminal(reader, writer, f"{prefix}{i}", ops, latencies, stats)
+                           for i, (reader, writer) in enumerate(terminals)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'connections_held': len(terminals),
+        'connect_errors': connect_errors,
+        'operations': len(latencies),
+        'operation_errors': stats['errors'],
+        'elapsed_s': elapsed,
+        'ops_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+async def run_spawned(connections, ops):
+    """Run the load test against an in-process scaled server"""
+    system = UserManagementSystem(profile='scaled')
+    server = await menu_server.start_server(system, port=0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await run_load(port=port, connections=connections, ops=ops)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the menu server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=menu_server.DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--ops', type=int, default=20, help="login/change-password rounds per terminal")
+    parser.add_argument('--spawn', action='store_true', help="start an in-process server")
+    args = parser.parse_args(argv)
+
+    if args.spawn:
+        report = asyncio.run(run_spawned(args.connections, args.ops))
+    else:
+        report = asyncio.run(run_load(args.host, args.port, args.unix, args.connections, args.ops))
+
+    print(f"CONNECTIONS HELD:   {report['connections_held']} "
+          f"({report['connect_errors']} failed to connect)")
+    print(f"OPERATIONS:         {report['operations']} ({report['operation_errors']} errors)")
+    print(f"THROUGHPUT:         {report['ops_per_sec']:,.0f} ops/s")
+    print(f"LATENCY p50 / p99:  {report['p50_ms']:.2f} ms / {report['p99_ms']:.2f} ms")
+    return 1 if report['connect_errors'] or report['operation_errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
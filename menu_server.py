@@ -0,0 +1,94 @@
+"""
+MENU SERVER - ASYNCIO TCP / UNIX SOCKET FRONT END
+Serves the legacy menu screens to many terminals from one shared system
+
+Each connection gets its own MenuSession, so clients see exactly the text
+the interactive program prints and answer its prompts one line at a time.
+All connections share one UserManagementSystem on a single event loop;
+transactions never block, so no locking is needed.
+
+Usage:
+    python menu_server.py [--host 127.0.0.1] [--port 7878] [--unix PATH]
+                          [--profile scaled] [--storage compact] [--session-ttl SECONDS]
+                          [--metrics-file ums.prom] [--metrics-interval 15]
+"""
+
+import argparse
+import asyncio
+from contextlib import nullcontext
+
+from metrics import Metrics, PrometheusDumper
+from modern_app import PROFILES, MenuSession, UserManagementSystem
+
+DEFAULT_PORT = 7878
+
+
+async def handle_client(system, reader, writer):
+    """Run the menu protocol for one connection"""
+    session = MenuSession(system)
+    try:
+        writer.write(session.start().encode())
+        await writer.drain()
+        while not session.closed:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                output = session.feed(line.decode(errors='replace').rstrip('\r\n'))
+            except ValueError:
+                # Non-numeric session token: the legacy program stops here too
+                break
+            writer.write(output.encode())
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(system, host='127.0.0.1', port=DEFAULT_PORT, path=None, backlog=4096):
+    """Start listening; returns the asyncio Server"""
+    async def client_connected(reader, writer):
+        await handle_client(system, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(client_connected, path=path, backlog=backlog)
+    return await asyncio.start_server(client_connected, host=host, port=port, backlog=backlog)
+
+
+async def serve_forever(system, host, port, path):
+    server = await start_server(system, host, port, path)
+    where = path if path is not None else f"{host}:{port}"
+    print(f"USER MANAGEMENT SYSTEM LISTENING ON {where}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the user management menu over a socket")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--profile', default='legacy', choices=sorted(PROFILES))
+    parser.add_argument('--storage', default='dict', choices=['dict', 'compact'])
+    parser.add_argument('--session-ttl', type=float, help="expire sessions after this many seconds")
+    parser.add_argument('--metrics-file', help="rewrite Prometheus text-format metrics to this file")
+    parser.add_argument('--metrics-interval', type=float, default=15.0,
+                        help="seconds between metrics file rewrites")
+    args = parser.parse_args(argv)
+
+    metrics = Metrics() if args.metrics_file else None
+    system = UserManagementSystem(storage=args.storage, profile=args.profile,
+                                  session_ttl=args.session_ttl, metrics=metrics)
+    dumper = nullcontext()
+    if metrics is not None:
+        dumper = PrometheusDumper(metrics, args.metrics_file, args.metrics_interval)
+    with dumper:
+        try:
+            asyncio.run(serve_forever(system, args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+METRICS - LATENCY HISTOGRAMS AND OPERATION COUNTERS
+HDR-style log-linear histograms, the opt-in UserManagementSystem metrics
+surface, and a Prometheus text-format exporter
+"""
+
+import os
+import threading
+
+# Fixed Prometheus histogram boundaries (seconds) derived from the HDR buckets
+PROMETHEUS_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                      1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) latency histogram
+
+    Values are recorded in nanoseconds. Below 2**sub_bits every value has
+    its own bucket; above that each power of two is split into
+    2**(sub_bits - 1) buckets, so the relative error stays under
+    2**-(sub_bits - 1) (under 1% with the default 8 bits) at any magnitude.
+    Buckets are stored sparsely.
+    """
+
+    def __init__(self, sub_bits=8):
+        self.sub_bits = sub_bits
+        self._half = 1 << (sub_bits - 1)
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        if value < (1 << self.sub_bits):
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return (1 << self.sub_bits) + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def bucket_upper(self, bucket):
+        """Largest value (ns) that falls into bucket"""
+        if bucket < (1 << self.sub_bits):
+            return bucket
+        offset = bucket - (1 << self.sub_bits)
+        shift = offset // self._half + 1
+        top = offset % self._half + self._half
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        """Add one latency sample given in seconds"""
+        value = max(0, int(seconds * 1e9))
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add another histogram's samples (same sub_bits) into this one"""
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, pct):
+        """Latency (seconds) at or below which pct% of samples fall"""
+        if not self.count:
+            return 0.0
+        threshold = max(1, -(-self.count * pct // 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= threshold:
+                return min(self.bucket_upper(bucket), self.max) / 1e9
+        return self.max / 1e9
+
+    def count_at_or_below(self, seconds):
+        """Samples whose bucket lies entirely at or below seconds"""
+        limit = int(seconds * 1e9)
+        return sum(count for bucket, count in self.counts.items()
+                   if self.bucket_upper(bucket) <= limit)
+
+    def cumulative(self):
+        """(upper bound in seconds, cumulative count) for each non-empty bucket"""
+        seen = 0
+        result = []
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            result.append((self.bucket_upper(bucket) / 1e9, seen))
+        return result
+
+    def summary(self):
+        """Count, mean and common percentiles in milliseconds"""
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6 if self.count else 0.0,
+            'min_ms': (self.min or 0) / 1e6,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p90_ms': self.percentile(90) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+            'p999_ms': self.percentile(99.9) * 1e3,
+            'max_ms': (self.max or 0) / 1e6,
+        }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Counters and latency histograms for one UserManagementSystem
+
+    Pass an instance as UserManagementSystem(metrics=...). Records, per
+    transaction (register / login / update_password), the call count, the
+    outcome count by legacy message and an HDR latency histogram, and per
+    lookup loop how many table rows were examined. Safe to update from many
+    threads.
+
+    With the indexes in place a lookup (user_lookup, session_lookup) counts
+    one row per index probe, hit or miss. The table rows themselves are
+    counted where they are read: n per index rebuild (user_index_rebuild,
+    session_index_rebuild) and n per whole-table scan (active_user_count,
+    active_session_list, session_timer_restart), so rows_examined is the
+    work done and a high rebuild count shows lookups paying for direct
+    table writes.
+    """
+
+    def __init__(self, sub_bits=8):
+        self.sub_bits = sub_bits
+        self.calls = {}
+        self.outcomes = {}
+        self.latency = {}
+        self.lookups = {}
+        self.rows_examined = {}
+        self._lock = threading.Lock()
+
+    def observe(self, operation, outcome, seconds):
+        """Record one finished transaction"""
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            key = (operation, outcome)
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            histogram = self.latency.get(operation)
+            if histogram is None:
+                histogram = self.latency[operation] = LatencyHistogram(self.sub_bits)
+            histogram.record(seconds)
+
+    def scanned(self, loop, rows):
+        """Record one pass of a lookup loop that examined `rows` table rows"""
+        with self._lock:
+            self.lookups[loop] = self.lookups.get(loop, 0) + 1
+            self.rows_examined[loop] = self.rows_examined.get(loop, 0) + rows
+
+    def to_dict(self):
+        """Snapshot of every counter, with latency summaries in milliseconds"""
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'outcomes': {operation: {outcome: count
+                                         for (op, outcome), count in self.outcomes.items()
+                                         if op == operation}
+                             for operation in self.calls},
+                'latency': {operation: histogram.summary()
+                            for operation, histogram in self.latency.items()},
+                'scans': {loop: {'lookups': self.lookups[loop],
+                                 'rows_examined': self.rows_examined[loop],
+                                 'mean_rows': self.rows_examined[loop] / self.lookups[loop]}
+                          for loop in self.lookups},
+            }
+
+    def prometheus_text(self, prefix='ums'):
+        """Render the metrics in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {prefix}_operations_total Transactions by operation and outcome")
+            lines.append(f"# TYPE {prefix}_operations_total counter")
+            for (operation, outcome), count in sorted(self.outcomes.items()):
+                lines.append(f'{prefix}_operations_total{{operation="{_label(operation)}",'
+                             f'outcome="{_label(outcome)}"}} {count}')
+
+            lines.append(f"# HELP {prefix}_operation_latency_seconds Transaction latency")
+            lines.append(f"# TYPE {prefix}_operation_latency_seconds histogram")
+            for operation, histogram in sorted(self.latency.items()):
+                label = f'operation="{_label(operation)}"'
+                for bound in PROMETHEUS_BUCKETS:
+                    lines.append(f'{prefix}_operation_latency_seconds_bucket{{{label},le="{bound:g}"}} '
+                                 f'{histogram.count_at_or_below(bound)}')
+                lines.append(f'{prefix}_operation_latency_seconds_bucket{{{label},le="+Inf"}} '
+                             f'{histogram.count}')
+                lines.append(f'{prefix}_operation_latency_seconds_sum{{{label}}} '
+                             f'{histogram.total / 1e9:.9f}')
+                lines.append(f'{prefix}_operation_latency_seconds_count{{{label}}} {histogram.count}')
+
+            lines.append(f"# HELP {prefix}_lookups_total Lookup loop passes")
+            lines.append(f"# TYPE {prefix}_lookups_total counter")
+            for loop, count in sorted(self.lookups.items()):
+                lines.append(f'{prefix}_lookups_total{{loop="{_label(loop)}"}} {count}')
+            lines.append(f"# HELP {prefix}_rows_examined_total Table rows examined by lookup loops")
+            lines.append(f"# TYPE {prefix}_rows_examined_total counter")
+            for loop, rows in sorted(self.rows_examined.items()):
+                lines.append(f'{prefix}_rows_examined_total{{loop="{_label(loop)}"}} {rows}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='ums'):
+        """Write the text format to path atomically (scrapers never see a partial file)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text(prefix))
+        os.replace(tmp_path, path)
+
+
+class PrometheusDumper:
+    """Background thread rewriting a Prometheus text file every `interval` seconds"""
+
+    def __init__(self, metrics, path, interval=15.0, prefix='ums'):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread after one final dump"""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.write_prometheus(self.path, self.prefix)
+        self.metrics.write_prometheus(self.path, self.prefix)
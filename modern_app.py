@@ -3,111 +3,505 @@ USER MANAGEMENT SYSTEM - PYTHON VERSION
 Replicates the exact functionality of the legacy COBOL application
 """
 
-import random
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager, nullcontext
 
+from columnar_storage import column_table, count_rows, field_values, find_rows
+from cow_storage import CowRecordTable, FrozenColumns, TablesSnapshot
+from lazy_table import LazyTable
+from mapped_storage import MappedStore
+from password_hashing import CredentialCache, is_hashed
+from record_storage import (SESSION_LAYOUT, USER_LAYOUT, RecordTable, check_digits, encode_field,
+                            fit_text, session_record_table, user_record_table)
+from session_expiry import TimingWheel
+from snapshot import SESSION_FIELDS, USER_FIELDS, capture_columns, read_columns, write_columns
+from token_allocator import TokenAllocator
+
+
+# Transaction result codes and the legacy screen message for each
+USER_REGISTERED = 'USER_REGISTERED'
+USERNAME_EXISTS = 'USERNAME_EXISTS'
+USER_DATABASE_FULL = 'USER_DATABASE_FULL'
+LOGIN_APPROVED = 'LOGIN_APPROVED'
+INVALID_CREDENTIALS = 'INVALID_CREDENTIALS'
+SESSION_TABLE_FULL = 'SESSION_TABLE_FULL'
+PASSWORD_CHANGED = 'PASSWORD_CHANGED'
+INVALID_SESSION_TOKEN = 'INVALID_SESSION_TOKEN'
+OLD_PASSWORD_INCORRECT = 'OLD_PASSWORD_INCORRECT'
+SESSION_USER_MISSING = 'SESSION_USER_MISSING'
+SESSION_LIMIT_REACHED = 'SESSION_LIMIT_REACHED'
+
+MESSAGES = {
+    USER_REGISTERED: "SUCCESS: USER REGISTERED!",
+    USERNAME_EXISTS: "ERROR: USERNAME ALREADY EXISTS!",
+    USER_DATABASE_FULL: "ERROR: USER DATABASE FULL!",
+    LOGIN_APPROVED: "SUCCESS: LOGIN APPROVED",
+    INVALID_CREDENTIALS: "ERROR: INVALID CREDENTIALS!",
+    SESSION_TABLE_FULL: "ERROR: SESSION TABLE FULL!",
+    PASSWORD_CHANGED: "SUCCESS: PASSWORD CHANGED!",
+    INVALID_SESSION_TOKEN: "ERROR: INVALID SESSION TOKEN!",
+    OLD_PASSWORD_INCORRECT: "ERROR: OLD PASSWORD INCORRECT!",
+    # Session belongs to a user no longer in the table: COBOL displays nothing
+    SESSION_USER_MISSING: "",
+    # Not in the legacy program: only with a per-user session cap
+    SESSION_LIMIT_REACHED: "ERROR: USER SESSION LIMIT REACHED!",
+}
+
+SUCCESS_CODES = frozenset([USER_REGISTERED, LOGIN_APPROVED, PASSWORD_CHANGED])
+
+
+class Result(namedtuple('Result', ['code', 'token'], defaults=[None])):
+    """Outcome of one transaction: a result code and, for logins, the token"""
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.code in SUCCESS_CODES
+
+    @property
+    def message(self):
+        return MESSAGES[self.code]
+
+    def screen_lines(self):
+        """Lines the legacy program displays for this result"""
+        lines = [self.message] if self.message else []
+        if self.token is not None:
+            lines.append(f"YOUR SESSION TOKEN: {self.token}")
+        return lines
+
+
+# Screen text shared by the console, batch and network front ends
+WELCOME_LINES = (
+    "========================================",
+    "   USER MANAGEMENT SYSTEM v1.0         ",
+    "   LEGACY MAINFRAME APPLICATION        ",
+    "========================================",
+)
+
+MENU_LINES = (
+    " ",
+    "MAIN MENU:",
+    "1. REGISTER NEW USER",
+    "2. LOGIN",
+    "3. CHANGE PASSWORD",
+    "4. EXIT",
+)
+
+CHOICE_PROMPT = "ENTER CHOICE (1-4): "
+
+# Menu choice -> (screen header, input prompts, transaction method)
+TRANSACTION_SCREENS = {
+    '1': ("--- USER REGISTRATION ---",
+          ("ENTER USERNAME: ", "ENTER PASSWORD: "), 'register'),
+    '2': ("--- USER LOGIN ---",
+          ("ENTER USERNAME: ", "ENTER PASSWORD: "), 'login'),
+    '3': ("--- CHANGE PASSWORD ---",
+          ("ENTER SESSION TOKEN: ", "ENTER OLD PASSWORD: ", "ENTER NEW PASSWORD: "),
+          'update_password'),
+}
+
+
+# INITIALIZEd USER-ENTRY / SESSION-ENTRY rows of dict storage
+BLANK_USER = {'user_name': '', 'user_password': '', 'user_active': 0}
+BLANK_SESSION = {'session_token': 0, 'session_user': '', 'session_active': 0}
+
+
+# Capacity profiles. 'legacy' preallocates the COBOL OCCURS 100 / OCCURS 50
+# arrays; 'scaled' grows both tables one row at a time up to its limits.
+PROFILES = {
+    'legacy': {'max_users': 100, 'max_sessions': 50, 'preallocate': True},
+    'scaled': {'max_users': 10_000_000, 'max_sessions': 900_000, 'preallocate': False},
+}
 
 class UserManagementSystem:
-    def __init__(self):
-        """Initialize the user management system"""
-        # User database - fixed array (max 100 users)
-        self.user_table = []
-        for _ in range(100):
-            self.user_table.append({
-                'user_name': '',
-                'user_password': '',
-                'user_active': 0
-            })
+    def __init__(self, storage='dict', profile='legacy', max_users=None, max_sessions=None,
+                 session_ttl=None, clock=time.monotonic, thread_safe=False, lock_stripes=64,
+                 token_allocator=None, password_hasher=None, credential_cache=None,
+                 metrics=None, data_file=None, sync='interval', sync_interval=1.0,
+                 max_sessions_per_user=None):
+        """Initialize the user management system
 
-        # Session table - fixed array (max 50 sessions)
-        self.session_table = []
-        for _ in range(50):
-            self.session_table.append({
-                'session_token': 0,
-                'session_user': '',
-                'session_active': 0
-            })
+        storage selects how the tables are held: 'dict' (one dict per row),
+        'compact' (fixed-width records in a single buffer, PIC X(20) padding
+        and truncation applied to every value) or 'mapped' (the compact
+        records in the memory-mapped data_file, which keeps its contents
+        across runs; sync / sync_interval set the msync policy, see
+        mapped_storage) or 'columnar' (one NumPy array per field, with the
+        compact field widths; compact records when NumPy is not installed)
+        or 'cow' (the compact records in copy-on-write pages, so snapshot()
+        views cost no table copy). A new data file is sized for the
+        capacity limits.
+
+        profile selects the capacity model (see PROFILES): 'legacy' keeps
+        the COBOL 100-user / 50-session fixed arrays, 'scaled' starts with
+        empty tables that grow on demand. max_users / max_sessions override
+        the profile limits.
+
+        session_ttl (seconds) turns on session expiry: expired sessions are
+        deactivated and their slots and tokens reused. The default (None)
+        keeps the legacy behavior of sessions that never end.
+
+        thread_safe makes the transaction methods safe to call from many
+        threads: the working-storage flags become per-call locals, the
+        session table gets its own lock, and user rows are guarded by
+        lock_stripes locks picked by username hash (registration also takes
+        a table-wide user lock to allocate the slot).
+
+        token_allocator replaces the default TokenAllocator over the full
+        100000-999999 range (the sharded deployment gives each shard its own
+        slice of the range).
+
+        password_hasher (a password_hashing.PasswordHasher) stores salted KDF
+        hashes instead of plaintext passwords. Recently verified logins are
+        remembered in credential_cache (a CredentialCache is created if none
+        is given) so repeat logins skip the KDF. Hashes do not fit the 20-byte
+        PIC X field, so this mode needs dict storage.
+
+        metrics (a metrics.Metrics) turns on instrumentation: per-transaction
+        call and outcome counts, latency histograms, and rows examined by
+        index probes, index rebuilds and whole-table scans. Without it the
+        transaction methods run unwrapped.
+
+        max_sessions_per_user caps the active sessions one user may hold;
+        a login past the cap is refused with SESSION_LIMIT_REACHED, so one
+        account cannot fill the session table. The default (None) keeps the
+        legacy behavior of no per-user limit.
+        """
+        if profile not in PROFILES:
+            raise ValueError(f"unknown capacity profile: {profile!r}")
+        limits = PROFILES[profile]
+        self.profile = profile
+        self.max_users = limits['max_users'] if max_users is None else max_users
+        self.max_sessions = limits['max_sessions'] if max_sessions is None else max_sessions
+        self._tokens = TokenAllocator() if token_allocator is None else token_allocator
+        if self.max_sessions > self._tokens.size:
+            raise ValueError(f"max_sessions cannot exceed {self._tokens.size} "
+                             "(available 6-digit session tokens)")
+        user_rows = self.max_users if limits['preallocate'] else 0
+        session_rows = self.max_sessions if limits['preallocate'] else 0
+
+        if storage == 'dict':
+            # User database - fixed array (max 100 users in the legacy profile)
+            # Session table - fixed array (max 50 sessions in the legacy profile)
+            # Preallocated slots are INITIALIZEd lazily: each row dict is
+            # created on first use; growing tables start empty
+            self.user_table = LazyTable(BLANK_USER, user_rows)
+            self.session_table = LazyTable(BLANK_SESSION, session_rows)
+            self._field_width = None
+        elif storage in ('compact', 'mapped', 'columnar', 'cow'):
+            if password_hasher is not None:
+                raise ValueError(f"hashed passwords do not fit {storage} storage; use storage='dict'")
+            self._field_width = 20
+        else:
+            raise ValueError(f"unknown storage backend: {storage!r}")
+        self.storage = storage
 
         # Counters
         self.user_count = 0
         self.session_count = 0
 
-        # Status flags
+        # Table mutation listeners: listener(event, *details), see add_listener()
+        self._listeners = []
+
+        # Number of snapshot() views handed out (each view's version)
+        self._snapshot_version = 0
+
+        # Fixed-width record tables, in memory or mapped from the data file
+        self._store = None
+        if storage == 'compact':
+            self.user_table = user_record_table(user_rows)
+            self.session_table = session_record_table(session_rows)
+        elif storage == 'columnar':
+            self.user_table = column_table(USER_LAYOUT, user_rows)
+            self.session_table = column_table(SESSION_LAYOUT, session_rows)
+        elif storage == 'cow':
+            self.user_table = CowRecordTable(USER_LAYOUT, user_rows)
+            self.session_table = CowRecordTable(SESSION_LAYOUT, session_rows)
+        elif storage == 'mapped':
+            if data_file is None:
+                raise ValueError("mapped storage needs a data_file")
+            self._store = MappedStore(data_file, self.max_users, self.max_sessions,
+                                      sync, sync_interval, clock)
+            if (self.max_users > self._store.user_capacity
+                    or self.max_sessions > self._store.session_capacity):
+                self._store.close()
+                raise ValueError(f"{data_file} holds {self._store.user_capacity} users and "
+                                 f"{self._store.session_capacity} sessions; limits are larger")
+            self.user_table = self._store.user_table
+            self.session_table = self._store.session_table
+            self.user_count = self._store.user_count
+            self.session_count = self._store.session_count
+            self._listeners.append(self._store.on_event)
+
+        # Status flags (mirrors of the last call's flags; not kept in
+        # thread-safe mode, where each call has its own)
         self.ws_user_found = 0
         self.ws_success_flag = 0
 
+        # Locks: table-wide user lock for slot allocation and index rebuilds,
+        # username-hash stripes for row reads/updates, one session table lock
+        self.thread_safe = thread_safe
+        if thread_safe:
+            self._user_lock = threading.RLock()
+            self._session_lock = threading.RLock()
+            self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+        else:
+            self._user_lock = self._session_lock = nullcontext()
+            self._stripes = [self._user_lock]
+
+        # Username -> first slot holding it (same slot PERFORM VARYING
+        # USER-IDX would stop on). Names stored more than once can only come
+        # from direct table writes; all of their slots are kept separately.
+        # The index covers _user_index_count rows as of the user table's
+        # _user_index_generation (its count of user_name writes).
+        self._user_index = {}
+        self._user_dupes = {}
+        self._user_index_count = 0
+        self._user_index_generation = self.user_table.generation
+
+        # Token -> first active session slot (live tokens are in self._tokens),
+        # covering _session_index_count rows as of the session table's
+        # _session_index_generation (its count of session_token writes)
+        self._session_index = {}
+        self._session_index_count = 0
+        self._session_index_generation = self.session_table.generation
+
+        # Username -> set of its active session slots
+        self._user_sessions = {}
+        self.max_sessions_per_user = max_sessions_per_user
+
+        # Optional hashed-password mode
+        self._hasher = password_hasher
+        self._credential_cache = None
+        if password_hasher is not None:
+            if credential_cache is None:
+                credential_cache = CredentialCache()
+            self._credential_cache = credential_cache
+
+        # Opt-in session expiry: a timing wheel of (slot, generation) timers
+        # and a free list of reclaimed session slots
+        self.session_ttl = session_ttl
+        self._clock = clock
+        self._free_sessions = []
+        self._session_gen = {}
+        self._expiry_wheel = None
+        if session_ttl is not None:
+            self._expiry_wheel = TimingWheel(tick=min(1.0, session_ttl / 16), start=clock())
+            if self._store is not None:
+                self._restart_session_timers()
+
+        # Opt-in instrumentation: the transaction methods are wrapped on this
+        # instance only, so an uninstrumented system pays nothing for it
+        self._metrics = metrics
+        if metrics is not None:
+            for operation in ('register', 'login', 'update_password'):
+                setattr(self, operation, self._timed(operation, getattr(self, operation)))
+
     def display_welcome(self):
         """Display welcome banner"""
-        print("========================================")
-        print("   USER MANAGEMENT SYSTEM v1.0         ")
-        print("   LEGACY MAINFRAME APPLICATION        ")
-        print("========================================")
+        for line in WELCOME_LINES:
+            print(line)
 
     def display_menu(self):
         """Display main menu"""
-        print(" ")
-        print("MAIN MENU:")
-        print("1. REGISTER NEW USER")
-        print("2. LOGIN")
-        print("3. CHANGE PASSWORD")
-        print("4. EXIT")
-        choice = input("ENTER CHOICE (1-4): ")
+        for line in MENU_LINES:
+            print(line)
+        choice = input(CHOICE_PROMPT)
         return choice
 
-    def register_user(self):
-        """Register a new user"""
-        print("--- USER REGISTRATION ---")
-        ws_username = input("ENTER USERNAME: ")
-        ws_password = input("ENTER PASSWORD: ")
+    def register(self, username, password):
+        """Register a new user; returns a Result"""
+        ws_username = self._accept(username)
+        ws_password = self._accept(password)
+        if self._hasher is not None and self._find_user(ws_username) < 0:
+            # Run the KDF before taking the table lock
+            ws_password = self._hasher.hash(ws_password)
 
-        # Check if user already exists
-        self.ws_user_found = 0
-        for user_idx in range(self.user_count):
-            if self.user_table[user_idx]['user_name'] == ws_username:
-                self.ws_user_found = 1
-                break
+        with self._user_lock:
+            # Check if user already exists
+            ws_user_found = 0
+            if self._find_user(ws_username) >= 0:
+                ws_user_found = 1
+            self._post_flags(ws_user_found)
 
-        if self.ws_user_found == 1:
-            print("ERROR: USERNAME ALREADY EXISTS!")
-        else:
-            if self.user_count < 100:
+            if ws_user_found == 1:
+                return Result(USERNAME_EXISTS)
+            if self.user_count < self.max_users:
                 user_idx = self.user_count
-                self.user_table[user_idx]['user_name'] = ws_username
-                self.user_table[user_idx]['user_password'] = ws_password
-                self.user_table[user_idx]['user_active'] = 1
-                self.user_count += 1
-                print("SUCCESS: USER REGISTERED!")
-            else:
-                print("ERROR: USER DATABASE FULL!")
+                self._store_row(self.user_table, user_idx, {
+                    'user_name': ws_username,
+                    'user_password': ws_password,
+                    'user_active': 1
+                })
+                self._user_index[ws_username] = user_idx
+                self._user_index_count = user_idx + 1
+                self._user_index_generation = self.user_table.generation
+                self.user_count = user_idx + 1
+                if self._listeners:
+                    self._notify('user_added', user_idx, ws_username, ws_password)
+                return Result(USER_REGISTERED)
+            return Result(USER_DATABASE_FULL)
 
-    def login_user(self):
-        """Login a user"""
-        print("--- USER LOGIN ---")
-        ws_username = input("ENTER USERNAME: ")
-        ws_password = input("ENTER PASSWORD: ")
+    def register_many(self, rows):
+        """Register a batch of (username, password) pairs; returns a Result each
+
+        Same checks, order and outcomes as calling register() per pair (a
+        name repeated within the batch is USERNAME_EXISTS like any other),
+        but the user lock is taken once for the whole batch. A row may be a
+        (username, password, active) triple instead: active 0 stores the
+        account disabled (USER-ACTIVE = 0), as in an imported table image.
+        """
+        rows = [(self._accept(row[0]), self._accept(row[1]), row[2] if len(row) > 2 else 1)
+                for row in rows]
+        if self._hasher is not None:
+            # Run the KDF before taking the table lock, for names not yet taken
+            fresh = [i for i, row in enumerate(rows) if self._find_user(row[0]) < 0]
+            hashes = self._hasher.hash_many([rows[i][1] for i in fresh])
+            for i, stored in zip(fresh, hashes):
+                rows[i] = (rows[i][0], stored, rows[i][2])
+
+        results = []
+        ws_user_found = 0
+        with self._user_lock:
+            for ws_username, ws_password, ws_active in rows:
+                ws_user_found = 1 if self._find_user(ws_username) >= 0 else 0
+                if ws_user_found == 1:
+                    results.append(Result(USERNAME_EXISTS))
+                elif self.user_count < self.max_users:
+                    user_idx = self.user_count
+                    self._store_row(self.user_table, user_idx, {
+                        'user_name': ws_username,
+                        'user_password': ws_password,
+                        'user_active': ws_active
+                    })
+                    self._user_index[ws_username] = user_idx
+                    self._user_index_count = user_idx + 1
+                    self._user_index_generation = self.user_table.generation
+                    self.user_count = user_idx + 1
+                    if self._listeners:
+                        self._notify('user_added', user_idx, ws_username, ws_password)
+                        if ws_active != 1:
+                            self._notify('user_deactivated', user_idx, ws_username)
+                    results.append(Result(USER_REGISTERED))
+                else:
+                    results.append(Result(USER_DATABASE_FULL))
+            self._post_flags(ws_user_found)
+        return results
+
+    def login(self, username, password):
+        """Log a user in; returns a Result carrying the new session token"""
+        ws_username = self._accept(username)
+        ws_password = self._accept(password)
 
         # Verify credentials
-        self.ws_user_found = 0
-        for user_idx in range(self.user_count):
-            if self.user_table[user_idx]['user_name'] == ws_username:
-                if self.user_table[user_idx]['user_password'] == ws_password:
+        ws_user_found = 0
+        with self._user_stripe(ws_username):
+            for user_idx in self._user_slots(ws_username):
+                if self._password_matches(user_idx, ws_username, ws_password):
                     if self.user_table[user_idx]['user_active'] == 1:
-                        self.ws_user_found = 1
+                        ws_user_found = 1
                         break
+        self._post_flags(ws_user_found)
+
+        if ws_user_found == 0:
+            return Result(INVALID_CREDENTIALS)
 
-        if self.ws_user_found == 1:
+        with self._session_lock:
+            if self._expiry_wheel is not None:
+                self.expire_sessions()
+            if (self.max_sessions_per_user is not None
+                    and len(self._sessions_of(ws_username)) >= self.max_sessions_per_user):
+                return Result(SESSION_LIMIT_REACHED)
             ws_random_num = self.generate_token()
-            if self.session_count < 50:
+            if self._free_sessions:
+                sess_idx = self._free_sessions.pop()
+            elif self.session_count < self.max_sessions:
                 sess_idx = self.session_count
-                self.session_table[sess_idx]['session_token'] = ws_random_num
-                self.session_table[sess_idx]['session_user'] = ws_username
-                self.session_table[sess_idx]['session_active'] = 1
-                self.session_count += 1
-                print("SUCCESS: LOGIN APPROVED")
-                print(f"YOUR SESSION TOKEN: {self.session_table[sess_idx]['session_token']}")
             else:
-                print("ERROR: SESSION TABLE FULL!")
-        else:
-            print("ERROR: INVALID CREDENTIALS!")
+                return Result(SESSION_TABLE_FULL)
+
+            self._store_row(self.session_table, sess_idx, {
+                'session_token': ws_random_num,
+                'session_user': ws_username,
+                'session_active': 1
+            })
+            self._tokens.claim(ws_random_num)
+            self._session_index[ws_random_num] = sess_idx
+            self._session_index_generation = self.session_table.generation
+            self._user_sessions.setdefault(ws_username, set()).add(sess_idx)
+            if sess_idx == self.session_count:
+                self._session_index_count = sess_idx + 1
+                self.session_count = sess_idx + 1
+            if self._listeners:
+                self._notify('session_added', sess_idx, ws_random_num, ws_username)
+            if self._expiry_wheel is not None:
+                generation = self._session_gen.get(sess_idx, 0) + 1
+                self._session_gen[sess_idx] = generation
+                self._expiry_wheel.schedule(self._clock() + self.session_ttl, (sess_idx, generation))
+            return Result(LOGIN_APPROVED, self.session_table[sess_idx]['session_token'])
+
+    def update_password(self, token, old_password, new_password):
+        """Change the password of the user owning a session; returns a Result"""
+        ws_old_password = self._accept(old_password)
+        ws_new_password = self._accept(new_password)
+
+        # Validate session token
+        ws_user_found = 0
+        ws_temp_user = ''
+        with self._session_lock:
+            if self._expiry_wheel is not None:
+                self.expire_sessions()
+            sess_idx = self._find_session(token)
+            if sess_idx >= 0:
+                ws_temp_user = self.session_table[sess_idx]['session_user']
+                ws_user_found = 1
+
+        if ws_user_found == 0:
+            self._post_flags(ws_user_found)
+            return Result(INVALID_SESSION_TOKEN)
+
+        # Find user and verify old password
+        ws_success_flag = 0
+        ws_changed = False
+        with self._user_stripe(ws_temp_user):
+            user_idx = self._find_user(ws_temp_user)
+            if user_idx >= 0:
+                ws_success_flag = 1
+                if self._password_matches(user_idx, ws_temp_user, ws_old_password):
+                    if self._hasher is not None:
+                        ws_new_password = self._hasher.hash(ws_new_password)
+                        self._credential_cache.invalidate(ws_temp_user)
+                    self.user_table[user_idx]['user_password'] = ws_new_password
+                    ws_changed = True
+                    if self._listeners:
+                        self._notify('password_changed', user_idx, ws_temp_user, ws_new_password)
+        self._post_flags(ws_user_found, ws_success_flag)
+
+        if ws_success_flag == 0:
+            return Result(SESSION_USER_MISSING)
+        return Result(PASSWORD_CHANGED if ws_changed else OLD_PASSWORD_INCORRECT)
+
+    def display_result(self, result):
+        """Display the legacy screen text for a transaction result"""
+        for line in result.screen_lines():
+            print(line)
+
+    def register_user(self):
+        """Register a new user"""
+        print("--- USER REGISTRATION ---")
+        ws_username = input("ENTER USERNAME: ")
+        ws_password = input("ENTER PASSWORD: ")
+        self.display_result(self.register(ws_username, ws_password))
+
+    def login_user(self):
+        """Login a user"""
+        print("--- USER LOGIN ---")
+        ws_username = input("ENTER USERNAME: ")
+        ws_password = input("ENTER PASSWORD: ")
+        self.display_result(self.login(ws_username, ws_password))
 
     def change_password(self):
         """Change user password"""
@@ -115,37 +509,588 @@ class UserManagementSystem:
         ws_token = int(input("ENTER SESSION TOKEN: "))
         ws_old_password = input("ENTER OLD PASSWORD: ")
         ws_new_password = input("ENTER NEW PASSWORD: ")
+        self.display_result(self.update_password(ws_token, ws_old_password, ws_new_password))
 
-        # Validate session token
-        self.ws_user_found = 0
-        ws_temp_user = ''
-        for sess_idx in range(self.session_count):
-            if self.session_table[sess_idx]['session_token'] == ws_token:
-                if self.session_table[sess_idx]['session_active'] == 1:
-                    ws_temp_user = self.session_table[sess_idx]['session_user']
-                    self.ws_user_found = 1
-                    break
+    def add_listener(self, listener):
+        """Call listener(event, *details) after every table mutation
+
+        Events, fired while the table's lock is held (so listeners see them
+        in commit order) and after the row has been written:
+            'user_added'        user_idx, username, stored password
+            'user_deactivated'  user_idx, username (added with USER-ACTIVE = 0)
+            'password_changed'  user_idx, username, stored password
+            'session_added'     sess_idx, token, username
+            'session_ended'     sess_idx, token
+        Direct writes to user_table / session_table raise no events.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop calling a listener added with add_listener()"""
+        self._listeners.remove(listener)
+
+    def _notify(self, event, *details):
+        for listener in self._listeners:
+            listener(event, *details)
+
+    def flush(self):
+        """Force mapped storage to disk (no-op for in-memory storage)"""
+        if self._store is not None:
+            self._store.flush(self.user_count, self.session_count)
+
+    def close(self):
+        """Flush and release mapped storage; the system is unusable afterwards"""
+        if self._store is not None:
+            self._store.close(self.user_count, self.session_count)
+
+    @contextmanager
+    def exclusive(self):
+        """Hold every table lock: no transaction runs inside the block"""
+        with ExitStack() as stack:
+            for stripe in self._stripes:
+                stack.enter_context(stripe)
+            stack.enter_context(self._user_lock)
+            stack.enter_context(self._session_lock)
+            yield
+
+    def apply_event(self, event, *details):
+        """Re-apply a mutation published to listeners (journal replay)
+
+        Writes the rows exactly as the original transaction left them and
+        marks the indexes for a resync. Listeners are not called.
+        """
+        if event == 'user_added':
+            user_idx, ws_username, ws_password = details
+            self._store_row(self.user_table, user_idx, {
+                'user_name': ws_username,
+                'user_password': ws_password,
+                'user_active': 1
+            })
+            self.user_count = max(self.user_count, user_idx + 1)
+            self._user_index_count = -1
+        elif event == 'user_deactivated':
+            self.user_table[details[0]]['user_active'] = 0
+        elif event == 'password_changed':
+            user_idx, _, ws_password = details
+            self.user_table[user_idx]['user_password'] = ws_password
+        elif event == 'session_added':
+            sess_idx, token, ws_username = details
+            self._store_row(self.session_table, sess_idx, {
+                'session_token': token,
+                'session_user': ws_username,
+                'session_active': 1
+            })
+            self.session_count = max(self.session_count, sess_idx + 1)
+            self._session_index_count = -1
+        elif event == 'session_ended':
+            self.session_table[details[0]]['session_active'] = 0
+            self._session_index_count = -1
+        else:
+            raise ValueError(f"unknown table event: {event!r}")
+
+    def load_records(self, user_records=b'', session_records=b''):
+        """Append raw USER-ENTRY / SESSION-ENTRY records (compact storage bytes)
+
+        The fast path for dataset loads. Compact and mapped tables take the
+        bytes in one copy and columnar tables one column at a time; dict
+        tables decode them row by row. There are no
+        duplicate checks (the data is a table image, read the way the COBOL
+        program would hold it) and the indexes resync on the next lookup.
+        Both batches are checked (size, capacity, PIC 9 digits) before either
+        is written, so a ValueError leaves the tables as they were.
+        Listeners get user_added / session_added (and user_deactivated /
+        session_ended for inactive rows) per row;
+        a mapped data file instead gets one counter update and flush.
+        Returns (users loaded, sessions loaded).
+        """
+        loaded = []
+        with self.exclusive():
+            # Check both batches before writing either, so a rejected load
+            # leaves no rows behind
+            for table, layout, data, count, limit in (
+                    (self.user_table, USER_LAYOUT, user_records, self.user_count, self.max_users),
+                    (self.session_table, SESSION_LAYOUT, session_records, self.session_count,
+                     self.max_sessions)):
+                rows = RecordTable(layout, 0, buffer=data)
+                rows.size, extra = divmod(len(data), rows.record_length)
+                if extra:
+                    raise ValueError(f"not a whole number of {rows.record_length}-byte records")
+                if count + rows.size > limit:
+                    raise ValueError(f"{rows.size} records do not fit: {count} of {limit} slots used")
+                check_digits(layout, data)
+                loaded.append((table, data, count, rows))
+
+            for table, data, count, rows in loaded:
+                if hasattr(table, 'write_records'):
+                    table.write_records(count, data)
+                else:
+                    for idx in range(rows.size):
+                        self._store_row(table, count + idx, dict(rows[idx]))
+
+            users, sessions = loaded[0][3], loaded[1][3]
+            first_user, first_session = self.user_count, self.session_count
+            self.user_count += users.size
+            self.session_count += sessions.size
+            self._user_index_count = -1
+            self._session_index_count = -1
+            if self._expiry_wheel is not None:
+                self._restart_session_timers()
+            listeners = self._listeners
+            if self._store is not None:
+                self._store.flush(self.user_count, self.session_count)
+                listeners = [listener for listener in listeners if listener != self._store.on_event]
+            for listener in listeners:
+                for idx in range(users.size):
+                    entry = users[idx]
+                    listener('user_added', first_user + idx, entry['user_name'],
+                             entry['user_password'])
+                    if entry['user_active'] != 1:
+                        listener('user_deactivated', first_user + idx, entry['user_name'])
+                for idx in range(sessions.size):
+                    entry = sessions[idx]
+                    listener('session_added', first_session + idx, entry['session_token'],
+                             entry['session_user'])
+                    if entry['session_active'] != 1:
+                        listener('session_ended', first_session + idx, entry['session_token'])
+        return users.size, sessions.size
+
+    def save_snapshot(self, path):
+        """Write both tables to a snapshot file (see snapshot.py) for load_snapshot()
+
+        The tables are copied a column at a time while every lock is held
+        and written atomically afterwards. Returns (users saved, sessions saved).
+        """
+        with self.exclusive():
+            users, sessions = capture_columns(self)
+        write_columns(path, 0, users, sessions)
+        return len(users[0]), len(sessions[0])
+
+    def load_snapshot(self, path):
+        """Restore both tables from a save_snapshot() file into an empty system
+
+        Dict tables keep the snapshot's columns as they are and build each
+        row dict on first use; the other storages load the rows as
+        records. The indexes resync on the next lookup, listeners are not
+        called and active sessions start a fresh TTL.
+        Returns (users loaded, sessions loaded).
+        """
+        _, users, sessions = read_columns(path)
+        user_rows, session_rows = len(users[0]), len(sessions[0])
+        with self.exclusive():
+            if self.user_count or self.session_count:
+                raise ValueError("load_snapshot needs an empty system")
+            if user_rows > self.max_users or session_rows > self.max_sessions:
+                raise ValueError(f"snapshot holds {user_rows} users and {session_rows} sessions; "
+                                 f"limits are {self.max_users} and {self.max_sessions}")
+            if self.storage == 'dict':
+                self.user_table = LazyTable(BLANK_USER, len(self.user_table), columns=users)
+                self.session_table = LazyTable(BLANK_SESSION, len(self.session_table),
+                                               columns=sessions)
+            else:
+                for table, layout, columns in ((self.user_table, USER_LAYOUT, users),
+                                               (self.session_table, SESSION_LAYOUT, sessions)):
+                    table.write_records(0, b''.join(
+                        encode_field(kind, length, value)
+                        for row in zip(*columns)
+                        for (_, kind, length), value in zip(layout, row)))
+            self.user_count = user_rows
+            self.session_count = session_rows
+            self._user_index_count = -1
+            self._session_index_count = -1
+            if self._expiry_wheel is not None:
+                self._restart_session_timers()
+            if self._store is not None:
+                self._store.flush(self.user_count, self.session_count)
+        return user_rows, session_rows
+
+    def snapshot(self):
+        """Consistent read-only view of both tables for reporting (a TablesSnapshot)
+
+        With storage='cow' the view shares the table pages: transactions
+        pause only while the page lists are copied, and afterwards a writer
+        copies a page the first time it changes it while any view is open.
+        Other storages copy every row while all locks are held. Close the
+        view (or use it in a with block) when the scan is done. For a file
+        to restore from, see save_snapshot().
+        """
+        with self.exclusive():
+            self._snapshot_version += 1
+            if self.storage == 'cow':
+                users = self.user_table.freeze(self.user_count)
+                sessions = self.session_table.freeze(self.session_count)
+            else:
+                user_columns, session_columns = capture_columns(self)
+                users = FrozenColumns(USER_FIELDS, user_columns)
+                sessions = FrozenColumns(SESSION_FIELDS, session_columns)
+            return TablesSnapshot(self._snapshot_version, users, sessions)
+
+    def reindex(self):
+        """Rebuild the indexes after loading tables directly
+
+        Active sessions restored this way start a fresh TTL.
+        """
+        self.rebuild_user_index()
+        self.rebuild_session_index()
+        if self._expiry_wheel is not None:
+            self._restart_session_timers()
+
+    def _restart_session_timers(self):
+        """Give every active session without a timer a full TTL"""
+        deadline = self._clock() + self.session_ttl
+        if self._metrics is not None:
+            self._metrics.scanned('session_timer_restart', self.session_count)
+        for sess_idx in find_rows(self.session_table, self.session_count, session_active=1):
+            if sess_idx not in self._session_gen:
+                self._session_gen[sess_idx] = 1
+                self._expiry_wheel.schedule(deadline, (sess_idx, 1))
+
+    def _timed(self, operation, method):
+        """Wrap a transaction method to record its latency and outcome"""
+        metrics = self._metrics
+
+        def timed(*args):
+            started = time.perf_counter()
+            result = method(*args)
+            metrics.observe(operation, result.message or result.code, time.perf_counter() - started)
+            return result
+        return timed
+
+    def _post_flags(self, user_found, success_flag=None):
+        """Copy a call's flags to WS-USER-FOUND / WS-SUCCESS-FLAG (legacy mode)"""
+        if not self.thread_safe:
+            self.ws_user_found = user_found
+            if success_flag is not None:
+                self.ws_success_flag = success_flag
+
+    def _user_stripe(self, username):
+        """Lock guarding the user rows for username"""
+        return self._stripes[hash(username) % len(self._stripes)]
+
+    def _password_matches(self, user_idx, username, password):
+        """Check a candidate password against USER-PASSWORD (plaintext or hashed)"""
+        stored = self.user_table[user_idx]['user_password']
+        if self._hasher is None:
+            return stored == password
+        if not is_hashed(stored):
+            # Legacy plaintext row: upgrade it once the password is proven
+            if stored != password:
+                return False
+            stored = self._hasher.hash(password)
+            self.user_table[user_idx]['user_password'] = stored
+            if self._listeners:
+                self._notify('password_changed', user_idx, username, stored)
+            return True
+        if self._credential_cache.check(username, password, stored):
+            return True
+        if self._hasher.verify(stored, password):
+            self._credential_cache.remember(username, password, stored)
+            return True
+        return False
+
+    def hash_plaintext_passwords(self):
+        """Migrate every plaintext USER-PASSWORD to a KDF hash in one pass
+
+        Returns the number of rows hashed. The KDF work is spread over the
+        hasher's process pool when it has one.
+        """
+        if self._hasher is None:
+            raise ValueError("no password_hasher configured")
+        with self._user_lock:
+            slots = [user_idx for user_idx in range(self.user_count)
+                     if not is_hashed(self.user_table[user_idx]['user_password'])]
+            hashes = self._hasher.hash_many(
+                [self.user_table[user_idx]['user_password'] for user_idx in slots])
+            for user_idx, stored in zip(slots, hashes):
+                self.user_table[user_idx]['user_password'] = stored
+                if self._listeners:
+                    self._notify('password_changed', user_idx,
+                                 self.user_table[user_idx]['user_name'], stored)
+        return len(slots)
 
-        if self.ws_user_found == 0:
-            print("ERROR: INVALID SESSION TOKEN!")
+    def _store_row(self, table, idx, values):
+        """Write a row into a preallocated slot, or append it to a growing table"""
+        if idx < len(table):
+            entry = table[idx]
+            for field, value in values.items():
+                entry[field] = value
         else:
-            # Find user and verify old password
-            self.ws_success_flag = 0
-            for user_idx in range(self.user_count):
-                if self.user_table[user_idx]['user_name'] == ws_temp_user:
-                    if self.user_table[user_idx]['user_password'] == ws_old_password:
-                        self.user_table[user_idx]['user_password'] = ws_new_password
-                        self.ws_success_flag = 1
-                        print("SUCCESS: PASSWORD CHANGED!")
+            table.append(values)
+
+    def _accept(self, value):
+        """Fit an input value to the storage field width (COBOL ACCEPT)"""
+        if self._field_width is None:
+            return value
+        return fit_text(value, self._field_width)
+
+    def _find_user(self, username):
+        """Return the first slot holding username, or -1 if not registered
+
+        The index is rebuilt first if rows were added or any user_name was
+        written since it was built (including direct table writes).
+        """
+        if (self._user_index_count != self.user_count
+                or self._user_index_generation != self.user_table.generation):
+            with self._user_lock:
+                # Re-check: a registration may have been mid-update
+                if (self._user_index_count != self.user_count
+                        or self._user_index_generation != self.user_table.generation):
+                    self.rebuild_user_index()
+        user_idx = self._user_index.get(username, -1)
+        if self._metrics is not None:
+            self._metrics.scanned('user_lookup', 1)
+        return user_idx
+
+    def _user_slots(self, username):
+        """Return every slot holding username, in table order"""
+        user_idx = self._find_user(username)
+        if user_idx < 0:
+            return ()
+        return self._user_dupes.get(username) or (user_idx,)
+
+    def rebuild_user_index(self):
+        """Rebuild the username index from the raw user table"""
+        with self._user_lock:
+            user_count = self.user_count
+            generation = self.user_table.generation
+            dupes = {}
+            names = field_values(self.user_table, 'user_name', range(user_count))
+            index = dict(zip(names, range(user_count)))
+            if len(index) < user_count:
+                # Some name is stored twice: index its first slot, keep them all
+                index = {}
+                for user_idx, ws_username in enumerate(names):
+                    if ws_username in index:
+                        dupes.setdefault(ws_username, [index[ws_username]]).append(user_idx)
                     else:
-                        print("ERROR: OLD PASSWORD INCORRECT!")
-                        self.ws_success_flag = 1
-                    break
+                        index[ws_username] = user_idx
+            self._user_index = index
+            self._user_dupes = dupes
+            self._user_index_count = user_count
+            self._user_index_generation = generation
+            if self._metrics is not None:
+                self._metrics.scanned('user_index_rebuild', user_count)
+
+    def check_user_index(self):
+        """Compare the username index with the raw user table
+
+        Returns a list of problem descriptions; an empty list means the index
+        agrees with a linear scan of user_table. Lookups resync the index
+        after direct user_table writes, so a stale index shows up here only
+        until the next one.
+        """
+        problems = []
+        expected = {}
+        for user_idx in range(self.user_count):
+            expected.setdefault(self.user_table[user_idx]['user_name'], user_idx)
+
+        if self._user_index_count != self.user_count:
+            problems.append(f"index covers {self._user_index_count} rows, "
+                            f"user_count is {self.user_count}")
+        if self._user_index_generation != self.user_table.generation:
+            problems.append("user names were written since the index was built")
+        for ws_username, user_idx in expected.items():
+            indexed = self._user_index.get(ws_username)
+            if indexed != user_idx:
+                problems.append(f"{ws_username!r}: table slot {user_idx}, "
+                                f"index slot {indexed}")
+        for ws_username in self._user_index.keys() - expected.keys():
+            problems.append(f"{ws_username!r}: indexed but not in table")
+        return problems
+
+    def _session_index_stale(self):
+        """True if sessions were added or a session_token written since the last rebuild"""
+        return (self._session_index_count != self.session_count
+                or self._session_index_generation != self.session_table.generation)
+
+    def _find_session(self, token):
+        """Return the first active session slot holding token, or -1"""
+        if self._session_index_stale():
+            self.rebuild_session_index()
+        sess_idx = self._session_index.get(token, -1)
+        if sess_idx >= 0:
+            entry = self.session_table[sess_idx]
+            if entry['session_token'] != token or entry['session_active'] != 1:
+                # Row was rewritten behind the index's back
+                self.rebuild_session_index()
+                sess_idx = self._session_index.get(token, -1)
+        if self._metrics is not None:
+            self._metrics.scanned('session_lookup', 1)
+        return sess_idx
+
+    def rebuild_session_index(self):
+        """Rebuild the token index and live-token pool from the session table"""
+        with self._session_lock:
+            index = {}
+            generation = self.session_table.generation
+            self._tokens.reset()
+            user_sessions = {}
+            active = find_rows(self.session_table, self.session_count, session_active=1)
+            for sess_idx, token, ws_username in zip(
+                    active, field_values(self.session_table, 'session_token', active),
+                    field_values(self.session_table, 'session_user', active)):
+                if token not in index:
+                    index[token] = sess_idx
+                    self._tokens.claim(token)
+                user_sessions.setdefault(ws_username, set()).add(sess_idx)
+            self._session_index = index
+            self._user_sessions = user_sessions
+            self._session_index_count = self.session_count
+            self._session_index_generation = generation
+            if self._metrics is not None:
+                self._metrics.scanned('session_index_rebuild', self.session_count)
+            active = set(active)
+            if self._expiry_wheel is not None:
+                # Inactive slots are free for reuse, lowest first
+                self._free_sessions = [sess_idx for sess_idx in range(self.session_count - 1, -1, -1)
+                                       if sess_idx not in active]
+            else:
+                # Only slots ended through the API are reused; drop any
+                # reactivated by direct table writes
+                self._free_sessions = [sess_idx for sess_idx in self._free_sessions
+                                       if sess_idx < self.session_count and sess_idx not in active]
+
+    def expire_sessions(self, now=None):
+        """Deactivate sessions whose TTL has run out; returns how many ended
+
+        Runs automatically before each login and password change when a
+        session_ttl is set; call it from a timer to reclaim slots sooner.
+        """
+        if self._expiry_wheel is None:
+            return 0
+        now = self._clock() if now is None else now
+        expired = 0
+        with self._session_lock:
+            if self._session_index_stale():
+                self.rebuild_session_index()
+            for sess_idx, generation in self._expiry_wheel.advance(now):
+                if self._session_gen.get(sess_idx) != generation:
+                    continue    # slot was reused since this timer was set
+                if self.session_table[sess_idx]['session_active'] == 1:
+                    self._end_session(sess_idx)
+                    expired += 1
+        return expired
+
+    def _end_session(self, sess_idx):
+        """Deactivate a session and put its slot and token back in the pools"""
+        entry = self.session_table[sess_idx]
+        token = entry['session_token']
+        ws_username = entry['session_user']
+        entry['session_active'] = 0
+        if self._listeners:
+            self._notify('session_ended', sess_idx, token)
+        self._session_gen.pop(sess_idx, None)
+        if self._session_index.get(token) == sess_idx:
+            del self._session_index[token]
+            self._tokens.release(token)
+        slots = self._user_sessions.get(ws_username)
+        if slots is not None:
+            slots.discard(sess_idx)
+            if not slots:
+                del self._user_sessions[ws_username]
+        self._free_sessions.append(sess_idx)
+
+    def _sessions_of(self, username):
+        """Set of username's active session slots (call with the session lock held)"""
+        if self._session_index_stale():
+            self.rebuild_session_index()
+        slots = self._user_sessions.get(username, ())
+        for sess_idx in slots:
+            entry = self.session_table[sess_idx]
+            if entry['session_active'] != 1 or entry['session_user'] != username:
+                # Row was rewritten behind the index's back
+                self.rebuild_session_index()
+                return self._user_sessions.get(username, ())
+        return slots
+
+    def session_user(self, token):
+        """Username owning the active session token, or '' if no session holds it"""
+        with self._session_lock:
+            sess_idx = self._find_session(token)
+            return self.session_table[sess_idx]['session_user'] if sess_idx >= 0 else ''
+
+    def active_sessions(self):
+        """Return (token, username) for every active session, in slot order"""
+        with self._session_lock:
+            if self._metrics is not None:
+                self._metrics.scanned('active_session_list', self.session_count)
+            slots = find_rows(self.session_table, self.session_count, session_active=1)
+            return list(zip(field_values(self.session_table, 'session_token', slots),
+                            field_values(self.session_table, 'session_user', slots)))
+
+    def list_sessions(self, username):
+        """Return the tokens of username's active sessions, in slot order"""
+        ws_username = self._accept(username)
+        with self._session_lock:
+            slots = sorted(self._sessions_of(ws_username))
+            return field_values(self.session_table, 'session_token', slots)
+
+    def deactivate_user_sessions(self, username):
+        """End every active session of username (revoke); returns how many ended
+
+        Each session is ended as expiry would end it: 'session_ended' is
+        published and the slot and token become free for new logins. Only
+        the user's own slots are visited (per-user session index).
+        """
+        ws_username = self._accept(username)
+        with self._session_lock:
+            slots = sorted(self._sessions_of(ws_username))
+            for sess_idx in slots:
+                self._end_session(sess_idx)
+        return len(slots)
+
+    def count_active_users(self):
+        """Number of user rows with USER-ACTIVE = 1"""
+        with self._user_lock:
+            if self._metrics is not None:
+                self._metrics.scanned('active_user_count', self.user_count)
+            return count_rows(self.user_table, self.user_count, user_active=1)
+
+    def check_session_index(self):
+        """Compare the token index with the raw session table
+
+        Returns a list of problem descriptions; an empty list means the index
+        agrees with a linear scan of session_table.
+        """
+        problems = []
+        expected = {}
+        for sess_idx in range(self.session_count):
+            entry = self.session_table[sess_idx]
+            if entry['session_active'] == 1:
+                expected.setdefault(entry['session_token'], sess_idx)
+
+        if self._session_index_count != self.session_count:
+            problems.append(f"index covers {self._session_index_count} rows, "
+                            f"session_count is {self.session_count}")
+        if self._session_index_generation != self.session_table.generation:
+            problems.append("session tokens were written since the index was built")
+        for token, sess_idx in expected.items():
+            indexed = self._session_index.get(token)
+            if indexed != sess_idx:
+                problems.append(f"token {token}: table slot {sess_idx}, "
+                                f"index slot {indexed}")
+        for token in self._session_index.keys() - expected.keys():
+            problems.append(f"token {token}: indexed but not active in table")
+
+        expected_users = {}
+        for sess_idx in range(self.session_count):
+            entry = self.session_table[sess_idx]
+            if entry['session_active'] == 1:
+                expected_users.setdefault(entry['session_user'], set()).add(sess_idx)
+        for ws_username in expected_users.keys() | self._user_sessions.keys():
+            slots = expected_users.get(ws_username, set())
+            indexed = self._user_sessions.get(ws_username, set())
+            if indexed != slots:
+                problems.append(f"{ws_username!r}: session slots {sorted(slots)}, "
+                                f"index slots {sorted(indexed)}")
+        return problems
 
     def generate_token(self):
         """Generate a 6-digit session token (not cryptographically secure!)"""
-        # Simple pseudo-random number generation
-        ws_random_num = int(random.random() * 900000 + 100000)
+        # Pseudo-random draw from the tokens no live session holds
+        with self._session_lock:
+            if self._session_index_stale():
+                self.rebuild_session_index()
+            ws_random_num = self._tokens.draw()
         return ws_random_num
 
     def menu_loop(self):
@@ -169,6 +1114,61 @@ class UserManagementSystem:
         """Main entry point"""
         self.display_welcome()
         self.menu_loop()
+        self.flush()
+
+
+class MenuSession:
+    """Line-at-a-time menu driver with no terminal I/O of its own
+
+    Produces exactly the text the interactive program writes to stdout when
+    its input is piped in: start() returns the opening screen and each feed()
+    takes one input line and returns the output up to the next prompt.
+    """
+
+    def __init__(self, system):
+        self.system = system
+        self.closed = False
+        self.transactions = 0
+        self._screen = None
+        self._answers = []
+        self._menu_text = ''.join(line + '\n' for line in MENU_LINES) + CHOICE_PROMPT
+
+    def start(self, welcome=True):
+        """Return the opening screen, ending at the menu prompt"""
+        banner = ''.join(line + '\n' for line in WELCOME_LINES) if welcome else ''
+        return banner + self._menu_text
+
+    def feed(self, line):
+        """Consume one input line and return the resulting output text
+
+        A non-numeric session token raises ValueError, just as the
+        interactive change_password does.
+        """
+        if self.closed:
+            raise RuntimeError("menu session is closed")
+
+        if self._screen is None:
+            screen = TRANSACTION_SCREENS.get(line)
+            if screen is not None:
+                self._screen = screen
+                self._answers = []
+                return screen[0] + '\n' + screen[1][0]
+            if line == '4':
+                self.closed = True
+                return "SYSTEM SHUTDOWN...\n"
+            return "INVALID CHOICE. TRY AGAIN.\n" + self._menu_text
+
+        header, prompts, method = self._screen
+        if method == 'update_password' and not self._answers:
+            line = int(line)
+        self._answers.append(line)
+        if len(self._answers) < len(prompts):
+            return prompts[len(self._answers)]
+
+        result = getattr(self.system, method)(*self._answers)
+        self._screen = None
+        self.transactions += 1
+        return ''.join(text + '\n' for text in result.screen_lines()) + self._menu_text
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+"""
+PASSWORD HASHING - SALTED KDF STORAGE AND VERIFIED-CREDENTIAL CACHE
+Replaces the legacy plaintext USER-PASSWORD comparison (optional mode)
+
+Stored format:
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+(salt and hash are unpadded base64). Rows that do not use one of these
+formats are treated as legacy plaintext until migrated.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+KDF_PREFIXES = ('pbkdf2_sha256$', 'scrypt$')
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _derive(kdf, params, password, salt):
+    """Run the KDF (module-level so a process pool can pickle it)"""
+    if kdf == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * n * r * p + 1024 * 1024)
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+
+
+def _hash_one(kdf, params, password):
+    salt = os.urandom(16)
+    digest = _derive(kdf, params, password.encode('utf-8'), salt)
+    prefix = 'pbkdf2_sha256' if kdf == 'pbkdf2' else 'scrypt'
+    fields = [prefix] + [str(value) for value in params] + [_b64encode(salt), _b64encode(digest)]
+    return '$'.join(fields)
+
+
+def is_hashed(stored):
+    """True if stored is in one of the KDF formats"""
+    return stored.startswith(KDF_PREFIXES)
+
+
+class PasswordHasher:
+    """Salted PBKDF2-SHA256 or scrypt with configurable cost
+
+    pool, if given, is a concurrent.futures executor (normally a
+    ProcessPoolExecutor) that the KDF runs on, keeping the calling thread
+    free to release the GIL while it waits.
+    """
+
+    def __init__(self, kdf='pbkdf2', iterations=200_000, n=2 ** 14, r=8, p=1, pool=None):
+        if kdf not in ('pbkdf2', 'scrypt'):
+            raise ValueError(f"unknown KDF: {kdf!r}")
+        self.kdf = kdf
+        self.params = (n, r, p) if kdf == 'scrypt' else (iterations,)
+        self.pool = pool
+
+    def hash(self, password):
+        """Return the stored form of password with a fresh salt"""
+        if self.pool is not None:
+            return self.pool.submit(_hash_one, self.kdf, self.params, password).result()
+        return _hash_one(self.kdf, self.params, password)
+
+    def hash_many(self, passwords):
+        """Hash a list of passwords (spread across the pool when there is one)"""
+        if self.pool is not None:
+            return list(self.pool.map(_hash_one, [self.kdf] * len(passwords),
+                                      [self.params] * len(passwords), passwords,
+                                      chunksize=max(1, len(passwords) // 64)))
+        return [_hash_one(self.kdf, self.params, password) for password in passwords]
+
+    def verify(self, stored, password):
+        """Check password against a stored hash (cost taken from the hash)"""
+        fields = stored.split('$')
+        try:
+            if fields[0] == 'scrypt' and len(fields) == 6:
+                kdf, params = 'scrypt', tuple(int(value) for value in fields[1:4])
+            elif fields[0] == 'pbkdf2_sha256' and len(fields) == 4:
+                kdf, params = 'pbkdf2', (int(fields[1]),)
+            else:
+                return False
+            salt, expected = _b64decode(fields[-2]), _b64decode(fields[-1])
+        except ValueError:
+            return False
+
+        password = password.encode('utf-8')
+        if self.pool is not None:
+            digest = self.pool.submit(_derive, kdf, params, password, salt).result()
+        else:
+            digest = _derive(kdf, params, password, salt)
+        return hmac.compare_digest(digest, expected)
+
+
+class CredentialCache:
+    """Bounded LRU/TTL cache of recently verified credentials
+
+    Holds one entry per user: a keyed digest of the password that last
+    verified and the stored hash it verified against. A hit needs the same
+    password and an unchanged stored hash, so a changed or rewritten row
+    never produces a stale hit. The digest key is random per process, so
+    the cache contents cannot be replayed against another instance.
+    """
+
+    def __init__(self, max_entries=100_000, ttl=300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def check(self, username, password, stored):
+        """True if this (user, password) verified recently against stored"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                digest, cached_stored, expires = entry
+                if expires <= self._clock() or cached_stored != stored:
+                    del self._entries[username]
+                elif hmac.compare_digest(digest, self._digest(password)):
+                    self._entries.move_to_end(username)
+                    self.hits += 1
+                    return True
+            self.misses += 1
+            return False
+
+    def remember(self, username, password, stored):
+        """Record a successful verification"""
+        with self._lock:
+            self._entries[username] = (self._digest(password), stored, self._clock() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        """Forget any cached credential for username"""
+        with self._lock:
+            self._entries.pop(username, None)
@@ -0,0 +1,176 @@
+"""
+RECORD STORAGE - COMPACT FIXED-WIDTH TABLES
+Stores USER-TABLE and SESSION-TABLE rows exactly as laid out in legacy_app.cob
+"""
+
+from collections.abc import Mapping
+
+
+# Field layouts copied from the DATA DIVISION: (name, PIC class, length)
+USER_LAYOUT = (
+    ('user_name', 'X', 20),         # PIC X(20)
+    ('user_password', 'X', 20),     # PIC X(20)
+    ('user_active', '9', 1),        # PIC 9
+)
+
+SESSION_LAYOUT = (
+    ('session_token', '9', 6),      # PIC 9(6)
+    ('session_user', 'X', 20),      # PIC X(20)
+    ('session_active', '9', 1),     # PIC 9
+)
+
+# Characters are stored one byte each; anything outside Latin-1 becomes '?'
+TEXT_ENCODING = 'latin-1'
+
+_DIGITS = b'0123456789'
+
+
+def fit_text(value, length):
+    """Return value as a PIC X(length) field would hold it
+
+    MOVE/ACCEPT into PIC X truncates on the right and pads with spaces, and
+    COBOL compares alphanumerics as if the shorter side were space-padded,
+    so trailing spaces are not significant.
+    """
+    return value.encode(TEXT_ENCODING, 'replace')[:length].decode(TEXT_ENCODING).rstrip(' ')
+
+
+def encode_field(kind, length, value):
+    """Encode one field value to its fixed-width bytes"""
+    if kind == 'X':
+        return value.encode(TEXT_ENCODING, 'replace')[:length].ljust(length, b' ')
+    # PIC 9 keeps the low-order digits, like a numeric MOVE
+    return b'%0*d' % (length, abs(int(value)) % 10 ** length)
+
+
+def blank_record(layout):
+    """Bytes of a freshly INITIALIZEd record (spaces and zeros)"""
+    return b''.join(b' ' * length if kind == 'X' else b'0' * length
+                    for _, kind, length in layout)
+
+
+def check_digits(layout, data):
+    """Raise ValueError naming the first record whose PIC 9 fields hold a non-digit
+
+    Each digit position is checked across every record with one strided
+    slice, so no Python code runs per record unless one is bad.
+    """
+    record_length = sum(length for _, _, length in layout)
+    offset = 0
+    for name, kind, length in layout:
+        if kind == '9':
+            for column in range(offset, offset + length):
+                if bytes(data[column::record_length]).translate(None, _DIGITS):
+                    for record_no, value in enumerate(data[column::record_length], 1):
+                        if value not in _DIGITS:
+                            raise ValueError(f"record {record_no}: {name} is not numeric")
+        offset += length
+
+
+class RecordView(Mapping):
+    """Dict-style view of one record inside a RecordTable buffer"""
+
+    __slots__ = ('_table', '_offset')
+
+    def __init__(self, table, offset):
+        self._table = table
+        self._offset = offset
+
+    def __getitem__(self, field):
+        start, length, kind = self._table.fields[field]
+        start += self._offset
+        raw = self._table.buffer[start:start + length]
+        if kind == 'X':
+            return bytes(raw).decode(TEXT_ENCODING).rstrip(' ')
+        return int(raw)
+
+    def __setitem__(self, field, value):
+        table = self._table
+        start, length, kind = table.fields[field]
+        start += self._offset
+        table.buffer[start:start + length] = encode_field(kind, length, value)
+        if field == table.key_field:
+            table.generation += 1
+
+    def __contains__(self, field):
+        return field in self._table.fields
+
+    def __iter__(self):
+        return iter(self._table.fields)
+
+    def __len__(self):
+        return len(self._table.fields)
+
+    def __repr__(self):
+        return f"RecordView({dict(self)!r})"
+
+
+class RecordTable:
+    """Fixed-width records in one preallocated bytearray
+
+    Indexing returns a RecordView, so table[i]['user_name'] reads and writes
+    straight through to the underlying bytes. append() grows the buffer in
+    place (amortized O(1)); it fails while a record_bytes() view is held.
+    buffer, if given, is an existing writable buffer (e.g. an mmap) already
+    holding `size` records; such a table cannot grow. generation counts
+    writes to the key field (the layout's first) and write_records() calls.
+    """
+
+    def __init__(self, layout, size, buffer=None):
+        self.layout = layout
+        self.fields = {}
+        offset = 0
+        for name, kind, length in layout:
+            self.fields[name] = (offset, length, kind)
+            offset += length
+        self.record_length = offset
+        self.key_field = layout[0][0]
+        self.generation = 0
+        self.size = size
+        if buffer is None:
+            buffer = bytearray(blank_record(layout) * size)
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError("record index out of range")
+        return RecordView(self, idx * self.record_length)
+
+    def append(self, values):
+        """Add a record built from a field -> value mapping"""
+        self.buffer += b''.join(encode_field(kind, length, values[name])
+                                for name, kind, length in self.layout)
+        self.size += 1
+
+    def write_records(self, idx, data):
+        """Copy raw records into slots idx onwards in one move, growing the table if needed"""
+        count, extra = divmod(len(data), self.record_length)
+        if extra:
+            raise ValueError(f"data is not a whole number of {self.record_length}-byte records")
+        start = idx * self.record_length
+        if idx + count > self.size and not isinstance(self.buffer, bytearray):
+            raise ValueError("records do not fit the table")
+        self.buffer[start:start + len(data)] = data
+        self.generation += 1
+        self.size = max(self.size, idx + count)
+        return count
+
+    def record_bytes(self, idx):
+        """Raw bytes of record idx (a zero-copy memoryview)"""
+        start = idx * self.record_length
+        return memoryview(self.buffer)[start:start + self.record_length]
+
+
+def user_record_table(size=100):
+    """Compact USER-TABLE (41 bytes per USER-ENTRY)"""
+    return RecordTable(USER_LAYOUT, size)
+
+
+def session_record_table(size=50):
+    """Compact SESSION-TABLE (27 bytes per SESSION-ENTRY)"""
+    return RecordTable(SESSION_LAYOUT, size)
@@ -0,0 +1,293 @@
+"""
+RUN BENCHMARKS - Microbenchmark Suite
+Times the core operations at several table sizes and checks for regressions
+
+Each benchmark preloads a scaled-profile system with the requested number
+of users (and sessions), runs warmup batches, then times repeated batches.
+Results are per-operation median and p95 plus ops/sec. The transaction
+cores are timed directly; the interactive wrappers only add input()/print().
+journal_recovery times one full crash recovery of a journal holding
+`size` records (no snapshot), i.e. recovery time against journal length.
+
+The startup benchmarks time bringing up a dict-storage system of `size`
+users: startup_legacy preallocates `size` user and session slots as row
+dicts up front (the old constructor), startup_lazy preallocates the same
+slots lazily, and startup_snapshot restores `size` users and size // 10
+sessions with load_snapshot() and logs one user in, so it includes the
+user and session index builds the first lookup pays for.
+
+login_during_snapshot logs in on storage='cow' while a snapshot() view
+taken at the start of each batch stays open, so it includes the page
+copies writers make to keep the view consistent.
+
+Usage:
+    python run_benchmarks.py [--sizes 100,1000,10000,100000] [--only login_user]
+                             [--output results.json] [--baseline baseline.json]
+                             [--threshold 0.15]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import weakref
+
+from journal import Journal
+from modern_app import UserManagementSystem
+
+DEFAULT_SIZES = (100, 1_000, 10_000, 100_000)
+
+# name -> setup function(size) returning run(ops)
+BENCHMARKS = {}
+
+# name -> fixed operations per timed batch, for benchmarks whose single
+# operation is already large (default: --ops)
+BATCH_OPS = {}
+
+
+def benchmark(name, ops=None):
+    """Register a benchmark setup function under name"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        if ops is not None:
+            BATCH_OPS[name] = ops
+        return setup
+    return register
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def preloaded_system(users, sessions=0, storage='dict'):
+    """Scaled-profile system holding `users` users and `sessions` sessions"""
+    system = UserManagementSystem(storage=storage, profile='scaled')
+    for i in range(users):
+        system.register(f'user{i}', 'pw')
+    for i in range(sessions):
+        system.login(f'user{i % users}', 'pw')
+    return system
+
+
+@benchmark('register_user')
+def bench_register(size):
+    system = preloaded_system(size)
+    names = (f'new{i}' for i in itertools.count())
+
+    def run(ops):
+        for _ in range(ops):
+            system.register(next(names), 'pw')
+    return run
+
+
+@benchmark('login_user')
+def bench_login(size):
+    system = preloaded_system(size)
+    users = itertools.cycle([f'user{i}' for i in range(0, size, max(1, size // 1000))])
+
+    def run(ops):
+        for _ in range(ops):
+            system.login(next(users), 'pw')
+    return run
+
+
+@benchmark('login_during_snapshot')
+def bench_login_during_snapshot(size):
+    system = preloaded_system(size, storage='cow')
+    users = itertools.cycle([f'user{i}' for i in range(0, size, max(1, size // 1000))])
+
+    def run(ops):
+        # A reader holds a fresh view for the whole batch, so writes copy pages
+        with system.snapshot():
+            for _ in range(ops):
+                system.login(next(users), 'pw')
+    return run
+
+
+@benchmark('change_password')
+def bench_change_password(size):
+    system = preloaded_system(size, sessions=min(size, 10_000))
+    tokens = itertools.cycle([system.session_table[i]['session_token']
+                              for i in range(system.session_count)])
+
+    def run(ops):
+        for _ in range(ops):
+            system.update_password(next(tokens), 'pw', 'pw')
+    return run
+
+
+@benchmark('generate_token')
+def bench_generate_token(size):
+    system = preloaded_system(min(size, 1000), sessions=min(size, 100_000))
+
+    def run(ops):
+        for _ in range(ops):
+            system.generate_token()
+    return run
+
+
+@benchmark('journal_recovery', ops=1)
+def bench_journal_recovery(size):
+    directory = tempfile.mkdtemp()
+    system = UserManagementSystem(profile='scaled')
+    journal = Journal(directory, commit_window=0, fsync=False, wait_durable=False)
+    journal.attach(system)
+    users = max(1, size // 2)
+    for i in range(users):
+        system.register(f'user{i}', 'pw')
+    for i in range(size - users):
+        system.login(f'user{i % users}', 'pw')
+    journal.close()
+
+    def run(ops):
+        for _ in range(ops):
+            recovered = Journal(directory, fsync=False)
+            recovered.recover(UserManagementSystem(profile='scaled'))
+            recovered.close()
+    weakref.finalize(run, shutil.rmtree, directory, True)
+    return run
+
+
+def preallocated_system(size):
+    """Legacy-profile dict system with `size` user and session slots"""
+    return UserManagementSystem(profile='legacy', max_users=size,
+                                max_sessions=min(size, 900_000))
+
+
+@benchmark('startup_legacy', ops=1)
+def bench_startup_legacy(size):
+    def run(ops):
+        for _ in range(ops):
+            system = preallocated_system(size)
+            # Eager INITIALIZE: every slot gets its row dict at startup
+            for table in (system.user_table, system.session_table):
+                for _ in table:
+                    pass
+    return run
+
+
+@benchmark('startup_lazy', ops=1)
+def bench_startup_lazy(size):
+    def run(ops):
+        for _ in range(ops):
+            preallocated_system(size)
+    return run
+
+
+@benchmark('startup_snapshot', ops=1)
+def bench_startup_snapshot(size):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'tables.snap')
+    preloaded_system(size, sessions=size // 10).save_snapshot(path)
+
+    def run(ops):
+        for _ in range(ops):
+            system = UserManagementSystem(profile='scaled')
+            system.load_snapshot(path)
+            system.login('user0', 'pw')
+    weakref.finalize(run, shutil.rmtree, directory, True)
+    return run
+
+
+def measure(run, ops=1000, repeats=15, warmup=3):
+    """Time `repeats` batches of `ops` operations; returns per-op stats"""
+    for _ in range(warmup):
+        run(ops)
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run(ops)
+        samples.append((time.perf_counter() - started) / ops)
+    samples.sort()
+    median = percentile(samples, 50)
+    return {
+        'median_us': median * 1e6,
+        'p95_us': percentile(samples, 95) * 1e6,
+        'ops_per_sec': 1 / median if median > 0 else 0.0,
+        'ops': ops,
+        'repeats': repeats,
+    }
+
+
+def run_suite(names=None, sizes=DEFAULT_SIZES, ops=1000, repeats=15, warmup=3, log=None):
+    """Run the selected benchmarks at every size; returns the JSON report"""
+    results = {}
+    for name in names or BENCHMARKS:
+        for size in sizes:
+            key = f"{name}[{size}]"
+            results[key] = measure(BENCHMARKS[name](size), BATCH_OPS.get(name, ops),
+                                   repeats, warmup)
+            if log is not None:
+                stats = results[key]
+                log(f"{key:<32} median {stats['median_us']:9.2f} us   "
+                    f"p95 {stats['p95_us']:9.2f} us   {stats['ops_per_sec']:12,.0f} ops/s")
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sizes': list(sizes),
+        },
+        'results': results,
+    }
+
+
+def find_regressions(report, baseline, threshold):
+    """Benchmarks whose median is more than `threshold` slower than baseline"""
+    regressions = []
+    for key, stats in report['results'].items():
+        before = baseline.get('results', {}).get(key)
+        if before is None or before['median_us'] <= 0:
+            continue
+        change = stats['median_us'] / before['median_us'] - 1
+        if change > threshold:
+            regressions.append((key, before['median_us'], stats['median_us'], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the user management system")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="comma-separated table sizes")
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help="run only this benchmark (repeatable)")
+    parser.add_argument('--ops', type=int, default=1000, help="operations per timed batch")
+    parser.add_argument('--repeats', type=int, default=15)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help="write the JSON report here")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="allowed median slowdown before failing (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = run_suite(args.only, sizes, args.ops, args.repeats, args.warmup, log=print)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRESULTS WRITTEN TO {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.threshold)
+        for key, before, after, change in regressions:
+            print(f"REGRESSION: {key} {before:.2f} us -> {after:.2f} us (+{change:.0%})")
+        if regressions:
+            return 1
+        print(f"NO REGRESSIONS BEYOND {args.threshold:.0%} OF BASELINE")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
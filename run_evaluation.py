@@ -1,41 +1,58 @@
 """
 RUN EVALUATION - Test Runner
 Runs all behavior tests and displays results
+
+Test cases run in parallel worker processes and each one is timed. If the
+grader (evaluate_refactor.py) has already run the suite against unchanged
+sources, its cached results are shown instead of running it again.
+
+Usage:
+    python run_evaluation.py [--workers N] [--no-cache]
 """
 
-import unittest
+import argparse
 import sys
-from behavior_tests import TestUserManagementSystem
 
+from evaluate_refactor import EvaluationCache, behavior_test_results, summarize_tests
+
+STATUS = {'pass': 'ok', 'fail': 'FAIL', 'error': 'ERROR', 'skip': 'skipped'}
 
-def run_all_tests():
+
+def run_all_tests(workers=None, use_cache=True):
     # Run behavior tests with detailed output
     print("=" * 70)
     print("RUNNING BEHAVIOR TESTS")
     print("=" * 70)
     print("\n")
 
-    # Create test suite
-    loader = unittest.TestLoader()
-    suite = loader.loadTestsFromTestCase(TestUserManagementSystem)
-
-    # Run tests with verbose output
-    runner = unittest.TextTestRunner(verbosity=2)
-    result = runner.run(suite)
+    tests, cached = behavior_test_results(workers, EvaluationCache(enabled=use_cache))
+    for test in tests:
+        print(f"{test['description']} ... {STATUS[test['outcome']]} "
+              f"({test['seconds'] * 1000:.1f} ms)")
+    for test in tests:
+        if test['outcome'] in ('fail', 'error'):
+            print("\n" + "=" * 70)
+            print(f"{STATUS[test['outcome']]}: {test['id']}")
+            print("-" * 70)
+            print(test['detail'])
+    if cached:
+        print("\n(cached results: sources unchanged since the last run)")
 
     # Display test summary
+    summary = summarize_tests(tests)
     print("\n" + "=" * 70)
     print("BEHAVIOR TEST SUMMARY")
     print("=" * 70)
-    tests_run = result.testsRun
-    tests_passed = tests_run - len(result.failures) - len(result.errors)
-    tests_failed = len(result.failures)
-    tests_errors = len(result.errors)
+    tests_run = summary['total']
+    tests_passed = summary['passed']
+    tests_failed = summary['failed']
+    tests_errors = summary['errors']
 
     print(f"Total Tests: {tests_run}")
     print(f"Passed: {tests_passed}")
     print(f"Failed: {tests_failed}")
     print(f"Errors: {tests_errors}")
+    print(f"Test Time: {summary['seconds'] * 1000:.1f} ms")
     print("=" * 70)
 
     # Return exit code
@@ -43,5 +60,9 @@ def run_all_tests():
 
 
 if __name__ == '__main__':
-    exit_code = run_all_tests()
+    parser = argparse.ArgumentParser(description="Run the behavior tests")
+    parser.add_argument('--workers', type=int, help="test worker processes (default: CPU count)")
+    parser.add_argument('--no-cache', action='store_true', help="always re-run the tests")
+    args = parser.parse_args()
+    exit_code = run_all_tests(args.workers, not args.no_cache)
     sys.exit(exit_code)
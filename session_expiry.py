@@ -0,0 +1,85 @@
+"""
+SESSION EXPIRY - HIERARCHICAL TIMING WHEEL
+Schedules session deadlines with O(1) insert and amortized O(1) expiry
+"""
+
+import math
+
+
+class TimingWheel:
+    """Hierarchical timing wheel
+
+    Level 0 has one bucket per tick; each higher level has buckets covering
+    `slots` times the span of the level below. An entry is filed at the
+    lowest level whose span covers its deadline and is cascaded down one
+    level each time that level's bucket comes round, so scheduling is O(1)
+    and every entry is moved at most `levels` times before it fires.
+    Deadlines past the top level wait in an overflow list.
+
+    Entries fire on the first advance() at or after their deadline, at most
+    one tick late. Cancellation is left to the caller: fired items that are
+    no longer wanted are simply ignored.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=4, start=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []
+        self._current = math.floor(start / tick)
+        self._count = 0
+
+    def __len__(self):
+        """Number of scheduled entries (including ones the caller cancelled)"""
+        return self._count
+
+    def schedule(self, deadline, item):
+        """File item to fire once time reaches deadline"""
+        self._file(max(math.ceil(deadline / self.tick), self._current + 1), item)
+        self._count += 1
+
+    def _file(self, expiry_tick, item):
+        delta = expiry_tick - self._current
+        for level in range(self.levels):
+            if delta < self._spans[level + 1]:
+                bucket = (expiry_tick // self._spans[level]) % self.slots
+                self._wheels[level][bucket].append((expiry_tick, item))
+                return
+        self._overflow.append((expiry_tick, item))
+
+    def _cascade(self, level):
+        bucket_idx = (self._current // self._spans[level]) % self.slots
+        bucket = self._wheels[level][bucket_idx]
+        self._wheels[level][bucket_idx] = []
+        for expiry_tick, item in bucket:
+            self._file(expiry_tick, item)
+
+    def advance(self, now):
+        """Move the wheel to time now; returns the items that have expired"""
+        target = math.floor(now / self.tick)
+        expired = []
+        if self._count == 0:
+            self._current = max(self._current, target)
+            return expired
+
+        while self._current < target and self._count:
+            self._current += 1
+            # Pull higher-level buckets down as their turn comes round
+            if self._current % self._spans[self.levels] == 0 and self._overflow:
+                overflow, self._overflow = self._overflow, []
+                for expiry_tick, item in overflow:
+                    self._file(expiry_tick, item)
+            for level in range(self.levels - 1, 0, -1):
+                if self._current % self._spans[level] == 0:
+                    self._cascade(level)
+
+            bucket_idx = self._current % self.slots
+            bucket = self._wheels[0][bucket_idx]
+            if bucket:
+                self._wheels[0][bucket_idx] = []
+                self._count -= len(bucket)
+                expired.extend(item for _, item in bucket)
+        self._current = max(self._current, target)
+        return expired
@@ -0,0 +1,224 @@
+"""
+SHARDED DEPLOYMENT - ONE UserManagementSystem PER WORKER PROCESS
+Partitions users across N processes by username hash
+
+Each worker owns the users whose name hashes to it, plus the sessions those
+users open. Session tokens are drawn so that token % N is the owning shard,
+which lets change password go straight to the right worker. Requests travel
+over one Pipe per worker; submit_batch() sends every shard its share of a
+batch before waiting on any of them, so the shards work in parallel.
+
+Usage:
+    python sharded_app.py --benchmark [--max-shards N] [--ops 200000] [--batch 2000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+import zlib
+
+from modern_app import (INVALID_SESSION_TOKEN, PROFILES, Result, UserManagementSystem)
+from record_storage import fit_text
+from token_allocator import TokenAllocator
+
+# Transaction methods a worker will run on behalf of the router
+SHARD_METHODS = frozenset(['register', 'login', 'update_password'])
+
+
+def shard_tokens(shard, shards):
+    """Token allocator for one shard: tokens t in 100000-999999 with t % shards == shard"""
+    low = 100000
+    return TokenAllocator(low, 999999, stride=shards, offset=(shard - low) % shards)
+
+
+def _worker(conn, shard, shards, system_kwargs):
+    """Worker process: apply batches of (method, args) and send back results"""
+    tokens = shard_tokens(shard, shards)
+    system_kwargs = dict(system_kwargs)
+    limits = PROFILES[system_kwargs.get('profile', 'legacy')]
+    if system_kwargs.get('max_sessions') is None:
+        system_kwargs['max_sessions'] = min(limits['max_sessions'], tokens.size)
+    system = UserManagementSystem(token_allocator=tokens, **system_kwargs)
+
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        conn.send([getattr(system, method)(*args) for method, args in batch])
+    conn.close()
+
+
+class ShardedUserManagementSystem:
+    """Router over N worker processes, each running its own UserManagementSystem
+
+    Offers the same register/login/update_password calls as the single
+    process system. Capacity limits apply per shard. A router is meant to be
+    driven from one thread.
+    """
+
+    def __init__(self, shards=None, **system_kwargs):
+        self.shards = shards or os.cpu_count() or 1
+        self._field_width = 20 if system_kwargs.get('storage') == 'compact' else None
+        self._conns = []
+        self._workers = []
+        for shard in range(self.shards):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_worker, daemon=True,
+                                             args=(child_conn, shard, self.shards, system_kwargs))
+            worker.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop all workers"""
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self._workers:
+            worker.join(timeout=5)
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+        self._workers = []
+
+    def shard_for_user(self, username):
+        """Shard owning username (stable across processes and runs)"""
+        if self._field_width is not None:
+            username = fit_text(username, self._field_width)
+        return zlib.crc32(username.encode('utf-8', 'surrogatepass')) % self.shards
+
+    def shard_for_token(self, token):
+        """Shard that issued token"""
+        return token % self.shards
+
+    def _route(self, method, args):
+        if method not in SHARD_METHODS:
+            raise ValueError(f"not a shard transaction: {method!r}")
+        if method == 'update_password':
+            return self.shard_for_token(args[0])
+        return self.shard_for_user(args[0])
+
+    def submit_batch(self, operations):
+        """Run a list of (method, args) operations; returns results in order
+
+        Operations on the same shard run in submission order; operations on
+        different shards run concurrently.
+        """
+        per_shard = [[] for _ in range(self.shards)]
+        positions = [[] for _ in range(self.shards)]
+        for position, (method, args) in enumerate(operations):
+            shard = self._route(method, args)
+            per_shard[shard].append((method, args))
+            positions[shard].append(position)
+
+        for shard, batch in enumerate(per_shard):
+            if batch:
+                self._conns[shard].send(batch)
+        results = [None] * len(operations)
+        for shard, batch in enumerate(per_shard):
+            if batch:
+                for position, result in zip(positions[shard], self._conns[shard].recv()):
+                    results[position] = result
+        return results
+
+    def register(self, username, password):
+        """Register a new user on its shard; returns a Result"""
+        return self.submit_batch([('register', (username, password))])[0]
+
+    def login(self, username, password):
+        """Log a user in on its shard; returns a Result carrying the token"""
+        return self.submit_batch([('login', (username, password))])[0]
+
+    def update_password(self, token, old_password, new_password):
+        """Change a password on the shard that issued token; returns a Result"""
+        if not isinstance(token, int):
+            return Result(INVALID_SESSION_TOKEN)
+        return self.submit_batch([('update_password', (token, old_password, new_password))])[0]
+
+
+def mixed_workload(users, seed=1):
+    """Build (setup, next_batch) for the benchmark's mixed workload
+
+    setup registers `users` users. next_batch(size, tokens) returns the next
+    batch, drawing password changes from the recently issued tokens: 10%
+    registrations, 60% logins, 30% password changes.
+    """
+    rng = random.Random(seed)
+    setup = [('register', (f'user{i}', 'pw')) for i in range(users)]
+    next_user = [users]
+
+    def next_batch(size, tokens):
+        batch = []
+        for _ in range(size):
+            roll = rng.random()
+            if roll < 0.1:
+                batch.append(('register', (f'user{next_user[0]}', 'pw')))
+                next_user[0] += 1
+            elif roll < 0.7 or not tokens:
+                batch.append(('login', (f'user{rng.randrange(users)}', 'pw')))
+            else:
+                batch.append(('update_password', (rng.choice(tokens), 'pw', 'pw')))
+        return batch
+
+    return setup, next_batch
+
+
+def run_benchmark(shards, ops, batch_size, users=20000, seed=1):
+    """Ops/sec for the mixed workload on a given number of shards"""
+    setup, next_batch = mixed_workload(users, seed)
+    with ShardedUserManagementSystem(shards, profile='scaled') as system:
+        for start in range(0, len(setup), batch_size):
+            system.submit_batch(setup[start:start + batch_size])
+
+        tokens = []
+        done = 0
+        started = time.perf_counter()
+        while done < ops:
+            batch = next_batch(min(batch_size, ops - done), tokens)
+            for result in system.submit_batch(batch):
+                if result.token is not None:
+                    tokens.append(result.token)
+            del tokens[:-10000]
+            done += len(batch)
+        elapsed = time.perf_counter() - started
+    return ops / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded user management deployment")
+    parser.add_argument('--benchmark', action='store_true', help="measure throughput scaling")
+    parser.add_argument('--max-shards', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if not args.benchmark:
+        parser.print_help()
+        return 0
+
+    print(f"MIXED WORKLOAD: {args.ops} OPS, BATCH {args.batch} "
+          f"(10% REGISTER / 60% LOGIN / 30% CHANGE PASSWORD)")
+    print(f"{'SHARDS':>6} {'OPS/SEC':>12} {'SPEEDUP':>8} {'EFFICIENCY':>10}")
+    baseline = None
+    for shards in range(1, args.max_shards + 1):
+        rate = run_benchmark(shards, args.ops, args.batch)
+        baseline = baseline or rate
+        speedup = rate / baseline
+        print(f"{shards:>6} {rate:>12,.0f} {speedup:>7.2f}x {speedup / shards:>9.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+SNAPSHOT - COMPACT TABLE CHECKPOINTS
+Binary image of USER-TABLE and SESSION-TABLE tagged with a journal position
+
+Layout (column by column, so a restore decodes each column in one pass):
+    header   magic, journal LSN, USER-COUNT, SESSION-COUNT
+    users    names, passwords (text columns), USER-ACTIVE (one byte each)
+    sessions SESSION-TOKEN (uint32 each), users (text column), SESSION-ACTIVE
+    trailer  CRC-32 of everything above
+
+A text column is the character length of every value (uint32 each), the
+byte length of the text, then all values concatenated as UTF-8. Integers
+are little-endian. Files in the older row-by-row layout (UMSSNAP1) are
+still read.
+
+Snapshots are written to a temporary file, fsynced and renamed into place,
+so a reader sees either the previous snapshot or the complete new one.
+"""
+
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Sequence
+from itertools import accumulate
+
+from columnar_storage import field_values
+
+MAGIC = b'UMSSNAP2'
+HEADER = struct.Struct('<8sQQQ')
+TRAILER = struct.Struct('<I')
+_BLOB = struct.Struct('<Q')
+
+# Row-by-row layout of earlier snapshots
+MAGIC_V1 = b'UMSSNAP1'
+_LENGTH = struct.Struct('<H')
+_FLAG = struct.Struct('<B')
+_TOKEN = struct.Struct('<I')
+
+
+USER_FIELDS = ('user_name', 'user_password', 'user_active')
+SESSION_FIELDS = ('session_token', 'session_user', 'session_active')
+
+
+def capture(system):
+    """Copy the live rows of both tables (call with system.exclusive() held)"""
+    users, sessions = capture_columns(system)
+    return list(zip(*users)), list(zip(*sessions))
+
+
+def capture_columns(system):
+    """Copy the live rows of both tables a column at a time (see decode_columns)"""
+    users = [field_values(system.user_table, field, range(system.user_count))
+             for field in USER_FIELDS]
+    sessions = [field_values(system.session_table, field, range(system.session_count))
+                for field in SESSION_FIELDS]
+    return users, sessions
+
+
+def _uint32s(values):
+    column = array('I', values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _text_column(values):
+    blob = ''.join(values).encode('utf-8', 'surrogatepass')
+    return _uint32s(map(len, values)) + _BLOB.pack(len(blob)) + blob
+
+
+def encode(lsn, users, sessions):
+    """Snapshot bytes for captured rows"""
+    return encode_columns(lsn, [list(column) for column in zip(*users)] or [[], [], []],
+                          [list(column) for column in zip(*sessions)] or [[], [], []])
+
+
+def encode_columns(lsn, users, sessions):
+    """Snapshot bytes for (names, passwords, actives) and (tokens, users, actives) columns"""
+    names, passwords, user_active = users
+    tokens, session_users, session_active = sessions
+    data = b''.join([HEADER.pack(MAGIC, lsn, len(names), len(tokens)),
+                     _text_column(names), _text_column(passwords), bytes(user_active),
+                     _uint32s(tokens), _text_column(session_users), bytes(session_active)])
+    return data + TRAILER.pack(zlib.crc32(data))
+
+
+class _Reader:
+    """Sequential column reader over a snapshot body"""
+
+    def __init__(self, body, offset):
+        self.view = memoryview(body)
+        self.offset = offset
+
+    def take(self, size):
+        if self.offset + size > len(self.view):
+            raise ValueError("snapshot is truncated")
+        self.offset += size
+        return self.view[self.offset - size:self.offset]
+
+    def uint32s(self, count):
+        column = array('I')
+        column.frombytes(self.take(count * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    def flags(self, count):
+        return list(self.take(count))
+
+    def text(self, count):
+        lengths = self.uint32s(count)
+        (size,) = _BLOB.unpack(self.take(_BLOB.size))
+        return TextColumn(str(self.take(size), 'utf-8', 'surrogatepass'), lengths)
+
+
+class TextColumn(Sequence):
+    """A decoded text column: one string, sliced into a value on each read
+
+    Building a million small strings is most of the cost of a restore, so
+    values are only cut out of the column text when something reads them.
+    """
+
+    def __init__(self, text, lengths):
+        self._text = text
+        self._offsets = array('Q', accumulate(lengths, initial=0))
+        if self._offsets[-1] != len(text):
+            raise ValueError("snapshot text column is damaged")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        offsets = self._offsets
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            text = self._text
+            bounds = offsets[start:stop + 1] if stop > start else ()
+            return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("text column index out of range")
+        return self._text[offsets[idx]:offsets[idx + 1]]
+
+
+def decode_columns(data):
+    """(lsn, users, sessions) columns from snapshot bytes; ValueError if damaged
+
+    users is (names, passwords, actives) and sessions (tokens, users,
+    actives), one sequence per field: text columns are TextColumns, the
+    others lists of ints.
+    """
+    body = _check(data)
+    magic, lsn, user_count, session_count = HEADER.unpack_from(body)
+    if magic == MAGIC_V1:
+        _, users, sessions = _decode_v1(body)
+        return (lsn, [list(column) for column in zip(*users)] or [[], [], []],
+                [list(column) for column in zip(*sessions)] or [[], [], []])
+    if magic != MAGIC:
+        raise ValueError("not a snapshot file")
+    reader = _Reader(body, HEADER.size)
+    users = (reader.text(user_count), reader.text(user_count), reader.flags(user_count))
+    sessions = (reader.uint32s(session_count).tolist(), reader.text(session_count),
+                reader.flags(session_count))
+    return lsn, users, sessions
+
+
+def decode(data):
+    """(lsn, users, sessions) rows from snapshot bytes; ValueError if damaged"""
+    lsn, users, sessions = decode_columns(data)
+    return lsn, list(zip(*users)), list(zip(*sessions))
+
+
+def _check(data):
+    """Snapshot body with its checksum verified"""
+    if len(data) < HEADER.size + TRAILER.size:
+        raise ValueError("snapshot is truncated")
+    body, (crc,) = data[:-TRAILER.size], TRAILER.unpack(data[-TRAILER.size:])
+    if zlib.crc32(body) != crc:
+        raise ValueError("snapshot checksum mismatch")
+    return body
+
+
+def _decode_v1(body):
+    """(lsn, users, sessions) rows from a row-by-row UMSSNAP1 body"""
+    _, lsn, user_count, session_count = HEADER.unpack_from(body)
+    view = memoryview(body)
+    offset = HEADER.size
+
+    def text():
+        nonlocal offset
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size + length
+        return bytes(view[offset - length:offset]).decode('utf-8', 'surrogatepass')
+
+    def flag():
+        nonlocal offset
+        offset += _FLAG.size
+        return view[offset - 1]
+
+    users = []
+    for _ in range(user_count):
+        users.append((text(), text(), flag()))
+    sessions = []
+    for _ in range(session_count):
+        (token,) = _TOKEN.unpack_from(view, offset)
+        offset += _TOKEN.size
+        sessions.append((token, text(), flag()))
+    return lsn, users, sessions
+
+
+def write_snapshot(path, lsn, users, sessions):
+    """Atomically write a snapshot file of captured rows"""
+    _write(path, encode(lsn, users, sessions))
+
+
+def write_columns(path, lsn, users, sessions):
+    """Atomically write a snapshot file of captured columns"""
+    _write(path, encode_columns(lsn, users, sessions))
+
+
+def _write(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def read_snapshot(path):
+    """(lsn, users, sessions) rows from a snapshot file"""
+    with open(path, 'rb') as f:
+        return decode(f.read())
+
+
+def read_columns(path):
+    """(lsn, users, sessions) columns from a snapshot file (see decode_columns)"""
+    with open(path, 'rb') as f:
+        return decode_columns(f.read())
+
+
+def restore(system, users, sessions):
+    """Load captured rows into an empty system's tables"""
+    if len(users) > system.max_users or len(sessions) > system.max_sessions:
+        raise ValueError("snapshot holds more rows than the system's capacity limits")
+    for user_idx, (ws_username, ws_password, active) in enumerate(users):
+        system.apply_event('user_added', user_idx, ws_username, ws_password)
+        if active != 1:
+            system.user_table[user_idx]['user_active'] = active
+    for sess_idx, (token, ws_username, active) in enumerate(sessions):
+        system.apply_event('session_added', sess_idx, token, ws_username)
+        if active != 1:
+            system.apply_event('session_ended', sess_idx, token)
+
+
+def _fsync_directory(path):
+    """Make a rename in path durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
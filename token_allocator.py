@@ -0,0 +1,95 @@
+"""
+TOKEN ALLOCATOR
+Hands out session tokens that no live session is holding
+"""
+
+import random
+
+
+class TokenAllocator:
+    """Collision-free tokens in the legacy 6-digit range (100000-999999)
+
+    The token space is treated as a permutation split in two: positions
+    [0, free_count) hold free tokens, [free_count, size) hold live ones.
+    Only positions that were swapped away from their home token are stored,
+    so draw, claim and release are O(1) no matter how full the space is.
+
+    stride/offset restrict the space to every stride-th token starting at
+    low + offset, e.g. so that a token's value identifies its shard.
+    """
+
+    def __init__(self, low=100000, high=999999, stride=1, offset=0):
+        self.low = low
+        self.high = high
+        self.stride = stride
+        self.base = low + offset
+        self.size = max(0, (high - self.base) // stride + 1)
+        self.free_count = self.size
+
+        # Displaced entries only: position -> token and token -> position
+        self._pos_token = {}
+        self._token_pos = {}
+
+    def __len__(self):
+        """Number of live (claimed) tokens"""
+        return self.size - self.free_count
+
+    def _token_at(self, pos):
+        return self._pos_token.get(pos, self.base + pos * self.stride)
+
+    def _pos_of(self, token):
+        return self._token_pos.get(token, (token - self.base) // self.stride)
+
+    def _in_space(self, token):
+        return self.base <= token <= self.high and (token - self.base) % self.stride == 0
+
+    def _place(self, pos, token):
+        if token == self.base + pos * self.stride:
+            self._pos_token.pop(pos, None)
+            self._token_pos.pop(token, None)
+        else:
+            self._pos_token[pos] = token
+            self._token_pos[token] = pos
+
+    def _swap(self, pos_a, pos_b):
+        token_a = self._token_at(pos_a)
+        token_b = self._token_at(pos_b)
+        self._place(pos_a, token_b)
+        self._place(pos_b, token_a)
+
+    def draw(self):
+        """Return a random free token without claiming it"""
+        if self.free_count == 0:
+            raise RuntimeError("session token space exhausted")
+        return self._token_at(int(random.random() * self.free_count))
+
+    def is_live(self, token):
+        """True if token is currently claimed"""
+        if not self._in_space(token):
+            return False
+        return self._pos_of(token) >= self.free_count
+
+    def claim(self, token):
+        """Mark token as live; returns False if it was out of range or taken"""
+        if not self._in_space(token):
+            return False
+        pos = self._pos_of(token)
+        if pos >= self.free_count:
+            return False
+        self.free_count -= 1
+        self._swap(pos, self.free_count)
+        return True
+
+    def release(self, token):
+        """Return a live token to the free pool; False if it was not live"""
+        if not self.is_live(token):
+            return False
+        self._swap(self._pos_of(token), self.free_count)
+        self.free_count += 1
+        return True
+
+    def reset(self):
+        """Free every token"""
+        self.free_count = self.size
+        self._pos_token.clear()
+        self._token_pos.clear()
@@ -0,0 +1,279 @@
+"""
+WORKLOAD - SYNTHETIC TRAFFIC GENERATOR AND LOAD DRIVER
+Seeded transaction streams driven open-loop or closed-loop against the system
+
+The generator produces a reproducible stream of register / login / change
+password operations for a fixed population of users whose popularity
+follows a Zipf distribution. A configurable fraction of logins use a wrong
+password and of password changes use a token that was never issued.
+
+The driver runs the stream against an in-process UserManagementSystem:
+  closed  - `clients` threads, each issuing its next operation when the
+            previous one finishes (plus optional think time)
+  open    - operations are scheduled at a fixed arrival rate (Poisson) and
+            latency is measured from the scheduled start, so a backlog shows
+            up as latency instead of silently lowering the offered load
+
+Usage:
+    python workload.py [--users 10000] [--ops 100000] [--mix 10,70,20] [--zipf 1.1]
+                       [--bad-password 0.05] [--invalid-token 0.02]
+                       [--mode closed --clients 4 | --mode open --rate 20000]
+                       [--profile legacy] [--max-sessions-per-user N] [--preregister]
+                       [--audit FILE --audit-format jsonl --audit-policy block]
+                       [--seed 42] [--json FILE]
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+
+from audit_log import FORMATS, POLICIES, AuditLog
+from metrics import LatencyHistogram
+from modern_app import (MESSAGES, PROFILES, SESSION_LIMIT_REACHED, SESSION_TABLE_FULL,
+                        USER_DATABASE_FULL, UserManagementSystem)
+
+# Result codes that mean a capacity limit was hit
+CAPACITY_CODES = (USER_DATABASE_FULL, SESSION_TABLE_FULL, SESSION_LIMIT_REACHED)
+
+OPERATIONS = ('register', 'login', 'update_password')
+
+
+class ZipfSampler:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s"""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self._cumulative = list(itertools.accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+
+    def sample(self):
+        return bisect.bisect_left(self._cumulative, self.rng.random() * self._cumulative[-1])
+
+
+def generate_operations(users=10000, ops=100000, mix=(10, 70, 20), zipf=1.1,
+                        bad_password=0.05, invalid_token=0.02, seed=42):
+    """Yield `ops` operations as (kind, username, password, token_is_valid)
+
+    kind is one of OPERATIONS. For password changes the driver supplies the
+    user's latest token when token_is_valid, otherwise a never-issued one.
+    Password changes keep the password the same, so every user's password
+    stays predictable for the rest of the stream.
+    """
+    rng = random.Random(seed)
+    names = ZipfSampler(users, zipf, rng)
+    weights = list(itertools.accumulate(mix))
+    for _ in range(ops):
+        kind = OPERATIONS[bisect.bisect_right(weights, rng.random() * weights[-1])]
+        username = f'user{names.sample()}'
+        password = f'pw-{username}'
+        if kind == 'login' and rng.random() < bad_password:
+            password = 'wrong-password'
+        token_is_valid = not (kind == 'update_password' and rng.random() < invalid_token)
+        yield kind, username, password, token_is_valid
+
+
+class LoadReport:
+    """Latency histograms, outcome counts and a throughput time series"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.latency = LatencyHistogram()
+        self.by_operation = {kind: LatencyHistogram() for kind in OPERATIONS}
+        self.outcomes = {}
+        self.capacity_hits = {code: 0 for code in CAPACITY_CODES}
+        self.timeline = {}
+        self.started = None
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, kind, code, latency, finished):
+        with self._lock:
+            self.latency.record(latency)
+            self.by_operation[kind].record(latency)
+            self.outcomes[code] = self.outcomes.get(code, 0) + 1
+            if code in self.capacity_hits:
+                self.capacity_hits[code] += 1
+            second = int((finished - self.started) / self.interval)
+            self.timeline[second] = self.timeline.get(second, 0) + 1
+
+    def to_dict(self):
+        return {
+            'operations': self.latency.count,
+            'elapsed_s': self.elapsed,
+            'throughput_ops_s': self.latency.count / self.elapsed if self.elapsed else 0.0,
+            'latency': self.latency.summary(),
+            'latency_by_operation': {kind: hist.summary()
+                                     for kind, hist in self.by_operation.items()},
+            'outcomes': {MESSAGES[code] or code: count for code, count in self.outcomes.items()},
+            'capacity_hits': {MESSAGES[code]: count for code, count in self.capacity_hits.items()},
+            'throughput_timeline': [
+                {'t_s': second * self.interval, 'ops_s': count / self.interval}
+                for second, count in sorted(self.timeline.items())],
+        }
+
+
+class LoadDriver:
+    """Applies generated operations to a system and records the outcomes"""
+
+    # Never issued: below the 6-digit token range
+    INVALID_TOKEN = 99999
+
+    def __init__(self, system, report):
+        self.system = system
+        self.report = report
+        self._tokens = {}
+
+    def execute(self, operation, scheduled=None):
+        kind, username, password, token_is_valid = operation
+        started = time.perf_counter()
+        if kind == 'register':
+            result = self.system.register(username, password)
+        elif kind == 'login':
+            result = self.system.login(username, password)
+            if result.token is not None:
+                self._tokens[username] = result.token
+        else:
+            token = self._tokens.get(username, self.INVALID_TOKEN) if token_is_valid \
+                else self.INVALID_TOKEN
+            result = self.system.update_password(token, password, password)
+        finished = time.perf_counter()
+        latency = finished - (started if scheduled is None else scheduled)
+        self.report.add(kind, result.code, latency, finished)
+
+    def run_closed(self, operations, clients=1, think_time=0.0):
+        """Closed loop: each client sends its next operation after the last completes"""
+        feed = iter(operations)
+        feed_lock = threading.Lock()
+
+        def client():
+            while True:
+                with feed_lock:
+                    operation = next(feed, None)
+                if operation is None:
+                    return
+                self.execute(operation)
+                if think_time:
+                    time.sleep(think_time)
+
+        self._run_threads(client, clients)
+
+    def run_open(self, operations, rate, workers=4, seed=0):
+        """Open loop: Poisson arrivals at `rate` ops/sec served by `workers` threads"""
+        backlog = queue.Queue(maxsize=workers * 1000)
+        rng = random.Random(seed)
+
+        def worker():
+            while True:
+                item = backlog.get()
+                if item is None:
+                    return
+                scheduled, operation = item
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.execute(operation, scheduled)
+
+        def dispatcher():
+            scheduled = time.perf_counter()
+            for operation in operations:
+                scheduled += rng.expovariate(rate)
+                backlog.put((scheduled, operation))
+            for _ in range(workers):
+                backlog.put(None)
+
+        self._run_threads(worker, workers, dispatcher)
+
+    def _run_threads(self, target, count, extra=None):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        if extra is not None:
+            threads.append(threading.Thread(target=extra))
+        self.report.started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.report.elapsed = time.perf_counter() - self.report.started
+
+
+def preregister(system, users):
+    """Register the whole population with the generator's passwords"""
+    for i in range(users):
+        system.register(f'user{i}', f'pw-user{i}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic workload generator and load driver")
+    parser.add_argument('--users', type=int, default=10000, help="user population size")
+    parser.add_argument('--ops', type=int, default=100000)
+    parser.add_argument('--mix', default='10,70,20',
+                        help="register,login,change-password weights")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent for usernames")
+    parser.add_argument('--bad-password', type=float, default=0.05)
+    parser.add_argument('--invalid-token', type=float, default=0.02)
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--clients', type=int, default=1, help="closed-loop clients")
+    parser.add_argument('--think-time', type=float, default=0.0, help="closed-loop think time (s)")
+    parser.add_argument('--rate', type=float, default=10000.0, help="open-loop arrivals per second")
+    parser.add_argument('--workers', type=int, default=4, help="open-loop worker threads")
+    parser.add_argument('--profile', default='scaled', choices=sorted(PROFILES))
+    parser.add_argument('--session-ttl', type=float)
+    parser.add_argument('--max-sessions-per-user', type=int, help="per-user session cap")
+    parser.add_argument('--preregister', action='store_true', help="register all users first")
+    parser.add_argument('--audit', help="write an audit log of every transaction to this file")
+    parser.add_argument('--audit-format', choices=FORMATS, default='jsonl')
+    parser.add_argument('--audit-policy', choices=POLICIES, default='block',
+                        help="what a full audit queue does to transactions")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    mix = tuple(float(weight) for weight in args.mix.split(','))
+    random.seed(args.seed)
+    system = UserManagementSystem(profile=args.profile, session_ttl=args.session_ttl,
+                                  max_sessions_per_user=args.max_sessions_per_user,
+                                  thread_safe=True)
+    if args.preregister:
+        preregister(system, args.users)
+    audit = None
+    if args.audit:
+        audit = AuditLog(args.audit, args.audit_format, args.audit_policy)
+        audit.attach(system)
+
+    operations = generate_operations(args.users, args.ops, mix, args.zipf,
+                                     args.bad_password, args.invalid_token, args.seed)
+    report = LoadReport()
+    driver = LoadDriver(system, report)
+    if args.mode == 'closed':
+        driver.run_closed(operations, args.clients, args.think_time)
+    else:
+        driver.run_open(operations, args.rate, args.workers, args.seed)
+
+    result = report.to_dict()
+    if audit is not None:
+        audit.close()
+        result['audit'] = audit.stats()
+    latency = result['latency']
+    print(f"OPERATIONS: {result['operations']} IN {result['elapsed_s']:.2f}s "
+          f"({result['throughput_ops_s']:,.0f} OPS/S, {args.mode} loop)")
+    print(f"LATENCY ms: p50 {latency['p50_ms']:.3f}  p90 {latency['p90_ms']:.3f}  "
+          f"p99 {latency['p99_ms']:.3f}  p99.9 {latency['p999_ms']:.3f}  max {latency['max_ms']:.3f}")
+    for message, count in sorted(result['outcomes'].items()):
+        print(f"  {count:>9}  {message}")
+    for message, count in result['capacity_hits'].items():
+        print(f"CAPACITY LIMIT {message} HIT {count} TIMES")
+    if audit is not None:
+        print(f"AUDIT RECORDS: {result['audit']['written']} WRITTEN, "
+              f"{result['audit']['dropped']} DROPPED, {result['audit']['blocked']} BLOCKED")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())